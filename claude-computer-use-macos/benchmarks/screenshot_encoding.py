@@ -0,0 +1,111 @@
+"""
+Screenshot encoding latency and payload size per encoder setting.
+
+Each setting runs the path a screenshot takes before it is sent: a capture,
+the resize to the tool's target width, the encode, and the base64 of the
+encoded bytes. The capture is a live `pyautogui.screenshot()` unless an image
+file is given with --image; --synthetic draws a screen-like image (windows,
+text, a photo) when there is no display to capture.
+
+Run from the claude-computer-use-macos directory:
+
+    python -m benchmarks.screenshot_encoding --runs 5
+"""
+
+import argparse
+import base64
+import io
+import random
+import statistics
+import time
+
+from PIL import Image, ImageDraw
+
+from computer_use_demo.tools.computer import ImageFormat, ScreenshotEncoding
+
+MAX_WIDTH = 1280
+
+SETTINGS = [
+    ("png optimize (previous)", None),
+    ("png level 1", ScreenshotEncoding(ImageFormat.PNG, compress_level=1)),
+    ("png level 3", ScreenshotEncoding(ImageFormat.PNG, compress_level=3)),
+    ("png level 6", ScreenshotEncoding(ImageFormat.PNG, compress_level=6)),
+    ("jpeg q60", ScreenshotEncoding(ImageFormat.JPEG, quality=60)),
+    ("jpeg q80", ScreenshotEncoding(ImageFormat.JPEG, quality=80)),
+    ("jpeg q90", ScreenshotEncoding(ImageFormat.JPEG, quality=90)),
+    ("webp q60", ScreenshotEncoding(ImageFormat.WEBP, quality=60)),
+    ("webp q80", ScreenshotEncoding(ImageFormat.WEBP, quality=80)),
+]
+
+
+def synthetic_screen(width: int = 2880, height: int = 1800) -> Image.Image:
+    """A Retina-sized image with flat windows, lines of text and a noisy photo."""
+    rng = random.Random(0)
+    image = Image.new("RGB", (width, height), (236, 236, 236))
+    draw = ImageDraw.Draw(image)
+    for _ in range(6):
+        x, y = rng.randrange(width // 2), rng.randrange(height // 2)
+        w, h = rng.randrange(600, width // 2), rng.randrange(400, height // 2)
+        draw.rectangle((x, y, x + w, y + h), fill=(255, 255, 255), outline=(0, 0, 0))
+        draw.rectangle((x, y, x + w, y + 44), fill=(210, 210, 215))
+        for line in range(y + 60, y + h - 20, 28):
+            words = " ".join(
+                "".join(rng.choice("abcdefghij") for _ in range(rng.randrange(2, 9)))
+                for _ in range(w // 70)
+            )
+            draw.text((x + 12, line), words, fill=(20, 20, 20))
+    photo = Image.effect_noise((640, 420), 48).convert("RGB")
+    image.paste(photo, (width - 760, height - 540))
+    return image
+
+
+def _capture_function(path: str | None, synthetic: bool):
+    """Returns a function producing a fresh capture; files are only decoded once."""
+    if synthetic or path:
+        image = synthetic_screen() if synthetic else Image.open(path).convert("RGB")
+        return image.copy
+    import pyautogui
+
+    return pyautogui.screenshot
+
+
+def _encode(image: Image.Image, encoding: ScreenshotEncoding | None) -> bytes:
+    if encoding is not None:
+        return encoding.encode(image)
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG", optimize=True)
+    buffer.seek(0)
+    return buffer.read()
+
+
+def main(runs: int, path: str | None, synthetic: bool):
+    capture = _capture_function(path, synthetic)
+    print(f"{'setting':>24} {'ms (median)':>12} {'encoded KB':>11} {'base64 KB':>10}")
+    for name, encoding in SETTINGS:
+        timings = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            image = capture()
+            if image.width > MAX_WIDTH:
+                height = int(image.height * MAX_WIDTH / image.width)
+                image = image.resize((MAX_WIDTH, height))
+            data = _encode(image, encoding)
+            encoded = base64.b64encode(data)
+            timings.append(time.perf_counter() - start)
+        print(
+            f"{name:>24} {statistics.median(timings) * 1000:12.1f} "
+            f"{len(data) / 1024:11.1f} {len(encoded) / 1024:10.1f}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Screenshot encoding latency and payload size per setting."
+    )
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--image", help="encode this image instead of a capture")
+    parser.add_argument(
+        "--synthetic", action="store_true", help="encode a synthetic screen"
+    )
+    args = parser.parse_args()
+    main(args.runs, args.image, args.synthetic)
@@ -0,0 +1,284 @@
+"""
+Turn latency of the sampling loop against a local mock Messages API.
+
+Compares the previous request path (a new synchronous client on every turn and
+a blocking `create` call inside the event loop) with `sampling_loop` (one
+long-lived async client, streamed responses, tool calls started as soon as
+their tool_use block has streamed). Every mocked response streams some text, a
+tool_use block, more text and a second tool_use block; the tool sleeps to
+stand in for a computer action. A heartbeat task records the longest event
+loop stall of each run.
+
+Run from the claude-computer-use-macos directory:
+
+    python -m benchmarks.turn_latency --turns 10
+"""
+
+import argparse
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, cast
+
+from anthropic import Anthropic, AsyncAnthropic
+
+from computer_use_demo.loop import APIProvider, sampling_loop
+from computer_use_demo.tools import ToolCollection, ToolResult
+from computer_use_demo.tools.base import BaseAnthropicTool
+
+
+class SleepTool(BaseAnthropicTool):
+    """A tool that sleeps, standing in for a computer action."""
+
+    name = "sleep"
+
+    def to_params(self):
+        return {
+            "name": self.name,
+            "description": "Sleep for a number of milliseconds.",
+            "input_schema": {
+                "type": "object",
+                "properties": {"ms": {"type": "integer"}},
+            },
+        }
+
+    async def __call__(self, ms: int = 0, **kwargs):
+        await asyncio.sleep(ms / 1000)
+        return ToolResult(output=f"slept {ms} ms")
+
+
+def _sse(event: dict) -> bytes:
+    return f"event: {event['type']}\ndata: {json.dumps(event)}\n\n".encode()
+
+
+class _MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: "MockMessagesServer"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        turn = sum(1 for m in body["messages"] if m["role"] == "assistant")
+        events = self.server.events(turn)
+
+        if body.get("stream"):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for delay, event in events:
+                time.sleep(delay)
+                chunk = _sse(event)
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+                self.wfile.flush()
+            self.wfile.write(b"0\r\n\r\n")
+            self.wfile.flush()
+            return
+
+        time.sleep(sum(delay for delay, _ in events))
+        payload = json.dumps(self.server.message(turn)).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+class MockMessagesServer(ThreadingHTTPServer):
+    """A local Messages API that replays a fixed response for each turn."""
+
+    daemon_threads = True
+
+    def __init__(self, turns: int, token_delay: float, tokens: int, tool_ms: int):
+        super().__init__(("127.0.0.1", 0), _MockHandler)
+        self.turns = turns
+        self.token_delay = token_delay
+        self.tokens = tokens
+        self.tool_ms = tool_ms
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def blocks(self, turn: int) -> list[dict]:
+        text = {"type": "text", "text": "word " * self.tokens}
+        if turn >= self.turns:
+            return [text]
+        return [
+            text,
+            {
+                "type": "tool_use",
+                "id": f"toolu_{turn}_a",
+                "name": "sleep",
+                "input": {"ms": self.tool_ms},
+            },
+            text,
+            {
+                "type": "tool_use",
+                "id": f"toolu_{turn}_b",
+                "name": "sleep",
+                "input": {"ms": self.tool_ms},
+            },
+        ]
+
+    def message(self, turn: int) -> dict:
+        return {
+            "id": f"msg_{turn}",
+            "type": "message",
+            "role": "assistant",
+            "model": "mock",
+            "content": self.blocks(turn),
+            "stop_reason": "end_turn" if turn >= self.turns else "tool_use",
+            "stop_sequence": None,
+            "usage": {"input_tokens": 1, "output_tokens": 1},
+        }
+
+    def events(self, turn: int) -> list[tuple[float, dict]]:
+        message = self.message(turn)
+        events: list[tuple[float, dict]] = [
+            (0.0, {"type": "message_start", "message": {**message, "content": []}})
+        ]
+        for index, block in enumerate(message["content"]):
+            if block["type"] == "text":
+                start = {"type": "text", "text": ""}
+                deltas = [
+                    {"type": "text_delta", "text": "word "} for _ in range(self.tokens)
+                ]
+            else:
+                start = {**block, "input": {}}
+                deltas = [
+                    {
+                        "type": "input_json_delta",
+                        "partial_json": json.dumps(block["input"]),
+                    }
+                ]
+            events.append(
+                (
+                    0.0,
+                    {
+                        "type": "content_block_start",
+                        "index": index,
+                        "content_block": start,
+                    },
+                )
+            )
+            events.extend(
+                (
+                    self.token_delay,
+                    {"type": "content_block_delta", "index": index, "delta": delta},
+                )
+                for delta in deltas
+            )
+            events.append((0.0, {"type": "content_block_stop", "index": index}))
+        events.append(
+            (
+                0.0,
+                {
+                    "type": "message_delta",
+                    "delta": {
+                        "stop_reason": message["stop_reason"],
+                        "stop_sequence": None,
+                    },
+                    "usage": {"output_tokens": 1},
+                },
+            )
+        )
+        events.append((0.0, {"type": "message_stop"}))
+        return events
+
+
+async def _heartbeat(stalls: list[float], interval: float = 0.005):
+    """Record how much later than scheduled each tick of the event loop runs."""
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        stalls.append(time.perf_counter() - start - interval)
+
+
+async def _legacy_loop(base_url: str, messages: list, tools: ToolCollection):
+    """The previous loop: a new client per turn and a blocking create call."""
+    while True:
+        client = Anthropic(api_key="mock", base_url=base_url)
+        raw_response = client.beta.messages.with_raw_response.create(
+            max_tokens=1024,
+            messages=messages,
+            model="mock",
+            tools=tools.to_params(),
+            betas=["computer-use-2024-10-22"],
+        )
+        response = raw_response.parse()
+        messages.append({"role": "assistant", "content": response.content})
+        tool_result_content = []
+        for block in response.content:
+            if block.type == "tool_use":
+                result = await tools.run(
+                    name=block.name, tool_input=cast(dict[str, Any], block.input)
+                )
+                tool_result_content.append(
+                    {
+                        "type": "tool_result",
+                        "tool_use_id": block.id,
+                        "content": result.output,
+                    }
+                )
+        if not tool_result_content:
+            return messages
+        messages.append({"role": "user", "content": tool_result_content})
+
+
+async def _measure(name: str, run, turns: int):
+    stalls: list[float] = []
+    heartbeat = asyncio.create_task(_heartbeat(stalls))
+    start = time.perf_counter()
+    await run()
+    elapsed = time.perf_counter() - start
+    heartbeat.cancel()
+    print(
+        f"{name:>10}: {elapsed / (turns + 1) * 1000:8.1f} ms/turn, "
+        f"max event loop stall {max(stalls, default=0.0) * 1000:8.1f} ms"
+    )
+
+
+async def main(turns: int, token_delay: float, tokens: int, tool_ms: int):
+    server = MockMessagesServer(turns, token_delay, tokens, tool_ms)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    tools = ToolCollection(SleepTool())
+
+    def new_messages() -> list:
+        return [{"role": "user", "content": "Sleep a few times."}]
+
+    await _measure(
+        "legacy", lambda: _legacy_loop(server.base_url, new_messages(), tools), turns
+    )
+
+    async def streamed():
+        await sampling_loop(
+            model="mock",
+            provider=APIProvider.ANTHROPIC,
+            system_prompt_suffix="",
+            messages=new_messages(),
+            output_callback=lambda block: None,
+            tool_output_callback=lambda result, tool_use_id: None,
+            api_response_callback=lambda response: None,
+            api_key="mock",
+            client=AsyncAnthropic(api_key="mock", base_url=server.base_url),
+            tool_collection=tools,
+            prompt_caching=False,
+        )
+
+    await _measure("streamed", streamed, turns)
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--turns", type=int, default=10)
+    parser.add_argument("--token-delay", type=float, default=0.005)
+    parser.add_argument("--tokens", type=int, default=40)
+    parser.add_argument("--tool-ms", type=int, default=150)
+    args = parser.parse_args()
+    asyncio.run(main(args.turns, args.token_delay, args.tokens, args.tool_ms))
@@ -0,0 +1,310 @@
+"""
+Message history of the sampling loop, indexed so that it can be trimmed without
+rescanning every message on every turn.
+"""
+
+import hashlib
+import json
+from collections import deque
+from collections.abc import Awaitable, Callable
+from typing import Any
+
+from anthropic.types.beta import BetaMessageParam
+
+from .tools.images import ImageHandle
+
+# Local token estimates: about four characters of text per token, and a
+# screenshot of up to 1280x800 pixels costs about (width * height) / 750 tokens
+CHARS_PER_TOKEN = 4
+IMAGE_TOKENS = 1400
+
+# Length of each elided tool result in the text handed to the summarizer
+SUMMARY_RESULT_CHARS = 300
+
+
+def _block_fields(block: Any) -> dict[str, Any]:
+    """A content block as a dict, whether it is a param dict or a response object."""
+    return block if isinstance(block, dict) else block.model_dump()
+
+
+def _result_items(tool_result: dict[str, Any]) -> list[dict[str, Any]]:
+    """The content blocks of a tool result, whose content may also be a string."""
+    content = tool_result.get("content") or []
+    if isinstance(content, str):
+        return [{"type": "text", "text": content}]
+    return content
+
+
+def estimate_tokens(message: BetaMessageParam) -> int:
+    """A rough count of the tokens of a message, leaving out its images."""
+    content = message["content"]
+    if isinstance(content, str):
+        return len(content) // CHARS_PER_TOKEN + 1
+    chars = 0
+    for block in map(_block_fields, content):
+        if block["type"] == "text":
+            chars += len(block["text"])
+        elif block["type"] == "tool_use":
+            chars += len(json.dumps(block["input"]))
+        elif block["type"] == "tool_result":
+            chars += sum(len(item.get("text", "")) for item in _result_items(block))
+    return chars // CHARS_PER_TOKEN + 1
+
+
+def render_messages(messages: list[BetaMessageParam]) -> str:
+    """A plain text transcript of messages, to be summarized."""
+    lines = []
+    for message in messages:
+        content = message["content"]
+        if isinstance(content, str):
+            lines.append(f"{message['role']}: {content}")
+            continue
+        for block in map(_block_fields, content):
+            if block["type"] == "text":
+                lines.append(f"{message['role']}: {block['text']}")
+            elif block["type"] == "tool_use":
+                lines.append(f"action: {block['name']} {json.dumps(block['input'])}")
+            elif block["type"] == "tool_result":
+                for item in _result_items(block):
+                    if item.get("type") == "text":
+                        lines.append(f"result: {item['text'][:SUMMARY_RESULT_CHARS]}")
+                    elif item.get("type") == "image":
+                        lines.append("result: [screenshot]")
+    return "\n".join(lines)
+
+
+def elide(transcript: str) -> str:
+    """The summary used without a summarizer: the actions that were taken."""
+    actions = [line for line in transcript.splitlines() if line.startswith("action: ")]
+    return "Earlier actions, in order:\n" + "\n".join(actions)
+
+
+class ConversationState:
+    """
+    The messages of a conversation plus an index of the images in its tool
+    results, oldest first.
+
+    `messages` is the caller's list and is updated in place. Messages must be
+    added with `append` to be indexed, and tool result contents must not be
+    replaced behind the state's back.
+
+    Image blocks may hold an ImageHandle as their data; `api_messages` resolves
+    them to base64 for a request, and pruned images are released from their
+    store. Handles are only meant to live while the state does: call
+    `resolve_images` before the messages are handed back to the caller.
+
+    The state also keeps an estimate of the conversation's size in tokens, see
+    `compact`. summary_cache maps summarizer inputs to their summaries and may
+    be shared between conversations.
+    """
+
+    messages: list[BetaMessageParam]
+    _images: deque[tuple[dict[str, Any], dict[str, Any]]]
+
+    def __init__(
+        self,
+        messages: list[BetaMessageParam],
+        summary_cache: dict[str, str] | None = None,
+    ):
+        self.messages = messages
+        self._images = deque()
+        self._tokens: list[int] = []
+        self._task: BetaMessageParam | None = None
+        self._summary = ""
+        self.summary_cache = {} if summary_cache is None else summary_cache
+        for message in messages:
+            self._index(message)
+
+    def append(self, message: BetaMessageParam):
+        """Append a message to the conversation and index its images."""
+        self.messages.append(message)
+        self._index(message)
+
+    @property
+    def image_count(self) -> int:
+        return len(self._images)
+
+    @property
+    def token_count(self) -> int:
+        """Estimated input tokens of the conversation, images included."""
+        return sum(self._tokens) + len(self._images) * IMAGE_TOKENS
+
+    def _index(self, message: BetaMessageParam):
+        self._tokens.append(estimate_tokens(message))
+        content = message["content"]
+        if not isinstance(content, list):
+            return
+        for item in content:
+            if not isinstance(item, dict) or item.get("type") != "tool_result":
+                continue
+            for block in item.get("content", []):
+                if isinstance(block, dict) and block.get("type") == "image":
+                    self._images.append((item, block))
+
+    def prune_images(self, images_to_keep: int, min_removal_threshold: int = 10):
+        """
+        With the assumption that images are screenshots that are of diminishing
+        value as the conversation progresses, remove all but the final
+        `images_to_keep` tool_result images in place.
+
+        Images are only removed in chunks of `min_removal_threshold`, so the
+        message prefix, and with it the prompt cache, only changes once every
+        `min_removal_threshold` new images. Takes time proportional to the
+        number of images removed.
+        """
+        images_to_remove = len(self._images) - images_to_keep
+        # for better cache behavior, we want to remove in chunks
+        images_to_remove -= images_to_remove % min_removal_threshold
+
+        for _ in range(max(images_to_remove, 0)):
+            tool_result, image = self._images.popleft()
+            content = tool_result["content"]
+            del content[next(i for i, block in enumerate(content) if block is image)]
+            data = image.get("source", {}).get("data")
+            if isinstance(data, ImageHandle):
+                data.release()
+
+    async def compact(
+        self,
+        token_budget: int,
+        keep_last_turns: int = 4,
+        summarize: Callable[[str], Awaitable[str]] | None = None,
+        target_ratio: float = 0.5,
+    ) -> bool:
+        """
+        When the conversation is estimated above token_budget, replace its oldest
+        turns (assistant message and tool results) with a summary appended to the
+        first message, until it is under target_ratio of the budget. The last
+        keep_last_turns turns always stay verbatim. Returns whether anything was
+        compacted.
+
+        The summary extends the previous one with the removed turns, through
+        summarize or, without it, as the list of actions they took. Compacting
+        well below the budget means it happens once every several turns, which
+        also keeps the prompt cache valid in between.
+        """
+        if self.token_count <= token_budget or len(self.messages) < 2:
+            return False
+        turn_starts = [
+            i for i, m in enumerate(self.messages) if i > 0 and m["role"] == "assistant"
+        ]
+        if len(turn_starts) <= keep_last_turns:
+            return False
+        candidates = turn_starts[1 : len(turn_starts) - keep_last_turns + 1]
+        target = token_budget * target_ratio
+        cut = candidates[-1]
+        image_tokens = self._image_tokens_after()
+        for candidate in candidates:
+            if sum(self._tokens[candidate:]) + image_tokens[candidate] <= target:
+                cut = candidate
+                break
+
+        removed = self.messages[1:cut]
+        transcript = render_messages(removed)
+        if self._summary:
+            transcript = (
+                f"Summary of the turns before:\n{self._summary}\n\n{transcript}"
+            )
+        key = hashlib.sha256(transcript.encode()).hexdigest()
+        if key not in self.summary_cache:
+            self.summary_cache[key] = (
+                await summarize(transcript) if summarize else elide(transcript)
+            )
+        self._summary = self.summary_cache[key]
+
+        removed_results = {
+            id(block)
+            for message in removed
+            if isinstance(message["content"], list)
+            for block in message["content"]
+            if isinstance(block, dict)
+        }
+        while self._images and id(self._images[0][0]) in removed_results:
+            _, image = self._images.popleft()
+            data = image.get("source", {}).get("data")
+            if isinstance(data, ImageHandle):
+                data.release()
+
+        self._task = self._task or self.messages[0]
+        task_content = self._task["content"]
+        if isinstance(task_content, str):
+            task_content = [{"type": "text", "text": task_content}]
+        first: BetaMessageParam = {
+            "role": "user",
+            "content": [
+                *task_content,
+                {
+                    "type": "text",
+                    "text": "Earlier turns of this conversation were removed. "
+                    f"<earlier_turns>\n{self._summary}\n</earlier_turns>",
+                },
+            ],
+        }
+        self.messages[:cut] = [first]
+        self._tokens[:cut] = [estimate_tokens(first)]
+        return True
+
+    def _image_tokens_after(self) -> list[int]:
+        """Estimated image tokens from each message index to the end."""
+        owner = {}
+        for index, message in enumerate(self.messages):
+            if isinstance(message["content"], list):
+                for block in message["content"]:
+                    owner[id(block)] = index
+        counts = [0] * (len(self.messages) + 1)
+        for tool_result, _ in self._images:
+            counts[owner[id(tool_result)]] += IMAGE_TOKENS
+        for index in range(len(self.messages) - 1, -1, -1):
+            counts[index] += counts[index + 1]
+        return counts
+
+    def resolve_images(self):
+        """
+        Replace the image handles in the messages with their base64 data, in
+        place, and release them from their store, so that the messages are plain
+        JSON-serializable data that outlives the store.
+        """
+        for _, image in self._images:
+            data = image.get("source", {}).get("data")
+            if isinstance(data, ImageHandle):
+                image["source"] = {**image["source"], "data": data.base64()}
+                data.release()
+
+    def api_messages(self) -> list[BetaMessageParam]:
+        """
+        Returns the messages for an API request, with image handles resolved to
+        base64 data. Only the tool results that hold handles are copied; the
+        base64 strings live no longer than the request.
+        """
+        resolved: dict[int, dict[str, Any]] = {}
+        for tool_result, image in self._images:
+            data = image.get("source", {}).get("data")
+            if not isinstance(data, ImageHandle):
+                continue
+            if id(tool_result) not in resolved:
+                resolved[id(tool_result)] = {
+                    **tool_result,
+                    "content": list(tool_result["content"]),
+                }
+            content = resolved[id(tool_result)]["content"]
+            index = next(i for i, block in enumerate(content) if block is image)
+            content[index] = {
+                **image,
+                "source": {**image["source"], "data": data.base64()},
+            }
+
+        if not resolved:
+            return self.messages
+        return [
+            (
+                {
+                    **message,
+                    "content": [
+                        resolved.get(id(item), item) for item in message["content"]
+                    ],
+                }
+                if isinstance(message["content"], list)
+                else message
+            )
+            for message in self.messages
+        ]
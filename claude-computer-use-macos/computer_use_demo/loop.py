@@ -2,16 +2,15 @@
 Agentic sampling loop that calls the Anthropic API and local implenmentation of anthropic-defined computer use tools.
 """
 
+import asyncio
+import itertools
 import platform
 from collections.abc import Callable
 from datetime import datetime
 from enum import StrEnum
 from typing import Any, cast
 
-from anthropic import Anthropic, AnthropicBedrock, AnthropicVertex, APIResponse
-from anthropic.types import (
-    ToolResultBlockParam,
-)
+from anthropic import AsyncAnthropic, AsyncAnthropicBedrock, AsyncAnthropicVertex
 from anthropic.types.beta import (
     BetaContentBlock,
     BetaContentBlockParam,
@@ -22,7 +21,16 @@ from anthropic.types.beta import (
     BetaToolResultBlockParam,
 )
 
-from .tools import BashTool, ComputerTool, EditTool, ToolCollection, ToolResult
+from .conversation import ConversationState
+from .tools import (
+    BashTool,
+    ComputerMacroTool,
+    ComputerTool,
+    EditTool,
+    ToolCollection,
+    ToolResult,
+)
+from .trajectory import Trajectory
 
 BETA_FLAG = "computer-use-2024-10-22"
 
@@ -48,10 +56,15 @@ PROVIDER_TO_DEFAULT_MODEL_NAME: dict[APIProvider, str] = {
 SYSTEM_PROMPT = f"""<SYSTEM_CAPABILITY>
 * You are utilizing a MacOS computer using {platform.machine()} architecture with internet access.
 * You can use the bash tool to execute commands in the terminal.
+* The bash tool also accepts a `"session"` name: each name is a separate shell, so commands in different sessions run at the same time. A long-running command can be started with `"background": true`; the result gives a job id, and calling the bash tool with `"job": <id>` returns its new output (add `"restart": true` to stop it). `"timeout"` sets a command's timeout in seconds.
 * To open applications, you can use the `open` command in the bash tool. For example, `open -a Safari` to open the Safari browser.
+* To make several changes to one file, call `str_replace_editor` once with the `"multi_edit"` command and `"edits"`, a list of `{"old_str", "new_str"}` replacements and `{"insert_line", "new_str"}` insertions. Every edit refers to the file as it is before the call, and either all of them are applied or none is.
 * When using your bash tool with commands that are expected to output very large quantities of text, redirect the output into a temporary file and use `str_replace_editor` or `grep -n -B <lines before> -A <lines after> <query> <filename>` to inspect the output.
 * When viewing a page, it can be helpful to zoom out so that you can see everything on the page. Alternatively, ensure you scroll down to see everything before deciding something isn't available.
 * When using your computer function calls, they may take a while to run and send back to you. Where possible and feasible, try to chain multiple of these calls into one function call request.
+* If a screenshot returns "Screen unchanged since last screenshot", the previous screenshot is still accurate. Only if you really need a new image, call the screenshot action with `"force": true`.
+* To perform several computer actions whose coordinates you already know, such as filling in the fields of a form, use the computer_macro tool to run them in one call; it returns a single screenshot at the end.
+* The type action pastes long text through the clipboard. If a field rejects pasted text, type it again with `"method": "keys"` to send real keystrokes.
 * The current date is {datetime.today().strftime('%A, %B %-d, %Y')}.
 </SYSTEM_CAPABILITY>
 
@@ -61,6 +74,46 @@ SYSTEM_PROMPT = f"""<SYSTEM_CAPABILITY>
 </IMPORTANT>"""
 
 
+# The same prompt for a Linux display without a desktop, such as XvfbBackend's
+LINUX_SYSTEM_PROMPT = (
+    SYSTEM_PROMPT.replace("a MacOS computer", "a Linux computer")
+    .replace(
+        "To open applications, you can use the `open` command in the bash tool. "
+        "For example, `open -a Safari` to open the Safari browser.",
+        "To open applications, start them in the background from the bash tool, "
+        "which has DISPLAY set to this screen. For example, `(firefox &)` to "
+        "open the Firefox browser. There is no desktop or window manager.",
+    )
+    .replace("When using Safari", "When using Firefox")
+    .replace("`brew install poppler`", "`apt-get install poppler-utils`")
+)
+
+
+SUMMARY_PROMPT = """Below is the transcript of the earlier part of a computer use session. \
+Summarize it for the agent that continues the session: what has been done, what was \
+found, values that may be needed later and the state the computer was left in. Be \
+brief and factual.
+
+<transcript>
+{transcript}
+</transcript>"""
+
+
+AsyncClient = AsyncAnthropic | AsyncAnthropicVertex | AsyncAnthropicBedrock
+
+
+def make_client(provider: APIProvider, api_key: str) -> AsyncClient:
+    """
+    Create an async API client. A client keeps a pool of HTTP connections, so it
+    should be created once and reused across turns.
+    """
+    if provider == APIProvider.VERTEX:
+        return AsyncAnthropicVertex()
+    elif provider == APIProvider.BEDROCK:
+        return AsyncAnthropicBedrock()
+    return AsyncAnthropic(api_key=api_key)
+
+
 async def sampling_loop(
     *,
     model: str,
@@ -69,124 +122,188 @@ async def sampling_loop(
     messages: list[BetaMessageParam],
     output_callback: Callable[[BetaContentBlock], None],
     tool_output_callback: Callable[[ToolResult, str], None],
-    api_response_callback: Callable[[APIResponse[BetaMessage]], None],
+    api_response_callback: Callable[[BetaMessage], None],
     api_key: str,
     only_n_most_recent_images: int | None = None,
     max_tokens: int = 4096,
+    prompt_caching: bool = True,
+    client: AsyncClient | None = None,
+    tool_collection: ToolCollection | None = None,
+    trajectory: Trajectory | None = None,
+    max_turns: int | None = None,
+    token_budget: int | None = None,
+    keep_last_turns: int = 4,
+    summary_cache: dict[str, str] | None = None,
+    system_prompt: str = SYSTEM_PROMPT,
 ):
     """
     Agentic sampling loop for the assistant/tool interaction of computer use.
-    """
-    tool_collection = ToolCollection(
-        ComputerTool(),
-        BashTool(),
-        EditTool(),
-    )
-    system = (
-        f"{SYSTEM_PROMPT}{' ' + system_prompt_suffix if system_prompt_suffix else ''}"
-    )
 
-    while True:
-        if only_n_most_recent_images:
-            _maybe_filter_to_n_most_recent_images(messages, only_n_most_recent_images)
-
-        if provider == APIProvider.ANTHROPIC:
-            client = Anthropic(api_key=api_key)
-        elif provider == APIProvider.VERTEX:
-            client = AnthropicVertex()
-        elif provider == APIProvider.BEDROCK:
-            client = AnthropicBedrock()
-
-        # Call the API
-        # we use raw_response to provide debug information to streamlit. Your
-        # implementation may be able call the SDK directly with:
-        # `response = client.messages.create(...)` instead.
-        raw_response = client.beta.messages.with_raw_response.create(
-            max_tokens=max_tokens,
-            messages=messages,
-            model=model,
-            system=system,
-            tools=tool_collection.to_params(),
-            betas=["computer-use-2024-10-22"],
-        )
+    system_prompt describes the computer, SYSTEM_PROMPT for this Mac or
+    LINUX_SYSTEM_PROMPT for a Linux display; system_prompt_suffix is appended.
 
-        api_response_callback(cast(APIResponse[BetaMessage], raw_response))
+    Responses are streamed from a single long-lived async client (created here
+    unless one is passed in) and each tool_use block starts executing as soon
+    as it has finished streaming, while the rest of the response arrives.
 
-        response = raw_response.parse()
+    With prompt_caching enabled (Anthropic provider only), a cache breakpoint is
+    placed at the end of the system prompt so that the tool definitions and
+    system prompt, which are identical on every turn, are read from the cache.
 
-        messages.append(
-            {
-                "role": "assistant",
-                "content": cast(list[BetaContentBlockParam], response.content),
-            }
-        )
+    With a trajectory, recorded responses are replayed without calling the API
+    for as long as the screen matches the recording, and the responses of a run
+    that finishes are recorded for the next one.
 
-        tool_result_content: list[BetaToolResultBlockParam] = []
-        for content_block in cast(list[BetaContentBlock], response.content):
-            output_callback(content_block)
-            if content_block.type == "tool_use":
-                result = await tool_collection.run(
-                    name=content_block.name,
-                    tool_input=cast(dict[str, Any], content_block.input),
-                )
-                tool_result_content.append(
-                    _make_api_tool_result(result, content_block.id)
-                )
-                tool_output_callback(result, content_block.id)
+    With max_turns, the loop returns after that many turns even if the model is
+    still calling tools; the last message is then the user's tool results.
 
-        if not tool_result_content:
-            return messages
+    With a token_budget, once the conversation is estimated above it, its oldest
+    turns are replaced with a summary written by the model, keeping the last
+    keep_last_turns turns verbatim (see ConversationState.compact). The summary
+    responses are passed to api_response_callback too, so that usage adds up.
 
-        messages.append({"content": tool_result_content, "role": "user"})
+    Screenshots are kept out of the messages while the loop runs; the messages
+    returned (or left in `messages` on an error) hold them as base64 data.
+    """
+    if tool_collection is None:
+        computer = ComputerTool()
+        tool_collection = ToolCollection(
+            computer,
+            ComputerMacroTool(computer),
+            BashTool(),
+            EditTool(),
+        )
+    computer = tool_collection.tool_map.get("computer")
+    system: BetaTextBlockParam = {
+        "type": "text",
+        "text": (
+            f"{system_prompt}{' ' + system_prompt_suffix if system_prompt_suffix else ''}"
+        ),
+    }
+    if prompt_caching and provider == APIProvider.ANTHROPIC:
+        system["cache_control"] = {"type": "ephemeral"}
 
+    conversation = ConversationState(messages, summary_cache)
+    owns_client = client is None
+    client = client or make_client(provider, api_key)
 
-def _maybe_filter_to_n_most_recent_images(
-    messages: list[BetaMessageParam],
-    images_to_keep: int,
-    min_removal_threshold: int = 10,
-):
-    """
-    With the assumption that images are screenshots that are of diminishing value as
-    the conversation progresses, remove all but the final `images_to_keep` tool_result
-    images in place, with a chunk of min_removal_threshold to reduce the amount we
-    break the implicit prompt cache.
-    """
-    if images_to_keep is None:
-        return messages
-
-    tool_result_blocks = cast(
-        list[ToolResultBlockParam],
-        [
-            item
-            for message in messages
-            for item in (
-                message["content"] if isinstance(message["content"], list) else []
-            )
-            if isinstance(item, dict) and item.get("type") == "tool_result"
-        ],
-    )
+    async def summarize(transcript: str) -> str:
+        response = await client.beta.messages.create(
+            model=model,
+            max_tokens=1024,
+            messages=[
+                {
+                    "role": "user",
+                    "content": SUMMARY_PROMPT.format(transcript=transcript),
+                }
+            ],
+        )
+        # the summary is paid for like any other response
+        api_response_callback(response)
+        return "\n".join(
+            block.text for block in response.content if block.type == "text"
+        )
 
-    total_images = sum(
-        1
-        for tool_result in tool_result_blocks
-        for content in tool_result.get("content", [])
-        if isinstance(content, dict) and content.get("type") == "image"
-    )
+    try:
+        for turn in itertools.count(1):
+            if only_n_most_recent_images:
+                conversation.prune_images(only_n_most_recent_images)
+            if token_budget and await conversation.compact(
+                token_budget, keep_last_turns, summarize
+            ):
+                # the screenshots the model has seen may have been summarized away
+                if isinstance(computer, ComputerTool):
+                    computer.reset_screenshot_cache()
+
+            screen = await trajectory.screen_hash() if trajectory else 0
+            recorded = trajectory.next_response(screen) if trajectory else None
+            if recorded:
+                response = recorded
+                scheduler = tool_collection.scheduler()
+                tool_runs = {
+                    block.id: scheduler.submit(
+                        name=block.name, tool_input=cast(dict[str, Any], block.input)
+                    )
+                    for block in response.content
+                    if block.type == "tool_use"
+                }
+            else:
+                response, tool_runs = await _stream_response(
+                    client,
+                    tool_collection,
+                    max_tokens=max_tokens,
+                    messages=conversation.api_messages(),
+                    model=model,
+                    system=[system],
+                    tools=tool_collection.to_params(),
+                    betas=[BETA_FLAG],
+                )
+                api_response_callback(response)
+            if trajectory:
+                trajectory.record(screen, response)
 
-    images_to_remove = total_images - images_to_keep
-    # for better cache behavior, we want to remove in chunks
-    images_to_remove -= images_to_remove % min_removal_threshold
+            conversation.append(
+                {
+                    "role": "assistant",
+                    "content": cast(list[BetaContentBlockParam], response.content),
+                }
+            )
 
-    for tool_result in tool_result_blocks:
-        if isinstance(tool_result.get("content"), list):
-            new_content = []
-            for content in tool_result.get("content", []):
-                if isinstance(content, dict) and content.get("type") == "image":
-                    if images_to_remove > 0:
-                        images_to_remove -= 1
-                        continue
-                new_content.append(content)
-            tool_result["content"] = new_content
+            tool_result_content: list[BetaToolResultBlockParam] = []
+            for content_block in cast(list[BetaContentBlock], response.content):
+                output_callback(content_block)
+                if content_block.type == "tool_use":
+                    result = await tool_runs[content_block.id]
+                    tool_result_content.append(
+                        _make_api_tool_result(result, content_block.id)
+                    )
+                    tool_output_callback(result, content_block.id)
+
+            if not tool_result_content:
+                if trajectory:
+                    trajectory.save()
+                return messages
+
+            conversation.append({"content": tool_result_content, "role": "user"})
+            if max_turns and turn >= max_turns:
+                return messages
+    finally:
+        # the caller gets plain messages, not handles into the computer's store
+        conversation.resolve_images()
+        if owns_client:
+            await client.close()
+
+
+async def _stream_response(
+    client: AsyncClient, tool_collection: ToolCollection, **params
+) -> tuple[BetaMessage, dict[str, asyncio.Task[ToolResult]]]:
+    """
+    Stream one response, scheduling each tool call as soon as its tool_use block
+    has been streamed. Independent tool calls run concurrently.
+    Returns the final message and the tool run of each tool_use id.
+    """
+    scheduler = tool_collection.scheduler()
+    tool_runs: dict[str, asyncio.Task[ToolResult]] = {}
+
+    try:
+        async with client.beta.messages.stream(**params) as stream:
+            async for event in stream:
+                if (
+                    event.type == "content_block_stop"
+                    and event.content_block.type == "tool_use"
+                ):
+                    block = event.content_block
+                    tool_runs[block.id] = scheduler.submit(
+                        name=block.name,
+                        tool_input=cast(dict[str, Any], block.input),
+                    )
+            response = await stream.get_final_message()
+    except BaseException:
+        for run in tool_runs.values():
+            run.cancel()
+        raise
+
+    return response, tool_runs
 
 
 def _make_api_tool_result(
@@ -195,15 +312,31 @@ def _make_api_tool_result(
     """Convert an agent ToolResult to an API ToolResultBlockParam."""
     tool_result_content: list[BetaTextBlockParam | BetaImageBlockParam] | str = []
     is_error = False
-    if result.error:
+    if result.error and not result.image:
         is_error = True
         tool_result_content = _maybe_prepend_system_tool_result(result, result.error)
     else:
-        if result.output:
+        # a failure may still show the screen it left, e.g. a macro's
+        is_error = bool(result.error)
+        text = result.error or result.output
+        if text or result.system:
             tool_result_content.append(
                 {
                     "type": "text",
-                    "text": _maybe_prepend_system_tool_result(result, result.output),
+                    "text": _maybe_prepend_system_tool_result(result, text or ""),
+                }
+            )
+        if result.image:
+            tool_result_content.append(
+                {
+                    "type": "image",
+                    "source": {
+                        "type": "base64",
+                        "media_type": result.image.media_type,
+                        # resolved to base64 data by ConversationState, for each
+                        # request and when the loop returns
+                        "data": result.image,  # type: ignore
+                    },
                 }
             )
         if result.base64_image:
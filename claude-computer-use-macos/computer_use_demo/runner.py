@@ -0,0 +1,357 @@
+"""
+Run many steps.xml jobs concurrently, each worker driving its own display.
+
+Every worker owns one computer backend (by default a headless Xvfb display) for
+its whole life and runs one sampling loop at a time on it. Each job gets its
+own bash session started in its own working directory, so jobs never share a
+screen, a shell or files. All workers share one API client.
+
+    python -m computer_use_demo.runner jobs.jsonl --workers 4
+
+where each line of jobs.jsonl is {"steps": "path/to/steps.xml", "parameters": {...}}.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import time
+from dataclasses import dataclass, field
+from typing import Callable
+from xml.sax.saxutils import escape, quoteattr
+
+from anthropic.types.beta import BetaMessage, BetaMessageParam
+
+from .loop import (
+    LINUX_SYSTEM_PROMPT,
+    APIProvider,
+    AsyncClient,
+    make_client,
+    sampling_loop,
+)
+from .tools import (
+    BashTool,
+    ComputerBackend,
+    ComputerMacroTool,
+    ComputerTool,
+    EditTool,
+    PyAutoGUIBackend,
+    ToolCollection,
+    XvfbBackend,
+)
+from .steps import StepResult, parse_workflow, run_steps
+from .trajectory import TrajectoryCache, trajectory_key
+
+
+@dataclass
+class Job:
+    """A steps.xml workflow to run with a set of parameters."""
+
+    steps_path: str
+    parameters: dict[str, str] = field(default_factory=dict)
+    id: str = ""
+
+
+@dataclass
+class JobResult:
+    job: Job
+    queued: float
+    started: float
+    finished: float
+    display_num: int | None = None
+    turns: int = 0
+    replayed_turns: int = 0
+    input_tokens: int = 0
+    output_tokens: int = 0
+    messages: list[BetaMessageParam] | None = None
+    error: str | None = None
+
+    @property
+    def latency(self) -> float:
+        """Seconds from when the job was queued until it finished."""
+        return self.finished - self.queued
+
+    @property
+    def run_time(self) -> float:
+        return self.finished - self.started
+
+
+def job_parameters(job: Job) -> str:
+    """The parameters of a job as an instruction, empty when it has none."""
+    if not job.parameters:
+        return ""
+    parameters = "\n".join(
+        f"<parameter name={quoteattr(name)}>{escape(str(value))}</parameter>"
+        for name, value in job.parameters.items()
+    )
+    return (
+        "Use these values wherever the steps call for them:\n"
+        f"<parameters>\n{parameters}\n</parameters>"
+    )
+
+
+def job_instruction(job: Job) -> str:
+    """The instruction for a job: its steps followed by its parameters."""
+    with open(job.steps_path) as f:
+        instruction = f.read().rstrip()
+    if job.parameters:
+        instruction += f"\n\n{job_parameters(job)}"
+    return instruction
+
+
+async def _run_job(
+    job: Job,
+    queued: float,
+    backend: ComputerBackend,
+    client: AsyncClient,
+    workdir: str,
+    trajectories: TrajectoryCache | None,
+    max_turns_per_step: int,
+    system_prompt_suffix: str,
+    **loop_kwargs,
+) -> JobResult:
+    result = JobResult(
+        job, queued, time.monotonic(), queued, display_num=backend.display_num
+    )
+    job_dir = os.path.join(workdir, job.id)
+    os.makedirs(job_dir, exist_ok=True)
+    env = None
+    if backend.display_num is not None:
+        # applications started from the shell open on the job's display, and
+        # the model is told it is on Linux rather than this Mac
+        env = {"DISPLAY": f":{backend.display_num}"}
+        loop_kwargs.setdefault("system_prompt", LINUX_SYSTEM_PROMPT)
+    computer = ComputerTool(backend=backend)
+    bash = BashTool(cwd=job_dir, env=env)
+    tool_collection = ToolCollection(
+        computer,
+        ComputerMacroTool(computer),
+        bash,
+        EditTool(),
+    )
+
+    with open(job.steps_path) as f:
+        xml = f.read()
+    instruction = job_instruction(job)
+    trajectory_prefix = trajectory_key(instruction, loop_kwargs["model"])
+    trajectory = None
+
+    def api_response_callback(response: BetaMessage):
+        result.turns += 1
+        result.input_tokens += response.usage.input_tokens
+        result.output_tokens += response.usage.output_tokens
+
+    def on_step(step: StepResult):
+        result.replayed_turns += step.replayed_turns
+        result.messages = step.messages
+
+    loop_kwargs.update(
+        output_callback=lambda block: None,
+        tool_output_callback=lambda tool_result, tool_use_id: None,
+        api_response_callback=api_response_callback,
+        client=client,
+        tool_collection=tool_collection,
+    )
+    try:
+        if parse_workflow(xml).steps:
+            # the parameters stay in the system prompt of every step
+            await run_steps(
+                xml,
+                system_prompt_suffix=f"{system_prompt_suffix}\n{job_parameters(job)}",
+                max_turns_per_step=max_turns_per_step,
+                trajectories=trajectories,
+                trajectory_prefix=trajectory_prefix,
+                on_step=on_step,
+                **loop_kwargs,
+            )
+        else:
+            if trajectories:
+                trajectory = trajectories.open(trajectory_prefix, computer)
+            result.messages = await sampling_loop(
+                messages=[{"role": "user", "content": instruction}],
+                system_prompt_suffix=system_prompt_suffix,
+                trajectory=trajectory,
+                **loop_kwargs,
+            )
+    except Exception as e:
+        result.error = f"{type(e).__name__}: {e}"
+    finally:
+        if trajectory:
+            result.replayed_turns = trajectory.replayed
+        computer.image_store.close()
+        # the job's shells and background commands must not outlive it
+        bash.close()
+        result.finished = time.monotonic()
+    return result
+
+
+async def run_jobs(
+    jobs: list[Job],
+    *,
+    workers: int,
+    model: str,
+    provider: APIProvider,
+    api_key: str,
+    backend_factory: Callable[[], ComputerBackend] = XvfbBackend,
+    workdir: str = "runs",
+    system_prompt_suffix: str = "",
+    trajectory_dir: str | None = None,
+    max_turns_per_step: int = 25,
+    on_result: Callable[[JobResult], None] | None = None,
+    **loop_kwargs,
+) -> list[JobResult]:
+    """
+    Run the jobs on `workers` concurrent workers and return their results in
+    completion order. A steps.xml with top-level steps runs one sampling loop
+    per step (see run_steps), otherwise the whole file is one instruction. A job
+    that fails is reported in its result's error and does not stop the others,
+    but a worker whose backend cannot be started cancels the other workers, and
+    its error is raised (in an ExceptionGroup) once they have stopped.
+    With a trajectory_dir, the trajectories of successful jobs are recorded there
+    and replayed by later runs of the same steps and parameters.
+    """
+    queue: asyncio.Queue[tuple[Job, float]] = asyncio.Queue()
+    for index, job in enumerate(jobs):
+        job.id = job.id or f"job_{index:04d}"
+        queue.put_nowait((job, time.monotonic()))
+    results: list[JobResult] = []
+    client = make_client(provider, api_key)
+    trajectories = TrajectoryCache(trajectory_dir) if trajectory_dir else None
+
+    async def worker():
+        # starting a display can take a moment, keep it off the event loop
+        backend = await asyncio.to_thread(backend_factory)
+        try:
+            while not queue.empty():
+                job, queued = queue.get_nowait()
+                result = await _run_job(
+                    job,
+                    queued,
+                    backend,
+                    client,
+                    workdir,
+                    trajectories,
+                    max_turns_per_step,
+                    system_prompt_suffix,
+                    model=model,
+                    provider=provider,
+                    api_key=api_key,
+                    **loop_kwargs,
+                )
+                results.append(result)
+                if on_result:
+                    on_result(result)
+        finally:
+            backend.close()
+
+    try:
+        # a failing worker cancels the others before the client is closed
+        async with asyncio.TaskGroup() as group:
+            for _ in range(min(workers, len(jobs))):
+                group.create_task(worker())
+    finally:
+        await client.close()
+    return results
+
+
+def summarize(results: list[JobResult], elapsed: float) -> dict[str, float]:
+    """Throughput and latency statistics of a run that took `elapsed` seconds."""
+    latencies = sorted(r.latency for r in results)
+    run_times = sorted(r.run_time for r in results)
+
+    def percentile(values: list[float], p: float) -> float:
+        if not values:
+            return 0.0
+        return values[min(len(values) - 1, int(p * len(values)))]
+
+    return {
+        "jobs": len(results),
+        "failed": sum(1 for r in results if r.error),
+        "elapsed_s": elapsed,
+        "jobs_per_hour": len(results) / elapsed * 3600 if elapsed else 0.0,
+        "latency_p50_s": percentile(latencies, 0.5),
+        "latency_p95_s": percentile(latencies, 0.95),
+        "run_time_mean_s": statistics.fmean(run_times) if run_times else 0.0,
+        "replayed_turns": sum(r.replayed_turns for r in results),
+        "turns_mean": statistics.fmean(r.turns for r in results) if results else 0.0,
+        "input_tokens": sum(r.input_tokens for r in results),
+        "output_tokens": sum(r.output_tokens for r in results),
+    }
+
+
+def load_jobs(path: str) -> list[Job]:
+    """Jobs from a JSON lines file; relative steps paths are relative to the file."""
+    jobs = []
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            spec = json.loads(line)
+            steps_path = os.path.join(os.path.dirname(path), spec["steps"])
+            jobs.append(Job(steps_path, spec.get("parameters", {}), spec.get("id", "")))
+    return jobs
+
+
+async def main():
+    parser = argparse.ArgumentParser(
+        description="Run steps.xml jobs concurrently on separate displays."
+    )
+    parser.add_argument("jobs", help="JSON lines file of jobs")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--workdir", default="runs")
+    parser.add_argument("--model", default="claude-3-5-sonnet-20241022")
+    parser.add_argument(
+        "--trajectories",
+        help="record successful runs here and replay them while the screen matches",
+    )
+    parser.add_argument(
+        "--backend",
+        choices=["xvfb", "local"],
+        default="xvfb",
+        help="a headless Xvfb display per worker, or this computer's screen",
+    )
+    args = parser.parse_args()
+
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    api_key = os.getenv("ANTHROPIC_API_KEY", "")
+    if not api_key:
+        raise ValueError(
+            "Please first set your API key in the ANTHROPIC_API_KEY environment variable"
+        )
+    if args.backend == "local" and args.workers > 1:
+        parser.error("the local backend has a single screen, use --workers 1")
+
+    def report(result: JobResult):
+        status = f"failed: {result.error}" if result.error else "done"
+        print(
+            f"{result.job.id} on display {result.display_num}: {status} "
+            f"in {result.run_time:.1f}s, {result.turns} turns, "
+            f"{result.replayed_turns} replayed"
+        )
+
+    jobs = load_jobs(args.jobs)
+    start = time.monotonic()
+    results = await run_jobs(
+        jobs,
+        workers=args.workers,
+        model=args.model,
+        provider=APIProvider.ANTHROPIC,
+        api_key=api_key,
+        backend_factory=XvfbBackend if args.backend == "xvfb" else PyAutoGUIBackend,
+        workdir=args.workdir,
+        trajectory_dir=args.trajectories,
+        on_result=report,
+        only_n_most_recent_images=10,
+        max_tokens=4096,
+    )
+    for name, value in summarize(results, time.monotonic() - start).items():
+        print(
+            f"{name}: {value:.2f}" if isinstance(value, float) else f"{name}: {value}"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
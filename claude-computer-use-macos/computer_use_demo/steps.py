@@ -0,0 +1,152 @@
+"""
+Run a generated steps.xml one top-level <step> at a time.
+
+Each step gets a sampling loop of its own, bounded in turns, whose conversation
+holds only the step and a short summary of the steps before it. The general
+description of the workflow is part of the system prompt, which stays the same
+(and cached) for every step. Input tokens per turn therefore do not grow with
+the length of the workflow.
+"""
+
+import re
+from dataclasses import dataclass
+from typing import Callable, cast
+
+from anthropic.types.beta import BetaContentBlock, BetaMessageParam
+
+from .loop import sampling_loop
+from .tools import ComputerTool, ToolCollection
+from .trajectory import TrajectoryCache, trajectory_key
+
+SUMMARY_MAX_CHARS = 1500
+
+_STEP_TAG = re.compile(r"<(/?)step>")
+_MAIN_DESCRIPTION = re.compile(r"<main_description>(.*?)</main_description>", re.S)
+_SUMMARY = re.compile(r"<summary>(.*?)</summary>", re.S)
+
+_STEP_PROMPT = """<progress_summary>
+{summary}
+</progress_summary>
+
+Do only step {number} of {count} of the workflow, then stop:
+{step}
+
+When the step is done, reply with a summary of the progress of the whole workflow \
+so far, including any values that later steps need and the current state of the \
+screen, between <summary> and </summary> tags."""
+
+
+class StepError(Exception):
+    """Raised when a step does not finish within its turn budget."""
+
+
+@dataclass
+class Workflow:
+    description: str
+    steps: list[str]
+
+
+@dataclass
+class StepResult:
+    index: int
+    summary: str
+    messages: list[BetaMessageParam]
+    replayed_turns: int = 0
+
+
+def parse_workflow(xml: str) -> Workflow:
+    """
+    Split a steps.xml into its main description and its top-level steps. Tags are
+    matched by depth rather than with an XML parser, because the generated text
+    inside them is not always well-formed XML (URLs with bare ampersands...).
+    """
+    match = _MAIN_DESCRIPTION.search(xml)
+    description = match.group(1).strip() if match else ""
+    steps = []
+    depth = 0
+    start = 0
+    for tag in _STEP_TAG.finditer(xml):
+        if not tag.group(1):
+            if depth == 0:
+                start = tag.start()
+            depth += 1
+        elif depth > 0:
+            depth -= 1
+            if depth == 0:
+                steps.append(xml[start : tag.end()])
+    return Workflow(description, steps)
+
+
+def _summary(messages: list[BetaMessageParam]) -> str:
+    """The summary in the last assistant message, or its text if there is none."""
+    text = "\n".join(
+        block.text
+        for block in cast(list[BetaContentBlock], messages[-1]["content"])
+        if block.type == "text"
+    )
+    match = _SUMMARY.search(text)
+    summary = (match.group(1) if match else text).strip()
+    return summary[-SUMMARY_MAX_CHARS:]
+
+
+async def run_steps(
+    xml: str,
+    *,
+    tool_collection: ToolCollection,
+    system_prompt_suffix: str = "",
+    max_turns_per_step: int = 25,
+    trajectories: TrajectoryCache | None = None,
+    trajectory_prefix: str = "",
+    on_step: Callable[[StepResult], None] | None = None,
+    **loop_kwargs,
+) -> list[StepResult]:
+    """
+    Run every top-level step of a steps.xml in its own sampling loop and return
+    the result of each. loop_kwargs are passed on to sampling_loop. Raises
+    StepError when a step is still calling tools after max_turns_per_step turns.
+
+    With trajectories, each step is recorded and replayed on its own, keyed by
+    trajectory_prefix and the step's position.
+    """
+    workflow = parse_workflow(xml)
+    if workflow.description:
+        system_prompt_suffix = (
+            f"{system_prompt_suffix}\n<workflow>\n{workflow.description}\n</workflow>"
+        )
+    computer = tool_collection.tool_map.get("computer")
+    results = []
+    summary = "Nothing has been done yet."
+    for index, step in enumerate(workflow.steps):
+        if isinstance(computer, ComputerTool):
+            # the new conversation has not seen any screenshot yet
+            computer.reset_screenshot_cache()
+        trajectory = None
+        if trajectories and isinstance(computer, ComputerTool):
+            key = trajectory_key(trajectory_prefix, str(index), step)
+            trajectory = trajectories.open(key, computer)
+        prompt = _STEP_PROMPT.format(
+            summary=summary,
+            number=index + 1,
+            count=len(workflow.steps),
+            step=step,
+        )
+        messages = await sampling_loop(
+            messages=[{"role": "user", "content": prompt}],
+            tool_collection=tool_collection,
+            system_prompt_suffix=system_prompt_suffix,
+            max_turns=max_turns_per_step,
+            trajectory=trajectory,
+            **loop_kwargs,
+        )
+        if messages[-1]["role"] != "assistant":
+            raise StepError(
+                f"Step {index + 1} did not finish within {max_turns_per_step} turns"
+            )
+        summary = _summary(messages)
+        result = StepResult(
+            index, summary, messages, trajectory.replayed if trajectory else 0
+        )
+        results.append(result)
+        if on_step:
+            on_step(result)
+    return results
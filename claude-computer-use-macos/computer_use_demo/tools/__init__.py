@@ -1,14 +1,27 @@
+from .backend import ComputerBackend, PyAutoGUIBackend, XvfbBackend
 from .base import CLIResult, ToolResult
 from .bash import BashTool
 from .collection import ToolCollection
-from .computer import ComputerTool
+from .computer import ComputerTool, ImageFormat, ScreenshotEncoding
 from .edit import EditTool
+from .history import EditHistory
+from .images import ImageHandle, ImageStore
+from .macro import ComputerMacroTool
 
 __ALL__ = [
     BashTool,
     CLIResult,
+    ComputerBackend,
+    ComputerMacroTool,
     ComputerTool,
+    EditHistory,
     EditTool,
+    ImageFormat,
+    ImageHandle,
+    ImageStore,
+    PyAutoGUIBackend,
+    ScreenshotEncoding,
     ToolCollection,
     ToolResult,
+    XvfbBackend,
 ]
@@ -0,0 +1,456 @@
+"""Screen capture, pointer and keyboard backends for the computer tool."""
+
+import mmap
+import os
+import select
+import shutil
+import struct
+import subprocess
+import tempfile
+import threading
+import weakref
+from abc import ABCMeta, abstractmethod
+
+from PIL import Image, ImageGrab
+
+
+class ComputerBackend(metaclass=ABCMeta):
+    """
+    The display the computer tool drives. Keys are named as pyautogui names them
+    ("command", "ctrl", "enter", ...). Any object with these methods can stand
+    in for a backend, e.g. a fake in tests.
+    """
+
+    display_num: int | None = None
+    paste_keys: tuple[str, ...] = ("command", "v")
+    # whether write can type any character, not only ASCII
+    types_unicode: bool = False
+
+    @abstractmethod
+    def size(self) -> tuple[int, int]:
+        """Returns the screen width and height in pixels."""
+        ...
+
+    @abstractmethod
+    def screenshot(self) -> Image.Image: ...
+
+    def sample(self, reduction: int) -> Image.Image:
+        """
+        A greyscale capture of the screen reduced by `reduction`, only used to tell
+        whether the screen is still changing. By default the screenshot, reduced;
+        backends with a cheaper way to look at the screen override it.
+        """
+        return self.screenshot().reduce(reduction).convert("L")
+
+    @abstractmethod
+    def position(self) -> tuple[int, int]:
+        """Returns the pointer position."""
+        ...
+
+    @abstractmethod
+    def move(self, x: int, y: int): ...
+
+    @abstractmethod
+    def click(self, button: str = "left"): ...
+
+    @abstractmethod
+    def double_click(self): ...
+
+    @abstractmethod
+    def mouse_down(self): ...
+
+    @abstractmethod
+    def mouse_up(self): ...
+
+    @abstractmethod
+    def write(self, text: str, interval: float = 0.0):
+        """Types text, waiting interval seconds after each character."""
+        ...
+
+    @abstractmethod
+    def hotkey(self, *keys: str):
+        """Presses the keys together and releases them in reverse order."""
+        ...
+
+    @abstractmethod
+    def get_clipboard(self) -> str: ...
+
+    @abstractmethod
+    def set_clipboard(self, text: str): ...
+
+    def save_clipboard(self) -> object:
+        """
+        The contents of the clipboard, in whatever form restore_clipboard takes
+        back. By default only its text; backends that can keep images, files and
+        rich text as well override both.
+        """
+        return self.get_clipboard()
+
+    def restore_clipboard(self, saved: object):
+        """Puts back contents returned by save_clipboard."""
+        self.set_clipboard(saved)
+
+    def close(self):
+        """Releases the display."""
+        pass
+
+
+class PyAutoGUIBackend(ComputerBackend):
+    """
+    The computer this process runs on, driven with pyautogui, with the macOS
+    pasteboard as the clipboard.
+    """
+
+    def __init__(self):
+        # pyautogui needs a display as soon as it is imported
+        import pyautogui
+
+        self._pyautogui = pyautogui
+
+    def size(self):
+        width, height = self._pyautogui.size()
+        return int(width), int(height)
+
+    def screenshot(self):
+        return self._pyautogui.screenshot()
+
+    def sample(self, reduction):
+        # a capture at nominal (not Retina) resolution, kept in memory, instead of
+        # pyautogui's screencapture written to a file and read back
+        try:
+            import Quartz
+        except ImportError:
+            return super().sample(reduction)
+        image = Quartz.CGWindowListCreateImage(
+            Quartz.CGDisplayBounds(Quartz.CGMainDisplayID()),
+            Quartz.kCGWindowListOptionOnScreenOnly,
+            Quartz.kCGNullWindowID,
+            Quartz.kCGWindowImageNominalResolution,
+        )
+        data = Quartz.CGDataProviderCopyData(Quartz.CGImageGetDataProvider(image))
+        capture = Image.frombuffer(
+            "RGB",
+            (Quartz.CGImageGetWidth(image), Quartz.CGImageGetHeight(image)),
+            bytes(data),
+            "raw",
+            "BGRX",
+            Quartz.CGImageGetBytesPerRow(image),
+            1,
+        )
+        return capture.reduce(reduction).convert("L")
+
+    def position(self):
+        x, y = self._pyautogui.position()
+        return int(x), int(y)
+
+    def move(self, x, y):
+        self._pyautogui.moveTo(x, y)
+
+    def click(self, button="left"):
+        self._pyautogui.click(button=button)
+
+    def double_click(self):
+        self._pyautogui.doubleClick()
+
+    def mouse_down(self):
+        self._pyautogui.mouseDown()
+
+    def mouse_up(self):
+        self._pyautogui.mouseUp()
+
+    def write(self, text, interval=0.0):
+        self._pyautogui.write(text, interval=interval)
+
+    def hotkey(self, *keys):
+        self._pyautogui.hotkey(*keys)
+
+    def get_clipboard(self):
+        return subprocess.run(
+            ["pbpaste"], capture_output=True, check=True
+        ).stdout.decode()
+
+    def set_clipboard(self, text):
+        subprocess.run(["pbcopy"], input=text.encode(), check=True)
+
+    def save_clipboard(self):
+        # every representation of every item on the pasteboard, not only text
+        try:
+            from AppKit import NSPasteboard
+        except ImportError:
+            return super().save_clipboard()
+        return [
+            {kind: item.dataForType_(kind) for kind in item.types()}
+            for item in NSPasteboard.generalPasteboard().pasteboardItems() or []
+        ]
+
+    def restore_clipboard(self, saved):
+        if isinstance(saved, str):
+            return super().restore_clipboard(saved)
+        from AppKit import NSPasteboard, NSPasteboardItem
+
+        items = []
+        for representations in saved:
+            item = NSPasteboardItem.alloc().init()
+            for kind, data in representations.items():
+                if data is not None:
+                    item.setData_forType_(data, kind)
+            items.append(item)
+        pasteboard = NSPasteboard.generalPasteboard()
+        pasteboard.clearContents()
+        if items:
+            pasteboard.writeObjects_(items)
+
+
+# pyautogui key names that differ from X keysyms
+XDOTOOL_KEYS = {
+    "command": "super",
+    "win": "super",
+    "enter": "Return",
+    "return": "Return",
+    "esc": "Escape",
+    "escape": "Escape",
+    "tab": "Tab",
+    "backspace": "BackSpace",
+    "delete": "Delete",
+    "del": "Delete",
+    "insert": "Insert",
+    "home": "Home",
+    "end": "End",
+    "pageup": "Prior",
+    "pagedown": "Next",
+    "up": "Up",
+    "down": "Down",
+    "left": "Left",
+    "right": "Right",
+    "capslock": "Caps_Lock",
+    **{f"f{n}": f"F{n}" for n in range(1, 13)},
+}
+
+XDOTOOL_BUTTONS = {"left": "1", "middle": "2", "right": "3"}
+
+# clipboard targets that describe the selection rather than hold its contents
+XCLIP_META_TARGETS = {"TARGETS", "TIMESTAMP", "MULTIPLE", "SAVE_TARGETS", "DELETE"}
+
+
+class XvfbBackend(ComputerBackend):
+    """
+    A headless X display of its own, started on the first free display number
+    from `first_display` on. Input is sent with xdotool and the clipboard is
+    accessed with xclip, so Xvfb, xdotool and xclip must be installed. Xvfb also
+    keeps its framebuffer in a file, which `sample` reads without asking the
+    server for the screen.
+    """
+
+    paste_keys = ("ctrl", "v")
+    types_unicode = True
+
+    # displays handed out by this process whose server may not have started yet
+    _claimed: set[int] = set()
+    _claim_lock = threading.Lock()
+
+    def __init__(
+        self,
+        width: int = 1280,
+        height: int = 800,
+        first_display: int = 99,
+        startup_timeout: float = 10.0,
+    ):
+        for program in ("Xvfb", "xdotool", "xclip"):
+            if shutil.which(program) is None:
+                raise RuntimeError(f"{program} is required for XvfbBackend")
+        self.width = width
+        self.height = height
+        self._fbdir = tempfile.mkdtemp(prefix="xvfb_")
+        try:
+            self.display_num, self._server = self._start_server(
+                first_display, startup_timeout
+            )
+        except BaseException:
+            shutil.rmtree(self._fbdir, ignore_errors=True)
+            raise
+        self._env = {**os.environ, "DISPLAY": self.display}
+        self._finalizer = weakref.finalize(
+            self, self._stop_server, self._server, self._fbdir
+        )
+
+    @property
+    def display(self) -> str:
+        return f":{self.display_num}"
+
+    def _start_server(self, first_display: int, startup_timeout: float):
+        display_num = first_display
+        while True:
+            with self._claim_lock:
+                while display_num in self._claimed or os.path.exists(
+                    f"/tmp/.X{display_num}-lock"
+                ):
+                    display_num += 1
+                self._claimed.add(display_num)
+            # Xvfb writes the display number to the pipe once it accepts
+            # connections, or exits without writing when the display is taken,
+            # e.g. by another process that saw the same number free
+            read_fd, write_fd = os.pipe()
+            try:
+                try:
+                    server = subprocess.Popen(
+                        [
+                            "Xvfb",
+                            f":{display_num}",
+                            "-screen",
+                            "0",
+                            f"{self.width}x{self.height}x24",
+                            "-nolisten",
+                            "tcp",
+                            "-fbdir",
+                            self._fbdir,
+                            "-displayfd",
+                            str(write_fd),
+                        ],
+                        pass_fds=(write_fd,),
+                        stdout=subprocess.DEVNULL,
+                        stderr=subprocess.DEVNULL,
+                    )
+                finally:
+                    os.close(write_fd)
+                ready, _, _ = select.select([read_fd], [], [], startup_timeout)
+                output = os.read(read_fd, 32) if ready else None
+            finally:
+                os.close(read_fd)
+            if output is None:
+                server.kill()
+                with self._claim_lock:
+                    self._claimed.discard(display_num)
+                raise RuntimeError(f"Xvfb :{display_num} did not start")
+            if output.strip():
+                return display_num, server
+            server.wait()
+            with self._claim_lock:
+                self._claimed.discard(display_num)
+            display_num += 1
+
+    @staticmethod
+    def _stop_server(server: subprocess.Popen, fbdir: str):
+        server.terminate()
+        try:
+            server.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            server.kill()
+        shutil.rmtree(fbdir, ignore_errors=True)
+
+    def close(self):
+        self._finalizer()
+        with self._claim_lock:
+            self._claimed.discard(self.display_num)
+
+    def _xdotool(self, *args: str) -> str:
+        return subprocess.run(
+            ["xdotool", *args], env=self._env, capture_output=True, check=True
+        ).stdout.decode()
+
+    def size(self):
+        return self.width, self.height
+
+    def screenshot(self):
+        return ImageGrab.grab(xdisplay=self.display)
+
+    def sample(self, reduction):
+        # the framebuffer is an XWD file: a header of big-endian 32 bit fields,
+        # the window name and the colormap, then the pixels
+        with (
+            open(os.path.join(self._fbdir, "Xvfb_screen0"), "rb") as f,
+            mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m,
+        ):
+            header = struct.unpack(">25I", m[:100])
+            header_size, width, height = header[0], header[4], header[5]
+            byte_order, bits_per_pixel, bytes_per_line = header[7], *header[11:13]
+            colormap_size = header[19] * 12
+            if bits_per_pixel != 32:
+                return super().sample(reduction)
+            start = header_size + colormap_size
+            pixels = m[start : start + bytes_per_line * height]
+        capture = Image.frombuffer(
+            "RGB",
+            (width, height),
+            pixels,
+            "raw",
+            "BGRX" if byte_order == 0 else "XRGB",
+            bytes_per_line,
+            1,
+        )
+        return capture.reduce(reduction).convert("L")
+
+    def position(self):
+        location = dict(
+            line.split("=", 1)
+            for line in self._xdotool("getmouselocation", "--shell").split()
+        )
+        return int(location["X"]), int(location["Y"])
+
+    def move(self, x, y):
+        self._xdotool("mousemove", "--sync", str(x), str(y))
+
+    def click(self, button="left"):
+        self._xdotool("click", XDOTOOL_BUTTONS[button])
+
+    def double_click(self):
+        self._xdotool("click", "--repeat", "2", XDOTOOL_BUTTONS["left"])
+
+    def mouse_down(self):
+        self._xdotool("mousedown", XDOTOOL_BUTTONS["left"])
+
+    def mouse_up(self):
+        self._xdotool("mouseup", XDOTOOL_BUTTONS["left"])
+
+    def write(self, text, interval=0.0):
+        self._xdotool("type", "--delay", str(int(interval * 1000)), "--", text)
+
+    def hotkey(self, *keys):
+        self._xdotool("key", "--", "+".join(XDOTOOL_KEYS.get(k, k) for k in keys))
+
+    def get_clipboard(self):
+        result = subprocess.run(
+            ["xclip", "-selection", "clipboard", "-o"],
+            env=self._env,
+            capture_output=True,
+        )
+        # xclip fails when nothing owns the clipboard yet
+        return result.stdout.decode() if result.returncode == 0 else ""
+
+    def set_clipboard(self, text):
+        subprocess.run(
+            ["xclip", "-selection", "clipboard", "-i"],
+            input=text.encode(),
+            env=self._env,
+            check=True,
+        )
+
+    def _xclip_output(self, target: str) -> bytes | None:
+        result = subprocess.run(
+            ["xclip", "-selection", "clipboard", "-t", target, "-o"],
+            env=self._env,
+            capture_output=True,
+        )
+        # xclip fails when nothing owns the clipboard yet
+        return result.stdout if result.returncode == 0 else None
+
+    def save_clipboard(self):
+        # xclip serves a single target, so keep the richest one: an image over
+        # anything else, the owner's first listed target otherwise
+        targets = (self._xclip_output("TARGETS") or b"").decode().split()
+        targets = [t for t in targets if t not in XCLIP_META_TARGETS]
+        if not targets:
+            return None
+        target = next((t for t in targets if t.startswith("image/")), targets[0])
+        data = self._xclip_output(target)
+        return (target, data) if data is not None else None
+
+    def restore_clipboard(self, saved):
+        if saved is None:
+            return self.set_clipboard("")
+        target, data = saved
+        subprocess.run(
+            ["xclip", "-selection", "clipboard", "-t", target, "-i"],
+            input=data,
+            env=self._env,
+            check=True,
+        )
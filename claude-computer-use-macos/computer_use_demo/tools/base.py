@@ -4,6 +4,8 @@ from typing import Any
 
 from anthropic.types.beta import BetaToolUnionParam
 
+from .images import ImageHandle
+
 
 class BaseAnthropicTool(metaclass=ABCMeta):
     """Abstract base class for Anthropic-defined tools."""
@@ -19,6 +21,15 @@ class BaseAnthropicTool(metaclass=ABCMeta):
     ) -> BetaToolUnionParam:
         raise NotImplementedError
 
+    def resources(self, **kwargs) -> tuple[frozenset[str], frozenset[str]]:
+        """
+        Returns the (shared, exclusive) resources a call with the given arguments
+        uses. Two calls may run concurrently unless one of them uses a resource
+        exclusively that the other one uses at all. By default a tool uses itself
+        exclusively, so its calls never overlap.
+        """
+        return frozenset(), frozenset({self.to_params()["name"]})
+
 
 @dataclass(kw_only=True, frozen=True)
 class ToolResult:
@@ -27,6 +38,7 @@ class ToolResult:
     output: str | None = None
     error: str | None = None
     base64_image: str | None = None
+    image: ImageHandle | None = None
     system: str | None = None
 
     def __bool__(self):
@@ -46,6 +58,7 @@ class ToolResult:
             output=combine_fields(self.output, other.output),
             error=combine_fields(self.error, other.error),
             base64_image=combine_fields(self.base64_image, other.base64_image, False),
+            image=combine_fields(self.image, other.image, False),
             system=combine_fields(self.system, other.system),
         )
 
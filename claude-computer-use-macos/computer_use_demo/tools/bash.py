@@ -1,10 +1,17 @@
 import asyncio
+import itertools
 import os
+import signal
+import tempfile
+import time
 from typing import ClassVar, Literal
 
 from anthropic.types.beta import BetaToolBash20241022Param
 
 from .base import BaseAnthropicTool, CLIResult, ToolError, ToolResult
+from .run import MAX_RESPONSE_LEN, OutputCapture
+
+DEFAULT_SESSION = "default"
 
 
 class _BashSession:
@@ -14,13 +21,25 @@ class _BashSession:
     _process: asyncio.subprocess.Process
 
     command: str = "/bin/bash"
-    _output_delay: float = 0.2  # seconds
-    _timeout: float = 120.0  # seconds
+    _read_size: int = 64 * 1024  # bytes
+    _output_limit: int = MAX_RESPONSE_LEN  # bytes shown per stream and command
+    _max_spills: int = 8  # files of clipped output kept for the model to search
     _sentinel: str = "<<exit>>"
 
-    def __init__(self):
+    def __init__(
+        self,
+        cwd: str | None = None,
+        env: dict[str, str] | None = None,
+        timeout: float = 120.0,  # seconds
+    ):
         self._started = False
         self._timed_out = False
+        self._cwd = cwd
+        self._env = env
+        self._timeout = timeout
+        self.busy = False
+        self.last_used = time.monotonic()
+        self._spills: list[OutputCapture] = []
 
     async def start(self):
         if self._started:
@@ -30,6 +49,8 @@ class _BashSession:
             self.command,
             preexec_fn=os.setsid,
             shell=True,
+            cwd=self._cwd,
+            env={**os.environ, **self._env} if self._env else None,
             bufsize=0,
             stdin=asyncio.subprocess.PIPE,
             stdout=asyncio.subprocess.PIPE,
@@ -39,15 +60,34 @@ class _BashSession:
         self._started = True
 
     def stop(self):
-        """Terminate the bash shell."""
+        """Terminate the bash shell, and delete the files its output spilled to."""
         if not self._started:
             raise ToolError("Session has not started.")
+        for capture in self._spills:
+            capture.remove()
+        self._spills.clear()
         if self._process.returncode is not None:
             return
-        self._process.terminate()
+        # bash leads its own process group, stop the commands it started too
+        try:
+            os.killpg(self._process.pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
 
-    async def run(self, command: str):
+    @property
+    def timed_out(self) -> bool:
+        return self._timed_out
+
+    async def run(self, command: str, timeout: float | None = None):
         """Execute a command in the bash shell."""
+        self.busy = True
+        try:
+            return await self._run(command, timeout or self._timeout)
+        finally:
+            self.busy = False
+            self.last_used = time.monotonic()
+
+    async def _run(self, command: str, timeout: float):
         if not self._started:
             raise ToolError("Session has not started.")
         if self._process.returncode is not None:
@@ -65,82 +105,295 @@ class _BashSession:
         assert self._process.stdout
         assert self._process.stderr
 
-        # send command to the process
+        # send command to the process; the sentinel ends its output on both streams
         self._process.stdin.write(
-            command.encode() + f"; echo '{self._sentinel}'\n".encode()
+            command.encode()
+            + f"; echo '{self._sentinel}'; echo '{self._sentinel}' >&2\n".encode()
         )
         await self._process.stdin.drain()
 
-        # read output from the process, until the sentinel is found
+        # read both streams at once, so that neither pipe fills up and blocks bash
         try:
-            async with asyncio.timeout(self._timeout):
-                while True:
-                    await asyncio.sleep(self._output_delay)
-                    # if we read directly from stdout/stderr, it will wait forever for
-                    # EOF. use the StreamReader buffer directly instead.
-                    output = (
-                        self._process.stdout._buffer.decode()  # pyright: ignore[reportAttributeAccessIssue]
-                    )
-                    if self._sentinel in output:
-                        # strip the sentinel and break
-                        output = output[: output.index(self._sentinel)]
-                        break
+            async with asyncio.timeout(timeout):
+                output, error = await asyncio.gather(
+                    self._read_until_sentinel(self._process.stdout, "bash_stdout_"),
+                    self._read_until_sentinel(self._process.stderr, "bash_stderr_"),
+                )
         except asyncio.TimeoutError:
             self._timed_out = True
             raise ToolError(
-                f"timed out: bash has not returned in {self._timeout} seconds and must be restarted",
+                f"timed out: bash has not returned in {timeout} seconds and must be restarted",
             ) from None
 
         if output.endswith("\n"):
             output = output[:-1]
-
-        error = (
-            self._process.stderr._buffer.decode()  # pyright: ignore[reportAttributeAccessIssue]
-        )
         if error.endswith("\n"):
             error = error[:-1]
 
-        # clear the buffers so that the next output can be read correctly
-        self._process.stdout._buffer.clear()  # pyright: ignore[reportAttributeAccessIssue]
-        self._process.stderr._buffer.clear()  # pyright: ignore[reportAttributeAccessIssue]
-
         return CLIResult(output=output, error=error)
 
+    async def _read_until_sentinel(
+        self, stream: asyncio.StreamReader, prefix: str
+    ) -> str:
+        """
+        Read a stream as data arrives until the sentinel line, and return what came
+        before it. Long output is clipped and spilled to a file, see OutputCapture.
+        """
+        sentinel = f"{self._sentinel}\n".encode()
+        # the last bytes read may be the start of the sentinel, so hold them back
+        hold_back = len(sentinel) - 1
+        capture = OutputCapture(self._output_limit, prefix=prefix)
+        pending = b""
+        while True:
+            chunk = await stream.read(self._read_size)
+            data = pending + chunk
+            index = data.find(sentinel)
+            # stop at the sentinel, or at the end of the stream if bash has exited
+            done = index >= 0 or not chunk
+            if index >= 0:
+                data = data[:index]
+            elif not done:
+                data, pending = data[:-hold_back], data[-hold_back:]
+            capture.write(data)
+            if done:
+                break
+
+        capture.close()
+        if capture.path is not None:
+            # only the most recent outputs stay available to search
+            self._spills.append(capture)
+            while len(self._spills) > self._max_spills:
+                self._spills.pop(0).remove()
+        return capture.text()
+
+
+class _BackgroundJob:
+    """A command running outside of any session, with its output going to a file."""
+
+    def __init__(self, command: str, process: asyncio.subprocess.Process, path: str):
+        self.command = command
+        self.process = process
+        self.path = path
+        self.offset = 0
+
 
 class BashTool(BaseAnthropicTool):
     """
     A tool that allows the agent to run bash commands.
     The tool parameters are defined by Anthropic and are not editable.
+
+    Beyond them, commands may name a `session`: each name is a separate shell,
+    started on first use, so that independent commands run concurrently. At
+    most max_sessions shells are kept; sessions idle for idle_timeout seconds
+    are stopped, as is a session whose command times out. A command can also
+    run in the `background`, and its output is then polled by `job` id.
     """
 
-    _session: _BashSession | None
+    _sessions: dict[str, _BashSession]
     name: ClassVar[Literal["bash"]] = "bash"
     api_type: ClassVar[Literal["bash_20241022"]] = "bash_20241022"
 
-    def __init__(self):
-        self._session = None
+    def __init__(
+        self,
+        cwd: str | None = None,
+        env: dict[str, str] | None = None,
+        max_sessions: int = 4,
+        session_timeout: float = 120.0,
+        idle_timeout: float = 900.0,
+    ):
+        """The shells start in cwd, with env added to this process's environment."""
+        self._sessions = {}
+        # why sessions were stopped without being asked to, until they are used again
+        self._stopped: dict[str, str] = {}
+        self._jobs: dict[int, _BackgroundJob] = {}
+        self._job_ids = itertools.count(1)
+        self.cwd = cwd
+        self.env = env
+        self.max_sessions = max_sessions
+        self.session_timeout = session_timeout
+        self.idle_timeout = idle_timeout
         super().__init__()
 
     async def __call__(
-        self, command: str | None = None, restart: bool = False, **kwargs
+        self,
+        command: str | None = None,
+        restart: bool = False,
+        session: str = DEFAULT_SESSION,
+        background: bool = False,
+        job: int | None = None,
+        timeout: float | None = None,
+        **kwargs,
     ):
         print("### Running bash command:", command)
+        self._reap_idle_sessions()
+        if job is not None:
+            return await self._job_output(job, kill=restart)
+
         if restart:
-            if self._session:
-                self._session.stop()
-            self._session = _BashSession()
-            await self._session.start()
+            if old := self._sessions.pop(session, None):
+                old.stop()
+            self._stopped.pop(session, None)
+            await self._session(session)
 
             return ToolResult(system="tool has been restarted.")
 
-        if self._session is None:
-            self._session = _BashSession()
-            await self._session.start()
+        if command is None:
+            raise ToolError("no command provided.")
+
+        bash, note = await self._session(session)
+        try:
+            if background:
+                result = await self._start_job(bash, command)
+            else:
+                result = await bash.run(command, timeout)
+            if note:
+                system = f"{result.system}\n{note}" if result.system else note
+                result = result.replace(system=system)
+            return result
+        except ToolError:
+            if not bash.timed_out:
+                raise
+            bash.stop()
+            self._sessions.pop(session, None)
+            self._stopped[session] = (
+                f"after a command ran for {timeout or self.session_timeout:g} seconds"
+            )
+            raise ToolError(
+                f"timed out: bash session '{session}' has not returned in "
+                f"{timeout or self.session_timeout} seconds. It has been stopped and "
+                "its next command starts a new shell."
+            ) from None
+
+    async def _session(self, name: str) -> tuple[_BashSession, str | None]:
+        """
+        Returns the named session, starting it and making room for it if needed,
+        with a note for the model when a session it used was stopped.
+        """
+        if bash := self._sessions.pop(name, None):
+            # most recently used sessions are kept last
+            self._sessions[name] = bash
+            return bash, None
+        notes = []
+        if reason := self._stopped.pop(name, None):
+            notes.append(
+                f"bash session '{name}' was stopped {reason} and has been restarted: "
+                "its working directory, environment variables and shell state "
+                "have been reset."
+            )
+        if len(self._sessions) >= self.max_sessions:
+            idle = [n for n, s in self._sessions.items() if not s.busy]
+            if not idle:
+                raise ToolError(
+                    f"all {self.max_sessions} bash sessions are busy, "
+                    "wait for one or use an existing session"
+                )
+            self._sessions.pop(idle[0]).stop()
+            self._stopped[idle[0]] = f"to make room for session '{name}'"
+            notes.append(
+                f"bash session '{idle[0]}' was stopped to make room for this one, "
+                f"at most {self.max_sessions} sessions are kept."
+            )
+        bash = _BashSession(self.cwd, self.env, self.session_timeout)
+        self._sessions[name] = bash
+        await bash.start()
+        return bash, "\n".join(notes) or None
 
-        if command is not None:
-            return await self._session.run(command)
+    def close(self):
+        """Stops every session and background job, and deletes their output files."""
+        for bash in self._sessions.values():
+            try:
+                bash.stop()
+            except ToolError:
+                # it never started
+                pass
+        self._sessions.clear()
+        self._stopped.clear()
+        for background in self._jobs.values():
+            if background.process.returncode is None:
+                try:
+                    os.killpg(background.process.pid, signal.SIGTERM)
+                except ProcessLookupError:
+                    pass
+            try:
+                os.unlink(background.path)
+            except FileNotFoundError:
+                pass
+        self._jobs.clear()
 
-        raise ToolError("no command provided.")
+    def _reap_idle_sessions(self):
+        now = time.monotonic()
+        for name, bash in list(self._sessions.items()):
+            if not bash.busy and now - bash.last_used > self.idle_timeout:
+                self._sessions.pop(name).stop()
+                self._stopped[name] = (
+                    f"after being idle for {self.idle_timeout:g} seconds"
+                )
+
+    async def _start_job(self, bash: _BashSession, command: str) -> ToolResult:
+        """Starts a command on its own, in the session's current directory."""
+        cwd = (await bash.run("pwd")).output
+        with tempfile.NamedTemporaryFile(
+            prefix="bash_job_", suffix=".log", delete=False
+        ) as output:
+            process = await asyncio.create_subprocess_shell(
+                command,
+                preexec_fn=os.setsid,
+                cwd=cwd or self.cwd,
+                env={**os.environ, **self.env} if self.env else None,
+                stdin=asyncio.subprocess.DEVNULL,
+                stdout=output,
+                stderr=asyncio.subprocess.STDOUT,
+            )
+        job = next(self._job_ids)
+        self._jobs[job] = _BackgroundJob(command, process, output.name)
+        return ToolResult(
+            output=f"Started background job {job} (pid {process.pid}), its output "
+            f"goes to {output.name}. Get its new output with job {job}."
+        )
+
+    async def _job_output(self, job: int, kill: bool = False) -> ToolResult:
+        """The output of a background job since it was last read, and its state."""
+        background = self._jobs.get(job)
+        if background is None:
+            raise ToolError(f"there is no background job {job}")
+        process = background.process
+        if kill and process.returncode is None:
+            try:
+                os.killpg(process.pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+            await process.wait()
+
+        with open(background.path, "rb") as f:
+            f.seek(background.offset)
+            data = f.read(MAX_RESPONSE_LEN + 1)
+        more = len(data) > MAX_RESPONSE_LEN
+        data = data[:MAX_RESPONSE_LEN]
+        background.offset += len(data)
+
+        if process.returncode is None:
+            state = "is running"
+        else:
+            state = f"has exited with returncode {process.returncode}"
+            if not more:
+                # all of its output has been read
+                del self._jobs[job]
+                os.unlink(background.path)
+        output = f"Job {job} {state}."
+        if data:
+            output += f" New output:\n{data.decode(errors='replace')}"
+        if more:
+            output += f"\n<more output follows, get it with job {job} again>"
+        return ToolResult(output=output)
+
+    def resources(self, session: str = DEFAULT_SESSION, job=None, **kwargs):
+        if job is not None:
+            return frozenset(), frozenset({f"bash_job:{job}"})
+        # commands may read and write files or open applications, but only
+        # commands in the same session have to wait for each other
+        return frozenset({"filesystem", "screen"}), frozenset(
+            {f"bash_session:{session}"}
+        )
 
     def to_params(self) -> BetaToolBash20241022Param:
         return {
@@ -1,5 +1,6 @@
 """Collection classes for managing multiple tools."""
 
+import asyncio
 from typing import Any
 
 from anthropic.types.beta import BetaToolUnionParam
@@ -32,3 +33,56 @@ class ToolCollection:
             return await tool(**tool_input)
         except ToolError as e:
             return ToolFailure(error=e.message)
+
+    def resources(
+        self, name: str, tool_input: dict[str, Any]
+    ) -> tuple[frozenset[str], frozenset[str]]:
+        """Returns the (shared, exclusive) resources of a tool call."""
+        tool = self.tool_map.get(name)
+        if not tool:
+            return frozenset(), frozenset()
+        return tool.resources(**tool_input)
+
+    def scheduler(self) -> "ToolScheduler":
+        """Returns a scheduler for the tool calls of one response."""
+        return ToolScheduler(self)
+
+
+class ToolScheduler:
+    """
+    Runs the tool calls of one response concurrently where it is safe to.
+
+    Calls are submitted in order and each one starts as soon as every earlier
+    call it conflicts with (see BaseAnthropicTool.resources) has finished, so
+    e.g. several file views run together while computer actions, which share
+    one screen, stay serialized.
+    """
+
+    def __init__(self, collection: ToolCollection):
+        self.collection = collection
+        self._calls: list[
+            tuple[frozenset[str], frozenset[str], asyncio.Task[ToolResult]]
+        ] = []
+
+    def submit(
+        self, *, name: str, tool_input: dict[str, Any]
+    ) -> asyncio.Task[ToolResult]:
+        shared, exclusive = self.collection.resources(name, tool_input)
+        conflicts = [
+            task
+            for other_shared, other_exclusive, task in self._calls
+            if exclusive & (other_shared | other_exclusive) or other_exclusive & shared
+        ]
+        task = asyncio.create_task(self._run(conflicts, name, tool_input))
+        self._calls.append((shared, exclusive, task))
+        return task
+
+    async def _run(
+        self,
+        conflicts: list[asyncio.Task[ToolResult]],
+        name: str,
+        tool_input: dict[str, Any],
+    ) -> ToolResult:
+        if conflicts:
+            await asyncio.wait(conflicts)
+        return await self.collection.run(name=name, tool_input=tool_input)
@@ -1,17 +1,35 @@
 import asyncio
-import base64
 import io
+import subprocess
+import time
+from dataclasses import dataclass
 from enum import StrEnum
 from typing import Literal, TypedDict
-import pyautogui
 from anthropic.types.beta import BetaToolComputerUse20241022Param
+from PIL import Image, ImageChops
 
+from .backend import ComputerBackend, PyAutoGUIBackend
 from .base import BaseAnthropicTool, ToolError, ToolResult
+from .images import ImageStore
 
 OUTPUT_DIR = "/tmp/outputs"
 
 TYPING_DELAY_MS = 12
 TYPING_GROUP_SIZE = 50
+# Longer text, or text that can't be typed key by key, is pasted instead. The
+# clipboard is restored once the target application has had time to read it.
+PASTE_MIN_LENGTH = 100
+PASTE_RESTORE_DELAY = 0.3
+
+# Screen fingerprints are greyscale captures reduced by this factor; pixels whose
+# grey level moves by no more than the tolerance (a blinking caret) are unchanged
+FINGERPRINT_REDUCTION = 8
+FINGERPRINT_PIXEL_TOLERANCE = 16
+
+# Before a screenshot the screen is sampled every SETTLE_INTERVAL seconds until
+# no more than this fraction of its fingerprint changes between samples
+SETTLE_INTERVAL = 0.05
+SETTLE_CHANGE_THRESHOLD = 0.001
 
 Action = Literal[
     "key",
@@ -27,11 +45,47 @@ Action = Literal[
 ]
 
 
+TypeMethod = Literal["auto", "keys", "chunks", "paste"]
+
+
 class ScalingSource(StrEnum):
     COMPUTER = "computer"
     API = "api"
 
 
+class ImageFormat(StrEnum):
+    PNG = "png"
+    JPEG = "jpeg"
+    WEBP = "webp"
+
+
+@dataclass(frozen=True)
+class ScreenshotEncoding:
+    """
+    How screenshots are encoded. PNG is lossless and `compress_level` (0-9)
+    trades size for encoding time; JPEG and WebP are lossy at `quality` (1-100)
+    and are much faster to encode and smaller to send.
+    """
+
+    format: ImageFormat = ImageFormat.PNG
+    compress_level: int = 1
+    quality: int = 80
+
+    @property
+    def media_type(self) -> str:
+        return f"image/{self.format.value}"
+
+    def encode(self, image: Image.Image) -> bytes:
+        buffer = io.BytesIO()
+        if self.format == ImageFormat.PNG:
+            image.save(buffer, format="PNG", compress_level=self.compress_level)
+        elif self.format == ImageFormat.JPEG:
+            image.convert("RGB").save(buffer, format="JPEG", quality=self.quality)
+        else:
+            image.save(buffer, format="WEBP", quality=self.quality, method=0)
+        return buffer.getvalue()
+
+
 class ComputerToolOptions(TypedDict):
     display_height_px: int
     display_width_px: int
@@ -42,9 +96,23 @@ def chunks(s: str, chunk_size: int) -> list[str]:
     return [s[i : i + chunk_size] for i in range(0, len(s), chunk_size)]
 
 
+def screen_fingerprint(image: Image.Image) -> Image.Image:
+    """A small greyscale copy of a screen capture that is cheap to compare."""
+    return image.reduce(FINGERPRINT_REDUCTION).convert("L")
+
+
+def fingerprint_change(a: Image.Image, b: Image.Image) -> float:
+    """The fraction of pixels that differ noticeably between two fingerprints."""
+    if a.size != b.size:
+        return 1.0
+    histogram = ImageChops.difference(a, b).histogram()
+    return sum(histogram[FINGERPRINT_PIXEL_TOLERANCE + 1 :]) / (a.width * a.height)
+
+
 class ComputerTool(BaseAnthropicTool):
     """
-    A tool that allows the agent to interact with the screen, keyboard, and mouse of the current computer.
+    A tool that allows the agent to interact with the screen, keyboard, and mouse of the current computer,
+    or of the display of another backend such as a headless Xvfb server.
     The tool parameters are defined by Anthropic and are not editable.
     """
 
@@ -54,7 +122,6 @@ class ComputerTool(BaseAnthropicTool):
     height: int
     display_num: int | None
 
-    _screenshot_delay = 1.0
     _scaling_enabled = True
 
     @property
@@ -68,13 +135,47 @@ class ComputerTool(BaseAnthropicTool):
     def to_params(self) -> BetaToolComputerUse20241022Param:
         return {"name": self.name, "type": self.api_type, **self.options}
 
-    def __init__(self):
+    def resources(self, **kwargs):
+        # every action reads or drives the one screen
+        return frozenset(), frozenset({"screen"})
+
+    def __init__(
+        self,
+        image_store: ImageStore | None = None,
+        unchanged_threshold: float | None = 0.0,
+        encoding: ScreenshotEncoding | None = None,
+        settle_time: float = 0.3,
+        settle_timeout: float = 3.0,
+        backend: ComputerBackend | None = None,
+    ):
+        """
+        unchanged_threshold is the fraction of the screen that may change while a
+        screenshot still counts as unchanged since the last one returned, in
+        which case a short text result is returned instead of the image. None
+        always returns the image.
+
+        A screenshot taken within settle_timeout seconds of an action waits until
+        the screen is still: at once if it is not changing, otherwise once it has
+        been stable for settle_time seconds, or until settle_timeout has passed
+        since the action.
+        """
         super().__init__()
 
-        self.width = int(pyautogui.size()[0])
-        self.height = int(pyautogui.size()[1])
+        self.backend = backend or PyAutoGUIBackend()
+        self.settle_time = settle_time
+        self.settle_timeout = settle_timeout
+        self.last_settle_duration = 0.0
+        self._last_action_time: float | None = None
+
+        self.image_store = image_store or ImageStore()
+        self.encoding = encoding or ScreenshotEncoding()
+        self.unchanged_threshold = unchanged_threshold
+        self._last_fingerprint: Image.Image | None = None
+
+        self.width, self.height = self.backend.size()
 
-        self.display_num = None  # Not used on MacOS
+        # None when driving the local screen
+        self.display_num = self.backend.display_num
 
         MAX_WIDTH = 1280  # Max screenshot width
         if self.width > MAX_WIDTH:
@@ -92,10 +193,28 @@ class ComputerTool(BaseAnthropicTool):
         action: Action,
         text: str | None = None,
         coordinate: list[int] | None = None,
+        force: bool = False,
+        method: TypeMethod = "auto",
         **kwargs,
+    ):
+        if action in ("screenshot", "cursor_position"):
+            return await self._act(action, text, coordinate, force, method)
+        try:
+            return await self._act(action, text, coordinate, force, method)
+        finally:
+            # the screen may still be reacting to this action
+            self._last_action_time = time.monotonic()
+
+    async def _act(
+        self,
+        action: Action,
+        text: str | None,
+        coordinate: list[int] | None,
+        force: bool,
+        method: TypeMethod,
     ):
         print(
-                f"### Performing action: {action} TEXT: {text if text else ''} COORDINATE: {coordinate if coordinate else ''}"
+            f"### Performing action: {action} TEXT: {text if text else ''} COORDINATE: {coordinate if coordinate else ''}"
         )
         if action in ("mouse_move", "left_click_drag"):
             if coordinate is None:
@@ -112,12 +231,12 @@ class ComputerTool(BaseAnthropicTool):
             )
 
             if action == "mouse_move":
-                await asyncio.to_thread(pyautogui.moveTo, x, y)
+                await asyncio.to_thread(self.backend.move, x, y)
                 return ToolResult(output=f"Mouse moved successfully to X={x}, Y={y}")
             elif action == "left_click_drag":
-                await asyncio.to_thread(pyautogui.mouseDown)
-                await asyncio.to_thread(pyautogui.moveTo, x, y)
-                await asyncio.to_thread(pyautogui.mouseUp)
+                await asyncio.to_thread(self.backend.mouse_down)
+                await asyncio.to_thread(self.backend.move, x, y)
+                await asyncio.to_thread(self.backend.mouse_up)
                 return ToolResult(output="Mouse drag action completed.")
 
         if action in ("key", "type"):
@@ -159,12 +278,11 @@ class ComputerTool(BaseAnthropicTool):
                     # Add more special keys as needed
                 }
                 key_sequence = [special_keys.get(key, key) for key in key_sequence]
-                await asyncio.to_thread(pyautogui.hotkey, *key_sequence)
+                await asyncio.to_thread(self.backend.hotkey, *key_sequence)
                 return ToolResult(output=f"Key combination '{text}' pressed.")
             elif action == "type":
-                await asyncio.to_thread(
-                    pyautogui.write, text, interval=TYPING_DELAY_MS / 1000.0
-                )
+                if await self.type_text(text, method) == "paste":
+                    return ToolResult(output=f"Pasted text: {text}")
                 return ToolResult(output=f"Typed text: {text}")
 
         if action in (
@@ -180,39 +298,158 @@ class ComputerTool(BaseAnthropicTool):
                 raise ToolError(f"coordinate is not accepted for {action}")
 
             if action == "screenshot":
-                return await self.screenshot()
+                return await self.screenshot(force=force)
             elif action == "cursor_position":
-                x, y = pyautogui.position()
+                x, y = await asyncio.to_thread(self.backend.position)
                 x, y = self.scale_coordinates(ScalingSource.COMPUTER, int(x), int(y))
                 return ToolResult(output=f"X={x},Y={y}")
             else:
                 if action == "left_click":
-                    await asyncio.to_thread(pyautogui.click, button="left")
+                    await asyncio.to_thread(self.backend.click, "left")
                     return ToolResult(output="Left click performed.")
                 elif action == "right_click":
-                    await asyncio.to_thread(pyautogui.click, button="right")
+                    await asyncio.to_thread(self.backend.click, "right")
                     return ToolResult(output="Right click performed.")
                 elif action == "double_click":
-                    await asyncio.to_thread(pyautogui.doubleClick)
+                    await asyncio.to_thread(self.backend.double_click)
                     return ToolResult(output="Double click performed.")
 
         raise ToolError(f"Invalid action: {action}")
 
-    async def screenshot(self):
-        """Take a screenshot of the current screen and return the base64 encoded image."""
-        # Capture screenshot using PyAutoGUI
-        screenshot = await asyncio.to_thread(pyautogui.screenshot)
+    async def type_text(self, text: str, method: TypeMethod = "auto") -> TypeMethod:
+        """
+        Enter text with the given method and return the method used. "keys" types
+        each character with a short delay, "chunks" writes groups of characters
+        without delays and "paste" pastes through the clipboard, falling back to
+        chunks when the clipboard is unavailable. "auto" pastes long text, and
+        text the backend cannot type key by key, and types the rest.
+        """
+        if method == "auto":
+            typeable = text.isascii() or self.backend.types_unicode
+            method = "keys" if len(text) < PASTE_MIN_LENGTH and typeable else "paste"
+        if method == "paste":
+            try:
+                await self._paste(text)
+                return method
+            except (OSError, subprocess.SubprocessError):
+                method = "chunks"
+        if method == "keys":
+            await asyncio.to_thread(self.backend.write, text, TYPING_DELAY_MS / 1000.0)
+        elif method == "chunks":
+            for chunk in chunks(text, TYPING_GROUP_SIZE):
+                await asyncio.to_thread(self.backend.write, chunk)
+        else:
+            raise ToolError(f"Invalid method for type: {method}")
+        return method
+
+    async def _paste(self, text: str):
+        # all of the clipboard is put back, not only its text
+        saved = await asyncio.to_thread(self.backend.save_clipboard)
+        await asyncio.to_thread(self.backend.set_clipboard, text)
+        try:
+            await asyncio.to_thread(self.backend.hotkey, *self.backend.paste_keys)
+            await asyncio.sleep(PASTE_RESTORE_DELAY)
+        finally:
+            await asyncio.to_thread(self.backend.restore_clipboard, saved)
+
+    async def screenshot(self, force: bool = False):
+        """
+        Take a screenshot of the current screen and return a handle to the encoded image.
+        Unless forced, a screen that is unchanged since the last screenshot returned
+        is reported as text instead.
+        """
+        screenshot, fingerprint, settled = await self.settle()
+        system = (
+            f"The screen settled {self.last_settle_duration:.2f}s after the action."
+            if settled and self.last_settle_duration
+            else None
+        )
 
+        if (
+            not force
+            and self.unchanged_threshold is not None
+            and self._last_fingerprint is not None
+            and fingerprint_change(fingerprint, self._last_fingerprint)
+            <= self.unchanged_threshold
+        ):
+            return ToolResult(
+                output="Screen unchanged since last screenshot. "
+                "Use the screenshot action with `force: true` to get the image anyway.",
+                system=system,
+            )
+        self._last_fingerprint = fingerprint
+
+        # Resizing and encoding a full capture is slow, keep it off the event loop
+        data = await asyncio.to_thread(self.encode_screenshot, screenshot)
+        image = self.image_store.put(data, self.encoding.media_type)
+        if not settled:
+            return ToolResult(
+                output=f"The screen was still changing after {self.settle_timeout}s.",
+                image=image,
+            )
+        return ToolResult(image=image, system=system)
+
+    async def settle(self) -> tuple[Image.Image, Image.Image, bool]:
+        """
+        Wait for the screen to stop changing after the last action and return a
+        full capture of it, its fingerprint and whether the screen settled before
+        the timeout.
+        """
+        settled = await self.wait()
+        screenshot = await asyncio.to_thread(self.backend.screenshot)
+        return screenshot, screen_fingerprint(screenshot), settled
+
+    async def wait(self) -> bool:
+        """
+        Wait for the screen to stop changing after the last action and return
+        whether it settled before the timeout. The screen is polled with the
+        backend's reduced samples, no full capture is taken. A screen that does
+        not change between the first two samples is settled at once; one that
+        does has to stay still for settle_time. How long this took is kept in
+        last_settle_duration, 0 when there was no action to wait for.
+        """
+        start = time.monotonic()
+        settled = True
+        self.last_settle_duration = 0.0
+        if (
+            self._last_action_time is not None
+            and start < self._last_action_time + self.settle_timeout
+        ):
+            # poll with reduced samples, which are much cheaper than screenshots
+            deadline = self._last_action_time + self.settle_timeout
+            stable_since = None
+            sample = await asyncio.to_thread(self.backend.sample, FINGERPRINT_REDUCTION)
+            while True:
+                if time.monotonic() >= deadline:
+                    settled = False
+                    break
+                await asyncio.sleep(SETTLE_INTERVAL)
+                previous, sample = sample, await asyncio.to_thread(
+                    self.backend.sample, FINGERPRINT_REDUCTION
+                )
+                if fingerprint_change(sample, previous) > SETTLE_CHANGE_THRESHOLD:
+                    stable_since = time.monotonic()
+                elif (
+                    stable_since is None
+                    or time.monotonic() - stable_since >= self.settle_time
+                ):
+                    break
+            self.last_settle_duration = time.monotonic() - start
+
+        if settled:
+            # nothing more is expected from that action
+            self._last_action_time = None
+        return settled
+
+    def encode_screenshot(self, screenshot: Image.Image) -> bytes:
+        """Scale a screen capture to the target size and encode it."""
         if self._scaling_enabled and self.scale_factor < 1.0:
             screenshot = screenshot.resize((self.target_width, self.target_height))
+        return self.encoding.encode(screenshot)
 
-        img_buffer = io.BytesIO()
-        # Save the image to an in-memory buffer
-        screenshot.save(img_buffer, format="PNG", optimize=True)
-        img_buffer.seek(0)
-        base64_image = base64.b64encode(img_buffer.read()).decode()
-
-        return ToolResult(base64_image=base64_image)
+    def reset_screenshot_cache(self):
+        """Forget the last screenshot, so that the next one is always returned."""
+        self._last_fingerprint = None
 
     def scale_coordinates(self, source: ScalingSource, x: int, y: int):
         """Scale coordinates between the assistant's coordinate system and the real screen coordinates."""
@@ -1,11 +1,17 @@
-from collections import defaultdict
+import asyncio
+import itertools
+import os
+import shutil
+import tempfile
 from pathlib import Path
 from typing import Literal, get_args
 
 from anthropic.types.beta import BetaToolTextEditor20241022Param
 
 from .base import BaseAnthropicTool, CLIResult, ToolError, ToolResult
-from .run import maybe_truncate, run
+from .history import EditHistory
+from .lines import LineIndexCache, read_head
+from .run import MAX_RESPONSE_LEN, maybe_truncate
 
 Command = Literal[
     "view",
@@ -13,8 +19,11 @@ Command = Literal[
     "str_replace",
     "insert",
     "undo_edit",
+    "multi_edit",
 ]
 SNIPPET_LINES: int = 4
+# files from this size on are viewed through a line index instead of read whole
+LINE_INDEX_MIN_SIZE: int = 1024 * 1024
 
 
 class EditTool(BaseAnthropicTool):
@@ -26,10 +35,11 @@ class EditTool(BaseAnthropicTool):
     api_type: Literal["text_editor_20241022"] = "text_editor_20241022"
     name: Literal["str_replace_editor"] = "str_replace_editor"
 
-    _file_history: dict[Path, list[str]]
+    _file_history: EditHistory
 
-    def __init__(self):
-        self._file_history = defaultdict(list)
+    def __init__(self, history: EditHistory | None = None):
+        self._file_history = history or EditHistory()
+        self._line_indexes = LineIndexCache()
         super().__init__()
 
     def to_params(self) -> BetaToolTextEditor20241022Param:
@@ -38,6 +48,11 @@ class EditTool(BaseAnthropicTool):
             "type": self.api_type,
         }
 
+    def resources(self, *, command: str | None = None, **kwargs):
+        if command == "view":
+            return frozenset({"filesystem"}), frozenset()
+        return frozenset(), frozenset({"filesystem"})
+
     async def __call__(
         self,
         *,
@@ -48,6 +63,7 @@ class EditTool(BaseAnthropicTool):
         old_str: str | None = None,
         new_str: str | None = None,
         insert_line: int | None = None,
+        edits: list[dict] | None = None,
         **kwargs,
     ):
         _path = Path(path)
@@ -58,7 +74,7 @@ class EditTool(BaseAnthropicTool):
             if not file_text:
                 raise ToolError("Parameter `file_text` is required for command: create")
             self.write_file(_path, file_text)
-            self._file_history[_path].append(file_text)
+            self._file_history.push(_path, file_text)
             return ToolResult(output=f"File created successfully at: {_path}")
         elif command == "str_replace":
             if not old_str:
@@ -76,6 +92,10 @@ class EditTool(BaseAnthropicTool):
             return self.insert(_path, insert_line, new_str)
         elif command == "undo_edit":
             return self.undo_edit(_path)
+        elif command == "multi_edit":
+            if not edits:
+                raise ToolError("Parameter `edits` is required for command: multi_edit")
+            return self.multi_edit(_path, edits)
         raise ToolError(
             f'Unrecognized command {command}. The allowed commands for the {self.name} tool are: {", ".join(get_args(Command))}'
         )
@@ -114,35 +134,21 @@ class EditTool(BaseAnthropicTool):
                     "The `view_range` parameter is not allowed when `path` points to a directory."
                 )
 
-            _, stdout, stderr = await run(
-                rf"find {path} -maxdepth 2 -not -path '*/\.*'"
-            )
+            stdout, stderr = await asyncio.to_thread(self.list_directory, path)
             if not stderr:
                 stdout = f"Here's the files and directories up to 2 levels deep in {path}, excluding hidden items:\n{stdout}\n"
             return CLIResult(output=stdout, error=stderr)
 
+        if path.stat().st_size >= LINE_INDEX_MIN_SIZE:
+            return await asyncio.to_thread(self.view_large_file, path, view_range)
+
         file_content = self.read_file(path)
         init_line = 1
         if view_range:
-            if len(view_range) != 2 or not all(isinstance(i, int) for i in view_range):
-                raise ToolError(
-                    "Invalid `view_range`. It should be a list of two integers."
-                )
             file_lines = file_content.split("\n")
-            n_lines_file = len(file_lines)
-            init_line, final_line = view_range
-            if init_line < 1 or init_line > n_lines_file:
-                raise ToolError(
-                    f"Invalid `view_range`: {view_range}. It's first element `{init_line}` should be within the range of lines of the file: {[1, n_lines_file]}"
-                )
-            if final_line > n_lines_file:
-                raise ToolError(
-                    f"Invalid `view_range`: {view_range}. It's second element `{final_line}` should be smaller than the number of lines in the file: `{n_lines_file}`"
-                )
-            if final_line != -1 and final_line < init_line:
-                raise ToolError(
-                    f"Invalid `view_range`: {view_range}. It's second element `{final_line}` should be larger or equal than its first `{init_line}`"
-                )
+            init_line, final_line = self.validate_view_range(
+                view_range, len(file_lines)
+            )
 
             if final_line == -1:
                 file_content = "\n".join(file_lines[init_line - 1 :])
@@ -153,6 +159,75 @@ class EditTool(BaseAnthropicTool):
             output=self._make_output(file_content, str(path), init_line=init_line)
         )
 
+    def view_large_file(self, path: Path, view_range: list[int] | None = None):
+        """
+        View a large file, reading only the lines in view_range, or only as much
+        of its start as the output can show.
+        """
+        try:
+            if not view_range:
+                file_content = read_head(path, MAX_RESPONSE_LEN + 1)
+                return CLIResult(output=self._make_output(file_content, str(path)))
+            index = self._line_indexes.get(path)
+            init_line, final_line = self.validate_view_range(
+                view_range, index.line_count
+            )
+            file_content = index.read(init_line, final_line)
+        except (OSError, UnicodeDecodeError) as e:
+            raise ToolError(f"Ran into {e} while trying to read {path}") from None
+        return CLIResult(
+            output=self._make_output(file_content, str(path), init_line=init_line)
+        )
+
+    def validate_view_range(self, view_range: list[int], n_lines_file: int):
+        """Check that view_range is valid for a file of n_lines_file lines."""
+        if len(view_range) != 2 or not all(isinstance(i, int) for i in view_range):
+            raise ToolError(
+                "Invalid `view_range`. It should be a list of two integers."
+            )
+        init_line, final_line = view_range
+        if init_line < 1 or init_line > n_lines_file:
+            raise ToolError(
+                f"Invalid `view_range`: {view_range}. It's first element `{init_line}` should be within the range of lines of the file: {[1, n_lines_file]}"
+            )
+        if final_line > n_lines_file:
+            raise ToolError(
+                f"Invalid `view_range`: {view_range}. It's second element `{final_line}` should be smaller than the number of lines in the file: `{n_lines_file}`"
+            )
+        if final_line != -1 and final_line < init_line:
+            raise ToolError(
+                f"Invalid `view_range`: {view_range}. It's second element `{final_line}` should be larger or equal than its first `{init_line}`"
+            )
+        return init_line, final_line
+
+    def list_directory(self, path: Path, depth: int = 2):
+        """
+        List the files and directories up to depth levels deep in path, excluding
+        hidden items, one per line. Returns the listing and any errors.
+        """
+        lines = [str(path)]
+        errors = []
+
+        def walk(directory: str, depth: int):
+            try:
+                with os.scandir(directory) as it:
+                    entries = sorted(
+                        (e for e in it if not e.name.startswith(".")),
+                        key=lambda e: e.name,
+                    )
+            except OSError as e:
+                errors.append(f"{directory}: {e.strerror}")
+                return
+            for entry in entries:
+                lines.append(entry.path)
+                if depth > 1 and entry.is_dir(follow_symlinks=False):
+                    walk(entry.path, depth - 1)
+
+        walk(str(path), depth)
+        return "".join(f"{line}\n" for line in lines), "".join(
+            f"{error}\n" for error in errors
+        )
+
     def str_replace(self, path: Path, old_str: str, new_str: str | None):
         """Implement the str_replace command, which replaces old_str with new_str in the file content"""
         # Read the file content
@@ -184,7 +259,7 @@ class EditTool(BaseAnthropicTool):
         self.write_file(path, new_file_content)
 
         # Save the content to history
-        self._file_history[path].append(file_content)
+        self._file_history.push(path, file_content)
 
         # Create a snippet of the edited section
         replacement_line = file_content.split(old_str)[0].count("\n")
@@ -229,7 +304,7 @@ class EditTool(BaseAnthropicTool):
         snippet = "\n".join(snippet_lines)
 
         self.write_file(path, new_file_text)
-        self._file_history[path].append(file_text)
+        self._file_history.push(path, file_text)
 
         success_msg = f"The file {path} has been edited. "
         success_msg += self._make_output(
@@ -240,12 +315,131 @@ class EditTool(BaseAnthropicTool):
         success_msg += "Review the changes and make sure they are as expected (correct indentation, no duplicate lines, etc). Edit the file again if necessary."
         return CLIResult(output=success_msg)
 
+    def multi_edit(self, path: Path, edits: list[dict]):
+        """
+        Implement the multi_edit command, which applies several replacements
+        ({old_str, new_str}) and insertions ({insert_line, new_str}) to the file
+        content in one pass. Every edit refers to the file as it was before the
+        command and is checked before any is applied; the file is then written
+        once, atomically, and undone as one edit.
+        """
+        file_content = self.read_file(path).expandtabs()
+        file_lines = file_content.split("\n")
+        n_lines_file = len(file_lines)
+        line_starts = list(
+            itertools.accumulate((len(line) + 1 for line in file_lines), initial=0)
+        )
+
+        # (start, end, new text, edit number) of each change to file_content
+        changes: list[tuple[int, int, str, int]] = []
+        for number, edit in enumerate(edits, start=1):
+            if not isinstance(edit, dict):
+                raise ToolError(
+                    f"No edits were performed. Edit {number} should be an object with `old_str` or `insert_line`, and `new_str`."
+                )
+            new_str = edit.get("new_str")
+            new_str = new_str.expandtabs() if new_str is not None else ""
+            if edit.get("old_str"):
+                old_str = edit["old_str"].expandtabs()
+                occurrences = file_content.count(old_str)
+                if occurrences == 0:
+                    raise ToolError(
+                        f"No edits were performed. In edit {number}, old_str `{old_str}` did not appear verbatim in {path}."
+                    )
+                elif occurrences > 1:
+                    lines = [
+                        idx + 1
+                        for idx, line in enumerate(file_lines)
+                        if old_str in line
+                    ]
+                    raise ToolError(
+                        f"No edits were performed. In edit {number}, there are multiple occurrences of old_str `{old_str}` in lines {lines}. Please ensure it is unique"
+                    )
+                start = file_content.index(old_str)
+                changes.append((start, start + len(old_str), new_str, number))
+            elif edit.get("insert_line") is not None:
+                insert_line = edit["insert_line"]
+                if not isinstance(insert_line, int) or not (
+                    0 <= insert_line <= n_lines_file
+                ):
+                    raise ToolError(
+                        f"No edits were performed. Invalid `insert_line` in edit {number}: {insert_line}. It should be within the range of lines of the file: {[0, n_lines_file]}"
+                    )
+                if not new_str:
+                    raise ToolError(
+                        f"No edits were performed. Parameter `new_str` is required to insert in edit {number}."
+                    )
+                if insert_line == n_lines_file:
+                    end = len(file_content)
+                    changes.append((end, end, f"\n{new_str}", number))
+                else:
+                    start = line_starts[insert_line]
+                    changes.append((start, start, f"{new_str}\n", number))
+            else:
+                raise ToolError(
+                    f"No edits were performed. Edit {number} should have `old_str` or `insert_line`."
+                )
+
+        # insertions come before a replacement that starts at the same place
+        changes.sort(key=lambda change: change[:2])
+        for previous, change in zip(changes, changes[1:]):
+            if change[0] < previous[1]:
+                raise ToolError(
+                    f"No edits were performed. Edits {previous[3]} and {change[3]} overlap."
+                )
+
+        parts = []
+        new_starts = []
+        position = 0
+        length = 0
+        for start, end, new_text, _ in changes:
+            parts.append(file_content[position:start])
+            length += start - position
+            new_starts.append(length)
+            parts.append(new_text)
+            length += len(new_text)
+            position = end
+        parts.append(file_content[position:])
+        new_file_content = "".join(parts)
+
+        self.write_file_atomic(path, new_file_content)
+        self._file_history.push(path, file_content)
+
+        # one snippet for each group of edits whose snippets would overlap
+        windows: list[tuple[int, int, list[int]]] = []
+        for (_, _, new_text, number), new_start in zip(changes, new_starts):
+            edit_line = new_file_content.count("\n", 0, new_start)
+            start_line = max(0, edit_line - SNIPPET_LINES)
+            end_line = edit_line + SNIPPET_LINES + new_text.count("\n")
+            if windows and start_line <= windows[-1][1] + 1:
+                previous_start, previous_end, numbers = windows[-1]
+                windows[-1] = (
+                    previous_start,
+                    max(previous_end, end_line),
+                    numbers + [number],
+                )
+            else:
+                windows.append((start_line, end_line, [number]))
+
+        success_msg = f"The file {path} has been edited with {len(changes)} edits. "
+        new_file_lines = new_file_content.split("\n")
+        for start_line, end_line, numbers in windows:
+            snippet = "\n".join(new_file_lines[start_line : end_line + 1])
+            edit_numbers = ", ".join(str(number) for number in sorted(numbers))
+            success_msg += self._make_output(
+                snippet,
+                f"a snippet of {path} around edits {edit_numbers}",
+                start_line + 1,
+            )
+        success_msg += "Review the changes and make sure they are as expected. Edit the file again if necessary."
+        return CLIResult(output=success_msg)
+
     def undo_edit(self, path: Path):
         """Implement the undo_edit command."""
-        if not self._file_history[path]:
+        old_text = self._file_history.pop(path)
+        if old_text is None:
             raise ToolError(f"No edit history found for {path}.")
 
-        old_text = self._file_history[path].pop()
         self.write_file(path, old_text)
 
         return CLIResult(
@@ -266,6 +460,30 @@ class EditTool(BaseAnthropicTool):
         except Exception as e:
             raise ToolError(f"Ran into {e} while trying to write to {path}") from None
 
+    def write_file_atomic(self, path: Path, file: str):
+        """
+        Write a file through a temporary file renamed over it, so that it is never
+        left half written; raise a ToolError if an error occurs.
+        """
+        target = path.resolve()
+        temp_path = None
+        try:
+            with tempfile.NamedTemporaryFile(
+                "w",
+                dir=target.parent,
+                prefix=f".{target.name}.",
+                suffix=".tmp",
+                delete=False,
+            ) as f:
+                temp_path = f.name
+                f.write(file)
+            shutil.copymode(target, temp_path)
+            os.replace(temp_path, target)
+        except Exception as e:
+            if temp_path and os.path.exists(temp_path):
+                os.unlink(temp_path)
+            raise ToolError(f"Ran into {e} while trying to write to {path}") from None
+
     def _make_output(
         self,
         file_content: str,
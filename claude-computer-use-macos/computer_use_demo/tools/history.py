@@ -0,0 +1,128 @@
+"""Undo history of the edit tool, stored as reverse diffs."""
+
+import itertools
+import zlib
+from dataclasses import dataclass
+from pathlib import Path
+
+COMPRESS_MIN_LENGTH = 1024
+_CHUNK = 64 * 1024
+
+
+def _pack(text: str) -> str | bytes:
+    if len(text) < COMPRESS_MIN_LENGTH:
+        return text
+    return zlib.compress(text.encode(), 1)
+
+
+def _unpack(data: str | bytes) -> str:
+    return data if isinstance(data, str) else zlib.decompress(data).decode()
+
+
+def _common_prefix(a: str, b: str) -> int:
+    """The length of the common prefix of a and b, compared a chunk at a time."""
+    n = min(len(a), len(b))
+    start = 0
+    while start < n and a[start : start + _CHUNK] == b[start : start + _CHUNK]:
+        start += _CHUNK
+    if start >= n:
+        return n
+    low, high = start, min(start + _CHUNK, n)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if a[start:middle] == b[start:middle]:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+@dataclass
+class _Entry:
+    """
+    A text to restore. The newest entry of a file holds its whole text, every
+    older one only what differs from the text of the entry after it: that text
+    keeps its first `prefix` and last `suffix` chars, with `data` in between.
+    """
+
+    seq: int
+    data: str | bytes
+    prefix: int = 0
+    suffix: int = 0
+
+    @property
+    def size(self) -> int:
+        return len(self.data)
+
+
+class EditHistory:
+    """
+    The texts that undo restores, a stack per file. A small edit to a large file
+    costs about the size of the edit rather than a copy of the file. The oldest
+    entries are dropped once a file's history holds more than max_file_bytes, or
+    all histories together more than max_bytes.
+    """
+
+    def __init__(
+        self,
+        max_file_bytes: int = 16 * 1024 * 1024,
+        max_bytes: int = 64 * 1024 * 1024,
+    ):
+        self.max_file_bytes = max_file_bytes
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries: dict[Path, list[_Entry]] = {}
+        self._sizes: dict[Path, int] = {}
+        self._seq = itertools.count()
+
+    def push(self, path: Path, text: str):
+        """Stores a text to restore on the next undo of path."""
+        entries = self._entries.setdefault(path, [])
+        if entries:
+            tip = entries[-1]
+            old = _unpack(tip.data)
+            prefix = _common_prefix(old, text)
+            suffix = _common_prefix(old[prefix:][::-1], text[prefix:][::-1])
+            middle = _pack(old[prefix : len(old) - suffix])
+            self._replace(path, -1, _Entry(tip.seq, middle, prefix, suffix))
+        entries.append(_Entry(next(self._seq), _pack(text)))
+        self._resize(path, entries[-1].size)
+        self._evict(path)
+
+    def pop(self, path: Path) -> str | None:
+        """The text the last edit of path replaced, None if there is none."""
+        entries = self._entries.get(path)
+        if not entries:
+            return None
+        tip = entries[-1]
+        text = _unpack(tip.data)
+        self._drop(path, -1)
+        if entries:
+            diff = entries[-1]
+            end = len(text) - diff.suffix
+            previous = text[: diff.prefix] + _unpack(diff.data) + text[end:]
+            self._replace(path, -1, _Entry(diff.seq, _pack(previous)))
+        return text
+
+    def _replace(self, path: Path, index: int, entry: _Entry):
+        entries = self._entries[path]
+        self._resize(path, entry.size - entries[index].size)
+        entries[index] = entry
+
+    def _drop(self, path: Path, index: int):
+        entries = self._entries[path]
+        self._resize(path, -entries.pop(index).size)
+        if not entries:
+            del self._entries[path]
+            del self._sizes[path]
+
+    def _resize(self, path: Path, change: int):
+        self._sizes[path] = self._sizes.get(path, 0) + change
+        self.size += change
+
+    def _evict(self, path: Path):
+        while path in self._entries and self._sizes[path] > self.max_file_bytes:
+            self._drop(path, 0)
+        while self.size > self.max_bytes:
+            oldest = min(self._entries, key=lambda p: self._entries[p][0].seq)
+            self._drop(oldest, 0)
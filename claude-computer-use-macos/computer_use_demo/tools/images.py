@@ -0,0 +1,107 @@
+"""Out-of-band storage for the images returned by tools."""
+
+import base64
+import itertools
+import os
+import shutil
+import tempfile
+import weakref
+from collections import OrderedDict
+
+
+class ImageHandle:
+    """
+    A lightweight reference to an image held by an ImageStore. Handles are kept
+    in the message history in place of base64 data, which is only produced when
+    a request is serialized.
+    """
+
+    __slots__ = ("store", "key", "media_type", "size")
+
+    def __init__(self, store: "ImageStore", key: int, media_type: str, size: int):
+        self.store = store
+        self.key = key
+        self.media_type = media_type
+        self.size = size
+
+    def read(self) -> bytes:
+        """Returns the image bytes."""
+        return self.store.read(self)
+
+    def base64(self) -> str:
+        """Returns the image as a base64 string, as sent to the API."""
+        return base64.b64encode(self.read()).decode()
+
+    def release(self):
+        """Drops the image from its store."""
+        self.store.release(self)
+
+    def __repr__(self):
+        return f"ImageHandle({self.key}, {self.media_type}, {self.size} bytes)"
+
+
+class ImageStore:
+    """
+    Holds each image's bytes once. The most recent images are kept in memory up
+    to `memory_limit` bytes; older ones spill to files in a temporary directory
+    that is removed when the store is closed or garbage collected.
+    """
+
+    def __init__(self, memory_limit: int = 64 * 1024 * 1024):
+        self.memory_limit = memory_limit
+        self._memory: OrderedDict[int, bytes] = OrderedDict()
+        self._memory_size = 0
+        self._spilled: dict[int, str] = {}
+        self._spill_dir: str | None = None
+        self._keys = itertools.count()
+        self._finalizer = None
+
+    def put(self, data: bytes, media_type: str = "image/png") -> ImageHandle:
+        """Stores image bytes and returns a handle to them."""
+        key = next(self._keys)
+        self._memory[key] = data
+        self._memory_size += len(data)
+        self._spill()
+        return ImageHandle(self, key, media_type, len(data))
+
+    def read(self, handle: ImageHandle) -> bytes:
+        if handle.key in self._memory:
+            return self._memory[handle.key]
+        if handle.key in self._spilled:
+            with open(self._spilled[handle.key], "rb") as f:
+                return f.read()
+        raise KeyError(f"{handle!r} has been released")
+
+    def release(self, handle: ImageHandle):
+        if handle.key in self._memory:
+            self._memory_size -= len(self._memory.pop(handle.key))
+        elif handle.key in self._spilled:
+            os.remove(self._spilled.pop(handle.key))
+
+    @property
+    def memory_size(self) -> int:
+        """Bytes of image data currently held in memory."""
+        return self._memory_size
+
+    def _spill(self):
+        """Moves the oldest in-memory images to disk until under the memory limit."""
+        while self._memory_size > self.memory_limit and len(self._memory) > 1:
+            key, data = self._memory.popitem(last=False)
+            if self._spill_dir is None:
+                self._spill_dir = tempfile.mkdtemp(prefix="image_store_")
+                self._finalizer = weakref.finalize(
+                    self, shutil.rmtree, self._spill_dir, ignore_errors=True
+                )
+            path = os.path.join(self._spill_dir, str(key))
+            with open(path, "wb") as f:
+                f.write(data)
+            self._spilled[key] = path
+            self._memory_size -= len(data)
+
+    def close(self):
+        """Drops every image and removes the spill directory."""
+        self._memory.clear()
+        self._memory_size = 0
+        self._spilled.clear()
+        if self._finalizer:
+            self._finalizer()
@@ -0,0 +1,100 @@
+"""Reading ranges of lines from large files without reading the whole file."""
+
+import codecs
+import mmap
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+from pathlib import Path
+
+BLOCK_SIZE = 64 * 1024
+
+
+def _normalize_newlines(text: str) -> str:
+    # \r\n line endings read as \n, as with Path.read_text
+    return text.replace("\r\n", "\n")
+
+
+def read_head(path: Path, chars: int) -> str:
+    """The first `chars` characters of a UTF-8 file, or all of it if it is shorter."""
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    with path.open("rb") as f:
+        # a character is at most 4 bytes, one more for a \r\n split in two
+        data = f.read(chars * 4 + 1)
+        text = decoder.decode(data, final=len(data) <= chars * 4)
+    return _normalize_newlines(text)[:chars]
+
+
+class LineIndex:
+    """
+    The number of newlines before each block of a file, counted once. A line is
+    then found by counting newlines from the start of its block, so reading a
+    range of lines takes time in proportion to the range, not to the file.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._newlines = array("q", [0])
+        with (
+            path.open("rb") as f,
+            mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m,
+        ):
+            for start in range(0, len(m), BLOCK_SIZE):
+                count = m[start : start + BLOCK_SIZE].count(b"\n")
+                self._newlines.append(self._newlines[-1] + count)
+
+    @property
+    def line_count(self) -> int:
+        """The number of lines, as many as `text.split("\\n")` gives."""
+        return self._newlines[-1] + 1
+
+    def read(self, init_line: int, final_line: int = -1) -> str:
+        """Lines init_line to final_line (1-based and inclusive, -1 for the last)."""
+        if final_line == -1:
+            final_line = self.line_count
+        with (
+            self.path.open("rb") as f,
+            mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m,
+        ):
+            start = self._line_start(m, init_line)
+            if final_line < self.line_count:
+                end = self._line_start(m, final_line + 1) - 1
+                if m[end - 1 : end] == b"\r":
+                    end -= 1
+            else:
+                end = len(m)
+            return _normalize_newlines(m[start:end].decode())
+
+    def _line_start(self, m: mmap.mmap, line: int) -> int:
+        """The offset at which a line starts, just after the newline before it."""
+        newlines = line - 1
+        if newlines == 0:
+            return 0
+        # the block that holds the newline, and how many newlines come before it
+        block = bisect_left(self._newlines, newlines) - 1
+        offset = block * BLOCK_SIZE
+        for _ in range(newlines - self._newlines[block]):
+            offset = m.find(b"\n", offset) + 1
+        return offset
+
+
+class LineIndexCache:
+    """The line indexes of the most recently viewed files, up to max_entries."""
+
+    def __init__(self, max_entries: int = 16):
+        self.max_entries = max_entries
+        self._indexes: OrderedDict[tuple[Path, int, int], LineIndex] = OrderedDict()
+
+    def get(self, path: Path) -> LineIndex:
+        """The index of a file, built again whenever its mtime or size changes."""
+        stat = path.stat()
+        key = (path, stat.st_mtime_ns, stat.st_size)
+        index = self._indexes.pop(key, None)
+        if index is None:
+            for old in [k for k in self._indexes if k[0] == path]:
+                del self._indexes[old]
+            index = LineIndex(path)
+        self._indexes[key] = index
+        while len(self._indexes) > self.max_entries:
+            self._indexes.popitem(last=False)
+        return index
@@ -0,0 +1,130 @@
+"""A tool that runs a sequence of computer actions in one call."""
+
+from typing import Any, Literal
+
+from anthropic.types.beta import BetaToolParam
+
+from .base import BaseAnthropicTool, ToolError, ToolResult
+from .computer import ComputerTool
+
+MACRO_ACTIONS = [
+    "key",
+    "type",
+    "mouse_move",
+    "left_click",
+    "left_click_drag",
+    "right_click",
+    "double_click",
+]
+# the other actions act at the current mouse position, like the computer tool's
+COORDINATE_ACTIONS = ["mouse_move", "left_click_drag"]
+
+
+def _failure(number: int, action: Any, reason: str, outputs: list[str]) -> str:
+    completed = "\n".join(outputs) or "none"
+    return (
+        f"Action {number} ({action}) failed: {reason}\nCompleted actions:\n{completed}"
+    )
+
+
+class ComputerMacroTool(BaseAnthropicTool):
+    """
+    Runs an ordered list of the computer tool's actions on the same computer and
+    returns a single screenshot at the end, so that a known sequence such as
+    filling in a form takes one round trip instead of one per action.
+    """
+
+    name: Literal["computer_macro"] = "computer_macro"
+
+    def __init__(self, computer: ComputerTool):
+        super().__init__()
+        self.computer = computer
+
+    def to_params(self) -> BetaToolParam:
+        return {
+            "name": self.name,
+            "description": (
+                "Perform several actions of the computer tool in order, then take "
+                "one screenshot. Use it when you already know the whole sequence, "
+                "e.g. mouse_move to a field, left_click, type, press tab, type. As "
+                "with the computer tool, only mouse_move and left_click_drag take a "
+                "coordinate; clicks happen at the current mouse position. Set "
+                "settle on an action to wait for the screen to stop changing before "
+                "the next one. Stops at the first action that fails and reports "
+                "the actions completed before it, with a screenshot."
+            ),
+            "input_schema": {
+                "type": "object",
+                "properties": {
+                    "actions": {
+                        "type": "array",
+                        "items": {
+                            "type": "object",
+                            "properties": {
+                                "action": {"type": "string", "enum": MACRO_ACTIONS},
+                                "text": {"type": "string"},
+                                "coordinate": {
+                                    "type": "array",
+                                    "items": {"type": "integer"},
+                                    "description": "Only for mouse_move and "
+                                    "left_click_drag.",
+                                },
+                                "settle": {"type": "boolean"},
+                            },
+                            "required": ["action"],
+                        },
+                    },
+                },
+                "required": ["actions"],
+            },
+        }
+
+    def resources(self, **kwargs):
+        return frozenset(), frozenset({"screen"})
+
+    async def __call__(self, *, actions: list[dict[str, Any]] | None = None, **kwargs):
+        if not actions:
+            raise ToolError("actions must be a non-empty list")
+        outputs = []
+        # reject a malformed macro before any of it runs
+        for number, step in enumerate(actions, start=1):
+            action = step.get("action")
+            if action not in MACRO_ACTIONS:
+                raise ToolError(
+                    _failure(number, action, "not allowed in a macro", outputs)
+                )
+            if step.get("coordinate") is not None and action not in COORDINATE_ACTIONS:
+                raise ToolError(
+                    _failure(
+                        number,
+                        action,
+                        "coordinate is only accepted for "
+                        f"{', '.join(COORDINATE_ACTIONS)}, use mouse_move first",
+                        outputs,
+                    )
+                )
+        failure = None
+        for number, step in enumerate(actions, start=1):
+            step = dict(step)
+            action = step.get("action")
+            settle = step.pop("settle", False)
+            try:
+                result = await self.computer(**step)
+            except ToolError as e:
+                result = ToolResult(error=e.message)
+            if result.error:
+                # the earlier actions did happen: report them with the screen
+                failure = _failure(number, action, result.error, outputs)
+                break
+            outputs.append(f"{number}. {result.output or action}")
+            if settle:
+                await self.computer.wait()
+
+        # always show the screen the macro left, whatever the last screenshot was
+        screenshot = await self.computer.screenshot(force=True)
+        if failure:
+            return ToolResult(error=failure, image=screenshot.image)
+        output = "\n".join(outputs)
+        if screenshot.output:
+            output += f"\n{screenshot.output}"
+        return ToolResult(output=output, image=screenshot.image)
@@ -1,8 +1,12 @@
 """Utility to run shell commands asynchronously with a timeout."""
 
 import asyncio
+import os
+import tempfile
 
-TRUNCATED_MESSAGE: str = "<response clipped><NOTE>To save on context only part of this file has been shown to you. You should retry this tool after you have searched inside the file with `grep -n` in order to find the line numbers of what you are looking for.</NOTE>"
+TRUNCATED_MESSAGE: str = (
+    "<response clipped><NOTE>To save on context only part of this file has been shown to you. You should retry this tool after you have searched inside the file with `grep -n` in order to find the line numbers of what you are looking for.</NOTE>"
+)
 MAX_RESPONSE_LEN: int = 16000
 
 
@@ -15,24 +19,125 @@ def maybe_truncate(content: str, truncate_after: int | None = MAX_RESPONSE_LEN):
     )
 
 
+class OutputCapture:
+    """
+    Captures a command's output in constant memory. Output up to `limit` bytes is
+    kept as is. Beyond that only the first and last limit / 2 bytes stay in
+    memory. With `spill`, the whole output is written to a temporary file, whose
+    path is given in the text so that the model can search it; the file is the
+    owner's to delete, with remove(), once the model no longer needs it.
+    """
+
+    def __init__(
+        self,
+        limit: int | None = MAX_RESPONSE_LEN,
+        prefix: str = "output_",
+        spill: bool = True,
+    ):
+        self.limit = limit
+        self.prefix = prefix
+        self.spill = spill
+        self.size = 0
+        self.path: str | None = None
+        self.truncated = False
+        self._head = bytearray()
+        self._tail = bytearray()
+        self._file = None
+
+    def write(self, data: bytes):
+        self.size += len(data)
+        if self.limit is None or (not self.truncated and self.size <= self.limit):
+            self._head += data
+            return
+        if not self.truncated:
+            # the output so far, this chunk included, is split into head and tail
+            self.truncated = True
+            self._head += data
+            if self.spill:
+                self._file = tempfile.NamedTemporaryFile(
+                    prefix=self.prefix, suffix=".log", delete=False
+                )
+                self.path = self._file.name
+                self._file.write(self._head)
+            head_size = self.limit // 2
+            self._tail = self._head[head_size:]
+            del self._head[head_size:]
+        else:
+            if self._file is not None:
+                self._file.write(data)
+            self._tail += data
+        del self._tail[: max(len(self._tail) - (self.limit - self.limit // 2), 0)]
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+
+    def remove(self):
+        """Deletes the file the output was spilled to, if any."""
+        self.close()
+        if self.path is not None:
+            try:
+                os.unlink(self.path)
+            except FileNotFoundError:
+                pass
+
+    def text(self) -> str:
+        """The output, or its start and end with a note on where the rest is."""
+        if not self.truncated:
+            return self._head.decode(errors="replace")
+        omitted = self.size - len(self._head) - len(self._tail)
+        note = f"\n<response clipped: {omitted} bytes in the middle are not shown."
+        if self.path is not None:
+            note += (
+                f" The full output ({self.size} bytes) is in {self.path}; search it "
+                "with `grep -n` or view parts of it with `sed -n`."
+            )
+        return (
+            self._head.decode(errors="replace")
+            + f"{note}>\n"
+            + self._tail.decode(errors="replace")
+        )
+
+
+async def capture_stream(
+    stream: asyncio.StreamReader, capture: OutputCapture, chunk_size: int = 64 * 1024
+):
+    """Reads a stream to its end into a capture."""
+    while chunk := await stream.read(chunk_size):
+        capture.write(chunk)
+    capture.close()
+
+
 async def run(
     cmd: str,
     timeout: float | None = 120.0,  # seconds
     truncate_after: int | None = MAX_RESPONSE_LEN,
 ):
-    """Run a shell command asynchronously with a timeout."""
+    """
+    Run a shell command asynchronously with a timeout. Only the start and end
+    of output beyond truncate_after bytes is kept, see OutputCapture; nothing
+    owns a spill file here, so none is written.
+    """
     process = await asyncio.create_subprocess_shell(
         cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
     )
+    assert process.stdout and process.stderr
+    stdout = OutputCapture(truncate_after, spill=False)
+    stderr = OutputCapture(truncate_after, spill=False)
 
     try:
-        stdout, stderr = await asyncio.wait_for(process.communicate(), timeout=timeout)
-        return (
-            process.returncode or 0,
-            maybe_truncate(stdout.decode(), truncate_after=truncate_after),
-            maybe_truncate(stderr.decode(), truncate_after=truncate_after),
+        await asyncio.wait_for(
+            asyncio.gather(
+                capture_stream(process.stdout, stdout),
+                capture_stream(process.stderr, stderr),
+                process.wait(),
+            ),
+            timeout=timeout,
         )
+        return (process.returncode or 0, stdout.text(), stderr.text())
     except asyncio.TimeoutError as exc:
+        stdout.close()
+        stderr.close()
         try:
             process.kill()
         except ProcessLookupError:
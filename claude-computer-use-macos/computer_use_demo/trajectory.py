@@ -0,0 +1,144 @@
+"""
+Record and replay of agent trajectories.
+
+A trajectory is the list of responses of a finished sampling loop, each stored
+with a perceptual hash of the screen the response was requested against. When
+the same workflow runs again, a recorded response is replayed (its tool calls
+run locally, without an API call) as long as the screen at that turn matches
+the recorded one. At the first turn whose screen differs, replay stops and the
+model takes over with the conversation so far. The final response, which
+reports the outcome, is never replayed: the model always writes it for the
+run at hand.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+
+from anthropic.types.beta import BetaMessage
+from PIL import Image
+
+from .tools import ComputerTool
+from .tools.computer import FINGERPRINT_REDUCTION
+
+HASH_SIZE = 16
+
+
+def perceptual_hash(image: Image.Image, size: int = HASH_SIZE) -> int:
+    """
+    A difference hash: the screen is reduced to a (size + 1) x size greyscale
+    grid and each bit tells whether a cell is brighter than its left neighbour.
+    """
+    grid = image.convert("L").resize((size + 1, size), Image.Resampling.BILINEAR)
+    pixels = list(grid.getdata())
+    bits = 0
+    for row in range(size):
+        for col in range(size):
+            left = pixels[row * (size + 1) + col]
+            right = pixels[row * (size + 1) + col + 1]
+            bits = bits << 1 | (right > left)
+    return bits
+
+
+def trajectory_key(*parts: str) -> str:
+    """A cache key for a workflow, e.g. from its instruction and model."""
+    return hashlib.sha256(json.dumps(parts).encode()).hexdigest()
+
+
+class Trajectory:
+    """
+    The recorded responses of one workflow, replayed while the screen matches,
+    and the responses of the current run, saved when the run succeeds.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        computer: ComputerTool,
+        recorded: list[tuple[int, BetaMessage]],
+        max_distance: int,
+    ):
+        self.path = path
+        self.computer = computer
+        self.max_distance = max_distance
+        self.replayed = 0
+        self._recorded = recorded
+        self._turns: list[tuple[int, BetaMessage]] = []
+        self._replaying = bool(recorded)
+
+    async def screen_hash(self) -> int:
+        """
+        The hash of the screen. While replaying, it is compared with the recorded
+        one, so the screen first settles after the last action. Once replay has
+        stopped it is only recorded for the next run, and a reduced sample of the
+        screen as it is now is hashed instead of waiting for a full capture.
+        """
+        if self._replaying:
+            _, fingerprint, _ = await self.computer.settle()
+        else:
+            fingerprint = await asyncio.to_thread(
+                self.computer.backend.sample, FINGERPRINT_REDUCTION
+            )
+        return perceptual_hash(fingerprint)
+
+    def next_response(self, screen: int) -> BetaMessage | None:
+        """
+        The recorded response for the next turn if the screen still matches the
+        recorded one and the response calls tools, otherwise None, after which
+        nothing more is replayed.
+        """
+        index = len(self._turns)
+        if not self._replaying or index >= len(self._recorded):
+            self._replaying = False
+            return None
+        recorded_screen, response = self._recorded[index]
+        screen_changed = (screen ^ recorded_screen).bit_count() > self.max_distance
+        # the final response reports on the recorded run, not on this one
+        is_final = not any(block.type == "tool_use" for block in response.content)
+        if screen_changed or is_final:
+            self._replaying = False
+            return None
+        self.replayed += 1
+        return response
+
+    def record(self, screen: int, response: BetaMessage):
+        self._turns.append((screen, response))
+
+    def save(self):
+        """Stores the responses of this run, replacing the previous recording."""
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        turns = [
+            {"screen": f"{screen:x}", "response": response.model_dump(mode="json")}
+            for screen, response in self._turns
+        ]
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump({"turns": turns}, f)
+        os.replace(temp_path, self.path)
+
+
+class TrajectoryCache:
+    """
+    Recorded trajectories in a directory, one JSON file per workflow key.
+    Screens whose hashes differ in at most max_distance of their bits match.
+    """
+
+    def __init__(self, directory: str, max_distance: int = 10):
+        self.directory = directory
+        self.max_distance = max_distance
+
+    def open(self, key: str, computer: ComputerTool) -> Trajectory:
+        """The trajectory of a workflow, with its previous recording if any."""
+        path = os.path.join(self.directory, f"{key}.json")
+        recorded = []
+        if os.path.exists(path):
+            with open(path) as f:
+                recorded = [
+                    (
+                        int(turn["screen"], 16),
+                        BetaMessage.model_validate(turn["response"]),
+                    )
+                    for turn in json.load(f)["turns"]
+                ]
+        return Trajectory(path, computer, recorded, self.max_distance)
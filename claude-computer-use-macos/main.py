@@ -7,7 +7,6 @@ import base64
 from computer_use_demo.loop import sampling_loop, APIProvider
 from computer_use_demo.tools import ToolResult
 from anthropic.types.beta import BetaMessage, BetaMessageParam
-from anthropic import APIResponse
 from dotenv import load_dotenv
 load_dotenv()
 
@@ -49,6 +48,13 @@ async def main():
             print(f"> Tool Output [{tool_use_id}]:", result.output)
         if result.error:
             print(f"!!! Tool Error [{tool_use_id}]:", result.error)
+        if result.image:
+            # Write the stored image bytes as they are
+            os.makedirs("screenshots", exist_ok=True)
+            extension = result.image.media_type.split("/")[-1]
+            with open(f"screenshots/screenshot_{tool_use_id}.{extension}", "wb") as f:
+                f.write(result.image.read())
+            print(f"Took screenshot screenshot_{tool_use_id}.{extension}")
         if result.base64_image:
             # Save the image to a file if needed
             os.makedirs("screenshots", exist_ok=True)
@@ -57,12 +63,20 @@ async def main():
                 f.write(base64.b64decode(image_data))
             print(f"Took screenshot screenshot_{tool_use_id}.png")
 
-    def api_response_callback(response: APIResponse[BetaMessage]):
+    def api_response_callback(response: BetaMessage):
+        response_json = response.model_dump(mode="json")
         print(
             "\n---------------\nAPI Response:\n",
-            json.dumps(json.loads(response.text)["content"], indent=4),  # type: ignore
+            json.dumps(response_json["content"], indent=4),
             "\n",
         )
+        usage = response_json.get("usage", {})
+        print(
+            f"Tokens: input={usage.get('input_tokens')} "
+            f"output={usage.get('output_tokens')} "
+            f"cache_write={usage.get('cache_creation_input_tokens')} "
+            f"cache_read={usage.get('cache_read_input_tokens')}"
+        )
 
     # Run the sampling loop
     messages = await sampling_loop(
@@ -1,7 +1,27 @@
 import os
+import re
 import subprocess
+from bisect import bisect_left
+from itertools import chain, zip_longest
 from urllib.parse import urlparse
 
+# Narration-aligned sampling: words that announce an action on screen
+ACTION_WORDS = {
+    "click", "clicks", "clicked", "clicking",
+    "type", "types", "typed", "typing",
+    "press", "presses", "pressed", "hit",
+    "select", "selects", "selected", "choose", "pick",
+    "open", "opens", "opened", "close", "closes",
+    "enter", "enters", "entered", "fill", "paste", "copy",
+    "scroll", "scrolls", "drag", "drop",
+    "navigate", "search", "submit", "save", "login",
+    "check", "uncheck", "dropdown",
+}
+NARRATION_OFFSET = 0.5  # seconds, narrators name an action just before doing it
+VISUAL_CHANGE_FPS = 4  # rate at which the visual change detector samples
+VISUAL_CHANGE_THRESHOLD = 6.0  # mean grey level difference between samples
+MIN_FRAME_GAP = 0.5  # seconds between two sampled frames
+
 def is_youtube_url(url):
     """Check if the provided path is a YouTube URL"""
     try:
@@ -10,11 +30,131 @@ def is_youtube_url(url):
     except:
         return False
 
-def process_video(input_path, output_folder="video_parts"):
+def _read_frames(video_path):
+    """Yield the (timestamp, frame) pairs of a video"""
+    import cv2
+
+    capture = cv2.VideoCapture(video_path)
+    try:
+        while True:
+            ok, frame = capture.read()
+            if not ok:
+                break
+            yield capture.get(cv2.CAP_PROP_POS_MSEC) / 1000.0, frame
+    finally:
+        capture.release()
+
+
+def _sample_video(video_path):
+    """
+    Decode the video once, keeping a JPEG sample VISUAL_CHANGE_FPS times a second
+    and the last frame, and run a cheap visual change detector on tiny greyscale
+    copies of the samples.
+    Returns the (timestamp, jpeg) samples and the (timestamp, magnitude) changes.
+    """
+    import cv2
+
+    samples = []
+    changes = []
+    previous = None
+    next_time = 0.0
+    timestamp, frame = 0.0, None
+    for timestamp, frame in _read_frames(video_path):
+        if timestamp < next_time:
+            continue
+        next_time = timestamp + 1.0 / VISUAL_CHANGE_FPS
+        samples.append((timestamp, cv2.imencode(".jpg", frame)[1].tobytes()))
+        small = cv2.cvtColor(cv2.resize(frame, (64, 36)), cv2.COLOR_BGR2GRAY)
+        if previous is not None:
+            magnitude = float(cv2.absdiff(small, previous).mean())
+            if magnitude > VISUAL_CHANGE_THRESHOLD:
+                changes.append((timestamp, magnitude))
+        previous = small
+    if frame is not None and samples[-1][0] != timestamp:
+        samples.append((timestamp, cv2.imencode(".jpg", frame)[1].tobytes()))
+    return samples, changes
+
+
+def _narration_timestamps(audio_path, aligner):
+    """Timestamps at which the narrator announces an action, from word alignment"""
+    timestamps = []
+    for word in aligner(audio_path):
+        text = re.sub(r"[^a-z]", "", word.get("word", "").lower())
+        if text in ACTION_WORDS and "start" in word:
+            timestamps.append(word["start"] + NARRATION_OFFSET)
+    return timestamps
+
+
+def _whisperx_aligner():
+    """Build a function returning the word-level alignment of an audio file"""
+    import whisperx
+
+    device = "cpu"
+    model = whisperx.load_model("small", device, compute_type="int8")
+    align_models = {}
+
+    def align(audio_path):
+        audio = whisperx.load_audio(audio_path)
+        result = model.transcribe(audio, batch_size=1)
+        language = result.get("language", "en")
+        if language not in align_models:
+            align_models[language] = whisperx.load_align_model(
+                language_code=language, device=device
+            )
+        align_model, metadata = align_models[language]
+        aligned = whisperx.align(
+            result["segments"], align_model, metadata, audio, device,
+            return_char_alignments=False,
+        )
+        return aligned.get("word_segments", [])
+
+    return align
+
+
+def _select_timestamps(narration, changes, duration, frame_budget):
+    """
+    Pick at most frame_budget timestamps: the first frame, then narrated actions
+    and visual changes by decreasing magnitude taken in turn, so that neither
+    source can use up the budget, then the last frame, keeping MIN_FRAME_GAP
+    between any two.
+    """
+    interleaved = zip_longest(
+        [t for t in narration if t <= duration],
+        [t for t, _ in sorted(changes, key=lambda change: -change[1])],
+    )
+    candidates = [0.0] + list(chain.from_iterable(interleaved)) + [duration]
+    selected = []
+    for t in candidates:
+        if t is None:
+            continue
+        if len(selected) >= frame_budget:
+            break
+        if all(abs(t - s) >= MIN_FRAME_GAP for s in selected):
+            selected.append(t)
+    return sorted(selected)
+
+
+def _write_frames_at(samples, timestamps, frames_dir):
+    """Write the first sample at or after each timestamp as frames_dir/frame_N.jpg"""
+    times = [t for t, _ in samples]
+    for index, timestamp in enumerate(timestamps):
+        # Timestamps past the last sample get the last frame
+        _, jpeg = samples[min(bisect_left(times, timestamp), len(samples) - 1)]
+        with open(os.path.join(frames_dir, f"frame_{index}.jpg"), "wb") as f:
+            f.write(jpeg)
+
+
+def process_video(
+    input_path, output_folder="video_parts", sampling="fixed", frame_budget=16
+):
     """
     Process either a YouTube URL or local video file
     input_path: Can be either a YouTube URL or a FileUploader object
     output_folder: Directory where processed files will be stored
+    sampling: "fixed" extracts one frame per second, "narration" picks the frames
+        where the narrator announces an action (WhisperX word alignment) or the
+        screen changes
+    frame_budget: Maximum number of frames per segment with "narration" sampling
     """
     # Create output directory
     os.makedirs(output_folder, exist_ok=True)
@@ -48,6 +188,8 @@ def process_video(input_path, output_folder="video_parts"):
         f"{output_folder}/temp_segment_%03d.mp4"
     ])
     
+    aligner = _whisperx_aligner() if sampling == "narration" else None
+
     # Process each segment
     segments = sorted([f for f in os.listdir(output_folder) if f.startswith("temp_segment_")])
     for segment in segments:
@@ -57,16 +199,6 @@ def process_video(input_path, output_folder="video_parts"):
         frames_dir = os.path.join(segment_dir, "frames")
         os.makedirs(frames_dir, exist_ok=True)
         
-        # Extract one frame per second
-        print(f"Extracting frames for {segment_name}...")
-        subprocess.run([
-            "ffmpeg",
-            "-i", segment_path,
-            "-vf", "fps=1",  # One frame per second
-            "-frame_pts", "1",  # Add presentation timestamp
-            f"{frames_dir}/frame_%d.jpg"
-        ])
-        
         # Extract audio for this segment
         print(f"Extracting audio for {segment_name}...")
         subprocess.run([
@@ -78,6 +210,26 @@ def process_video(input_path, output_folder="video_parts"):
             "-ab", "192k",  # Audio bitrate
             f"{segment_dir}/audio.mp3"
         ])
+
+        print(f"Extracting frames for {segment_name}...")
+        if sampling == "narration":
+            # Extract frames where an action is narrated or the screen changes
+            narration = _narration_timestamps(f"{segment_dir}/audio.mp3", aligner)
+            samples, changes = _sample_video(segment_path)
+            if samples:
+                timestamps = _select_timestamps(
+                    narration, changes, samples[-1][0], frame_budget
+                )
+                _write_frames_at(samples, timestamps, frames_dir)
+        else:
+            # Extract one frame per second
+            subprocess.run([
+                "ffmpeg",
+                "-i", segment_path,
+                "-vf", "fps=1",  # One frame per second
+                "-frame_pts", "1",  # Add presentation timestamp
+                f"{frames_dir}/frame_%d.jpg"
+            ])
         
         # Remove temporary segment file
         os.remove(segment_path)
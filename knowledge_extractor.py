@@ -1,18 +1,65 @@
+import argparse
 import base64
 import gc
 import json
 import os
-from typing import Dict, List, Optional
-
-import whisperx
+import re
+import string
+import time
+import uuid
+from abc import ABC, abstractmethod
+from typing import Callable, Dict, List, Optional, Union
+
+import anthropic
+import cv2
 from langchain.cache import SQLiteCache
-from langchain.globals import set_llm_cache
+from langchain.globals import get_llm_cache, set_llm_cache
 from langchain_anthropic import ChatAnthropic
-from langchain_core.messages import HumanMessage
+from langchain_core.load import dumps
+from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.outputs import ChatGeneration
 
 # Set up LangChain caching
 set_llm_cache(SQLiteCache(database_path=".langchain.db"))
 
+_MODEL = "claude-3-5-sonnet-latest"
+_MAX_TOKENS = 1024
+_XML_RETRIES = 2
+
+# Message Batches limits per batch, and how long to wait for a batch to end
+_BATCH_MAX_REQUESTS = 100_000
+_BATCH_MAX_BYTES = 256 * 1024 * 1024
+_BATCH_TIMEOUT = 24 * 60 * 60
+
+# Mark the static prefix of each prompt as a prompt-cache breakpoint
+_PROMPT_CACHING = os.getenv("PROMPT_CACHING", "1") != "0"
+
+# The API does not cache shorter prefixes; tokens are estimated at 4 chars each
+_MIN_CACHEABLE_TOKENS = 1024
+_CHARS_PER_TOKEN = 4
+
+# Token usage of all API calls made by this process, including prompt-cache
+# reads/writes; responses served from the LangChain cache cost nothing
+_usage_totals: Dict[str, int] = {
+    "input_tokens": 0,
+    "output_tokens": 0,
+    "cache_creation_input_tokens": 0,
+    "cache_read_input_tokens": 0,
+}
+
+# Delta frames: per-pixel grey level difference that counts as a change, the
+# fraction of the pixels that must change for a frame to be described at all and
+# for it to count as a scene change, and the fraction of the frame above which
+# a crop is no cheaper than the full frame
+_PIXEL_DIFF_THRESHOLD = 25
+_MIN_CHANGE_RATIO = 0.0002
+_SCENE_CHANGE_RATIO = 0.35
+_MAX_CROP_RATIO = 0.5
+_CROP_PADDING = 16
+_THUMBNAIL_WIDTH = 320
+_THUMBNAIL_BOX_COLOR = (0, 0, 255)
+_UNCHANGED_FRAME_DESCRIPTION = "No visible change since the previous frame."
+
 # Prompts
 _DESCRIBE_IMAGE_PROMPT = """
 You are a helpful assistant that describes images.
@@ -32,6 +79,26 @@ Your output should be structured into XML format, omit any details that are not
 Omit any of your comments, only output the XML, between <xml> and </xml> tags.
 """
 
+_DESCRIBE_CHANGES_PROMPT = """
+You are a helpful assistant that describes changes between frames of a screen recording.
+
+You are given two images:
+1. A crop of the region of the screen that changed since the previous frame
+2. A low resolution thumbnail of the whole screen, with the region outlined in red
+
+You are a part of a COMPUTER USE pipeline, you need to describe SPECIFIC details of the change that are relevant to the computer use.
+
+### GUIDELINES
+- Describe only what changed since the previous frame, e.g. a typed value, an opened dropdown, a new dialog
+- Use the thumbnail to locate the changed region on the screen and in the application
+- Extract form details, but make sure that it can generalize to other forms - we need a general "The input form with the label 'Name' now has value 'John Doe'"
+- Be as specific as possible
+
+### OUTPUT
+Your output should be structured into XML format, omit any details that are not relevant to the computer use.
+Omit any of your comments, only output the XML, between <xml> and </xml> tags.
+"""
+
 _STEPS_CREATION_PROMPT = """
 You are a helpful assistant that creates steps from a segment of a video.
 
@@ -114,6 +181,7 @@ Your output should be in xml format, between <xml> and </xml> tags.
         They specifically mentioned in the audio that this is a tool for ordering pizza, you can ignore other cuisines
     </guidance>
 </tool>
+</xml>
 
 ### GUIDELINES
 Be as robust as possible!
@@ -177,40 +245,411 @@ Return your output between <xml> and </xml> tags.
 
 """
 
+
 def _encode_image(image_path: str) -> str:
     """Encode image to base64."""
     with open(image_path, "rb") as image_file:
         return base64.b64encode(image_file.read()).decode("utf-8")
 
 
-def _call(prompt: str, image_path: Optional[str] = None) -> str:
-    """Make a call to Claude with optional image input."""
-    model = ChatAnthropic(model="claude-3-5-sonnet-latest")
+def set_prompt_caching(enabled: bool):
+    """Turn prompt-cache breakpoints on the static prompt prefixes on or off."""
+    global _PROMPT_CACHING
+    _PROMPT_CACHING = enabled
 
-    if image_path:
-        base64_image = _encode_image(image_path)
-        message = HumanMessage(
-            content=[
-                {"type": "text", "text": prompt},
-                {
-                    "type": "image",
-                    "source": {
-                        "type": "base64",
-                        "media_type": "image/jpeg",
-                        "data": base64_image,
-                    },
-                },
-            ]
+
+def usage_totals() -> Dict[str, int]:
+    """Return the token usage accumulated so far, including cache reads/writes."""
+    return dict(_usage_totals)
+
+
+def _record_usage(usage: Dict[str, int]):
+    """Add the usage of a single response to the running totals."""
+    for key in _usage_totals:
+        _usage_totals[key] += usage.get(key) or 0
+
+
+def _langchain_usage(message) -> Dict[str, int]:
+    """
+    Convert LangChain usage metadata to Anthropic usage field names. LangChain
+    counts cache reads and writes in its input tokens, Anthropic does not.
+    """
+    usage = getattr(message, "usage_metadata", None) or {}
+    details = usage.get("input_token_details") or {}
+    cache_creation = details.get("cache_creation") or 0
+    cache_read = details.get("cache_read") or 0
+    return {
+        "input_tokens": usage.get("input_tokens", 0) - cache_creation - cache_read,
+        "output_tokens": usage.get("output_tokens", 0),
+        "cache_creation_input_tokens": cache_creation,
+        "cache_read_input_tokens": cache_read,
+    }
+
+
+def _prompt_blocks(template: str, **kwargs) -> List[Dict]:
+    """
+    Format a prompt template into text blocks, putting a cache breakpoint on the
+    static text that precedes the first replacement field.
+
+    The breakpoint is only placed when that text is long enough for the API to
+    cache it. None of the current prompts is: the longest static prefix, that of
+    _STEPS_CREATION_PROMPT, is about 1,700 characters, roughly 430 tokens, well
+    below the 1024-token minimum. So today no extractor request is cached.
+    """
+    prefix = next(string.Formatter().parse(template))[0]
+    dynamic = template.format(**kwargs)[len(prefix) :]
+
+    static_block = {"type": "text", "text": prefix}
+    if _PROMPT_CACHING and len(prefix) >= _MIN_CACHEABLE_TOKENS * _CHARS_PER_TOKEN:
+        static_block["cache_control"] = {"type": "ephemeral"}
+    return [static_block] + ([{"type": "text", "text": dynamic}] if dynamic else [])
+
+
+def _message_content(
+    prompt: Union[str, List[Dict]],
+    image_path: Optional[str] = None,
+    images: Optional[List[str]] = None,
+) -> Union[str, List[Dict]]:
+    """
+    Build the content of a user message with optional image input.
+
+    images holds already base64-encoded JPEG images, sent after image_path.
+    """
+    images = ([_encode_image(image_path)] if image_path else []) + (images or [])
+    if not images:
+        return prompt
+
+    blocks = [{"type": "text", "text": prompt}] if isinstance(prompt, str) else prompt
+    return blocks + [
+        {
+            "type": "image",
+            "source": {
+                "type": "base64",
+                "media_type": "image/jpeg",
+                "data": image,
+            },
+        }
+        for image in images
+    ]
+
+
+def _encode_frame(frame) -> str:
+    """Encode an OpenCV image to a base64 JPEG."""
+    _, buffer = cv2.imencode(".jpg", frame)
+    return base64.b64encode(buffer.tobytes()).decode("utf-8")
+
+
+def _changed_region(
+    previous, current
+) -> tuple[Optional[tuple[int, int, int, int]], float]:
+    """
+    Return the (x, y, w, h) bounding box of the pixels that differ, or None if
+    none do, and the fraction of all pixels that differ.
+    """
+    diff = cv2.absdiff(
+        cv2.cvtColor(previous, cv2.COLOR_BGR2GRAY),
+        cv2.cvtColor(current, cv2.COLOR_BGR2GRAY),
+    )
+    _, mask = cv2.threshold(diff, _PIXEL_DIFF_THRESHOLD, 255, cv2.THRESH_BINARY)
+    points = cv2.findNonZero(mask)
+    if points is None:
+        return None, 0.0
+    return cv2.boundingRect(points), len(points) / mask.size
+
+
+def _frame_requests(
+    image_paths: List[str], delta: bool = False
+) -> List[Optional[tuple[List[Dict], List[str]]]]:
+    """
+    Build the (prompt, images) description request of each frame.
+
+    Without delta every frame is sent in full. With delta, a frame is compared
+    with the previous kept frame: only the changed region is sent, together with
+    a low resolution thumbnail with the region outlined for context. The full
+    frame is sent instead when so many pixels changed that it is a scene change,
+    or when the region covers most of the frame. Frames where next to nothing
+    changed, such as compression noise, map to None and need no request. Frames
+    OpenCV cannot decode are sent in full and not compared.
+    """
+    if not delta:
+        return [
+            (_prompt_blocks(_DESCRIBE_IMAGE_PROMPT), [_encode_image(path)])
+            for path in image_paths
+        ]
+
+    requests = []
+    previous = None
+    for path in image_paths:
+        frame = cv2.imread(path)
+        if frame is None:
+            print(f"Could not decode {path}, sending it in full")
+            requests.append(
+                (_prompt_blocks(_DESCRIBE_IMAGE_PROMPT), [_encode_image(path)])
+            )
+            continue
+
+        if previous is None or previous.shape != frame.shape:
+            region, changed = (0, 0, frame.shape[1], frame.shape[0]), 1.0
+        else:
+            region, changed = _changed_region(previous, frame)
+
+        if region is None or changed < _MIN_CHANGE_RATIO:
+            requests.append(None)
+            continue
+
+        x, y, w, h = region
+        height, width = frame.shape[:2]
+        top, bottom = max(0, y - _CROP_PADDING), min(height, y + h + _CROP_PADDING)
+        left, right = max(0, x - _CROP_PADDING), min(width, x + w + _CROP_PADDING)
+        crop_ratio = (bottom - top) * (right - left) / (width * height)
+        if changed > _SCENE_CHANGE_RATIO or crop_ratio > _MAX_CROP_RATIO:
+            requests.append(
+                (_prompt_blocks(_DESCRIBE_IMAGE_PROMPT), [_encode_frame(frame)])
+            )
+        else:
+            crop = frame[top:bottom, left:right]
+
+            scale = _THUMBNAIL_WIDTH / width
+            thumbnail = cv2.resize(frame, (_THUMBNAIL_WIDTH, round(height * scale)))
+            cv2.rectangle(
+                thumbnail,
+                (round(left * scale), round(top * scale)),
+                (round(right * scale) - 1, round(bottom * scale) - 1),
+                _THUMBNAIL_BOX_COLOR,
+                2,
+            )
+            requests.append(
+                (
+                    _prompt_blocks(_DESCRIBE_CHANGES_PROMPT),
+                    [_encode_frame(crop), _encode_frame(thumbnail)],
+                )
+            )
+        previous = frame
+
+    return requests
+
+
+def _chunk_text(chunk) -> str:
+    """Return the text of a streamed message chunk."""
+    if isinstance(chunk.content, str):
+        return chunk.content
+    return "".join(
+        block.get("text", "") for block in chunk.content if isinstance(block, dict)
+    )
+
+
+def _cached_text(model: ChatAnthropic, messages: List[HumanMessage]) -> Optional[str]:
+    """Return the response the LangChain cache holds for messages, if any."""
+    cache = get_llm_cache()
+    if cache is None:
+        return None
+    generations = cache.lookup(dumps(messages), model._get_llm_string())
+    return generations[0].text if generations else None
+
+
+def _call(
+    prompt: Union[str, List[Dict]],
+    image_path: Optional[str] = None,
+    on_text: Optional[Callable[[str], None]] = None,
+    images: Optional[List[str]] = None,
+    check: Optional[Callable[[Optional[str]], None]] = None,
+) -> str:
+    """
+    Make a call to Claude with optional image input.
+
+    If on_text is given the response is streamed and on_text receives each text
+    chunk as it arrives; an exception raised by on_text aborts the stream. A
+    streamed response is stored in the LangChain cache once check, if given,
+    accepts it; check receives the stop reason of the response. A response found
+    in the cache is returned (and passed to on_text) as a whole, with a stop
+    reason of None, and its usage is not counted again.
+    """
+    model = ChatAnthropic(model=_MODEL, max_tokens=_MAX_TOKENS)
+    message = HumanMessage(content=_message_content(prompt, image_path, images))
+
+    cached = _cached_text(model, [message])
+    if cached is not None:
+        if on_text:
+            on_text(cached)
+        if check:
+            check(None)
+        return cached
+
+    if on_text is None:
+        response = model.invoke([message])
+        _record_usage(_langchain_usage(response))
+        return response.content
+
+    chunks = []
+    stop_reason = None
+    for chunk in model.stream([message]):
+        _record_usage(_langchain_usage(chunk))
+        stop_reason = chunk.response_metadata.get("stop_reason") or stop_reason
+        text = _chunk_text(chunk)
+        if text:
+            chunks.append(text)
+            on_text(text)
+
+    text = "".join(chunks)
+    if check:
+        check(stop_reason)
+    cache = get_llm_cache()
+    if cache is not None:
+        cache.update(
+            dumps([message]),
+            model._get_llm_string(),
+            [ChatGeneration(message=AIMessage(content=text))],
         )
-    else:
-        message = HumanMessage(content=prompt)
+    return text
+
 
-    response = model.invoke([message])
-    return response.content
+class MalformedXMLError(ValueError):
+    """Raised when a response is missing its <xml> block or the block is malformed."""
+
+
+class _StepStreamParser:
+    """
+    Incremental parser for the <xml> block of a streamed response.
+
+    Only the structural tags of our output format (xml, step, steps) are tracked,
+    so free-form markup inside descriptions does not confuse it. Each top-level
+    <step> is passed to on_step as soon as its closing tag arrives, and a
+    mismatched structural tag raises MalformedXMLError straight away, which
+    aborts the stream. After that the parser ignores any further text and close
+    raises the same error.
+    """
+
+    _TAG = re.compile(r"<(/?)(xml|steps|step)(\s[^<>]*)?>")
+
+    def __init__(self, on_step: Optional[Callable[[int, str], None]] = None):
+        self.on_step = on_step
+        self.steps: List[str] = []
+        self._buffer = ""
+        self._pos = 0
+        self._stack: List[tuple[str, int]] = []
+        self._content_start: Optional[int] = None
+        self._content: Optional[str] = None
+        self.error: Optional[MalformedXMLError] = None
+
+    @property
+    def done(self) -> bool:
+        return self._content is not None
+
+    def feed(self, text: str):
+        """Consume the next chunk of the response."""
+        if self.done or self.error:
+            return
+        self._buffer += text
+
+        for match in self._TAG.finditer(self._buffer, self._pos):
+            self._pos = match.end()
+            closing, name = match.group(1), match.group(2)
+
+            if self._content_start is None:
+                # Anything before the opening <xml> tag is reasoning
+                if name == "xml" and not closing:
+                    self._content_start = match.end()
+                    self._stack.append((name, match.start()))
+                continue
+
+            if not closing:
+                self._stack.append((name, match.start()))
+                continue
+
+            open_name, start = self._stack.pop() if self._stack else (None, 0)
+            if open_name != name:
+                self.error = MalformedXMLError(
+                    f"Unexpected </{name}> while <{open_name}> is open"
+                )
+                raise self.error
+
+            if name == "xml":
+                self._content = self._buffer[self._content_start : match.start()]
+                return
+            if name == "step" and len(self._stack) == 1:
+                step = self._buffer[start : match.end()]
+                self.steps.append(step)
+                if self.on_step:
+                    self.on_step(len(self.steps) - 1, step)
+
+    def close(self) -> str:
+        """Finish parsing and return the content of the <xml> block."""
+        if self.error:
+            raise self.error
+        if self._content_start is None:
+            raise MalformedXMLError("Response has no <xml> block")
+        if not self.done:
+            open_tags = ", ".join(f"<{name}>" for name, _ in self._stack)
+            raise MalformedXMLError(f"Response was truncated with {open_tags} open")
+        return self._content
+
+
+def _call_xml(
+    prompt: Union[str, List[Dict]],
+    image_path: Optional[str] = None,
+    on_step: Optional[Callable[[int, str], None]] = None,
+    retries: int = _XML_RETRIES,
+) -> str:
+    """
+    Stream a call whose response holds an <xml> block and return the block content.
+
+    on_step receives (index, step) for each top-level <step> as soon as it is
+    complete. Malformed or truncated responses are retried and are not cached;
+    a retry only passes on the steps past those already emitted, so each index
+    is emitted once. A response cut off at max_tokens is not retried, as it would
+    be cut off again. When no attempt is left, the content of the last response
+    is extracted leniently, as the batch path does.
+    """
+    emitted = 0
+
+    def emit(index: int, step: str):
+        nonlocal emitted
+        if on_step and index >= emitted:
+            emitted = index + 1
+            on_step(index, step)
+
+    text = ""
+    for attempt in range(retries + 1):
+        parser = _StepStreamParser(emit)
+        chunks: List[str] = []
+        stop_reason = None
+
+        def feed(chunk: str):
+            chunks.append(chunk)
+            try:
+                parser.feed(chunk)
+            except MalformedXMLError:
+                # The last attempt is read to its end for the lenient extraction
+                if attempt < retries:
+                    raise
+
+        def check(reason: Optional[str]):
+            nonlocal stop_reason
+            stop_reason = reason
+            parser.close()
+
+        try:
+            _call(prompt, image_path, on_text=feed, check=check)
+            return parser.close()
+        except MalformedXMLError as e:
+            text = "".join(chunks)
+            print(f"Malformed XML response (attempt {attempt + 1}): {e}")
+            if stop_reason == "max_tokens":
+                print("The response was cut off at max_tokens, not retrying")
+                break
+
+    return _extract_xml(text)
+
+
+def _extract_xml(text: str) -> str:
+    """Return the content between <xml> and </xml> tags, or the text itself."""
+    return text.split("<xml>")[1].split("</xml>")[0] if "<xml>" in text else text
 
 
 def _transcribe_from_path(audio_path: str, verbose: bool = False) -> Optional[str]:
     """Transcribe audio file to text using WhisperX."""
+    import whisperx
+
     try:
         if verbose:
             print(f"Transcribing: {audio_path}")
@@ -239,27 +678,45 @@ def _transcribe_from_path(audio_path: str, verbose: bool = False) -> Optional[st
         return None
 
 
-def _process_segment(segment: Dict) -> tuple[str, str, List[str]]:
-    """Process a single video segment."""
+def _format_image_description(idx: int, description: str) -> str:
+    """Format a single frame description for the steps creation prompt."""
+    description = description.replace("\n", "")
+    return f"FRAME {idx}: {description}"
+
+
+def _process_segment(
+    segment: Dict,
+    on_step: Optional[Callable[[int, str], None]] = None,
+    delta_frames: bool = False,
+) -> tuple[str, str, List[str]]:
+    """
+    Process a single video segment, passing each created step to on_step.
+
+    With delta_frames, frames are described as changes since the previous frame.
+    """
     audio_text = _transcribe_from_path(segment["audio"], verbose=True)
     print(f"Transcribed audio: {audio_text}")
 
     image_descriptions = []
     print(f"SEGMENT: {segment}")
-    for idx, image in enumerate(segment["images"]):
-        res = _call(_DESCRIBE_IMAGE_PROMPT, image)
-        res = res.replace("\n", "")
-        image_descriptions.append(f"FRAME {idx}: {res}")
+    frame_requests = _frame_requests(segment["images"], delta=delta_frames)
+    for idx, request in enumerate(frame_requests):
+        if request is None:
+            res = _UNCHANGED_FRAME_DESCRIPTION
+        else:
+            prompt, images = request
+            res = _call(prompt, images=images)
+        image_descriptions.append(_format_image_description(idx, res))
 
     image_descriptions_parsed = "\n".join(image_descriptions)
-    res = _call(
-        _STEPS_CREATION_PROMPT.format(
-            audio_text=audio_text, image_descriptions=image_descriptions_parsed
-        )
+    res = _call_xml(
+        _prompt_blocks(
+            _STEPS_CREATION_PROMPT,
+            audio_text=audio_text,
+            image_descriptions=image_descriptions_parsed,
+        ),
+        on_step=on_step,
     )
-
-    # Extract content between XML tags
-    res = res.split("<xml>")[1].split("</xml>")[0] if "<xml>" in res else res
     return res, audio_text, image_descriptions
 
 
@@ -275,18 +732,15 @@ def _final_xml_creation(main_description: str, tools: str) -> str:
     """
 
 
-def process_video_segments(segments_path: str, limit: Optional[int] = None) -> str:
-    """
-    Process video segments and generate a combined XML description.
+def _natural_sort_key(path: str) -> List[Union[int, str]]:
+    """Sort key that orders the numbers embedded in a path numerically."""
+    return [int(part) if part.isdigit() else part for part in re.split(r"(\d+)", path)]
 
-    Args:
-        segments_path (str): Path to the directory containing video segments
-        limit (Optional[int]): Maximum number of segments to process
 
-    Returns:
-        str: Combined XML description of the video segments
-    """
-    # Build knowledge base from directory structure
+def _build_knowledge_base(
+    segments_path: str, limit: Optional[int] = None
+) -> List[Dict]:
+    """Collect the audio file and sorted frames of every segment in a directory."""
     knowledge_base = []
 
     # Get sorted list of segment directories
@@ -303,44 +757,72 @@ def process_video_segments(segments_path: str, limit: Optional[int] = None) -> s
     if limit:
         segment_dirs = segment_dirs[:limit]
 
-    # Build knowledge base
     for segment_dir in segment_dirs:
         segment_path = os.path.join(segments_path, segment_dir)
+        frames_path = os.path.join(segment_path, "frames")
 
         # Get audio file
         audio_file = os.path.join(segment_path, "audio.mp3")
 
-        # Get sorted image files
-        # Get sorted image files
+        # Get image files in frame order (frame_2 before frame_10)
         image_files = sorted(
-    [
-        os.path.join(segment_path, "frames", f)  # Add "frames" subdirectory
-        for f in os.listdir(os.path.join(segment_path, "frames"))  # Look in frames directory
-        if f.endswith((".png", ".jpg", ".jpeg"))
-        and os.path.isfile(os.path.join(segment_path, "frames", f))
-    ]
-)
+            [
+                os.path.join(frames_path, f)
+                for f in os.listdir(frames_path)
+                if f.endswith((".png", ".jpg", ".jpeg"))
+                and os.path.isfile(os.path.join(frames_path, f))
+            ],
+            key=_natural_sort_key,
+        )
+
         # Add segment to knowledge base
         segment_data = {"audio": audio_file, "images": image_files}
         knowledge_base.append(segment_data)
 
+    return knowledge_base
+
+
+def process_video_segments(
+    segments_path: str,
+    limit: Optional[int] = None,
+    on_step: Optional[Callable[[int, int, str], None]] = None,
+    delta_frames: bool = False,
+) -> str:
+    """
+    Process video segments and generate a combined XML description.
+
+    Args:
+        segments_path (str): Path to the directory containing video segments
+        limit (Optional[int]): Maximum number of segments to process
+        on_step (Optional[Callable]): Called with (segment index, step index, step)
+            as soon as each step of a segment has been streamed
+        delta_frames (bool): Send only the changed region of consecutive frames
+
+    Returns:
+        str: Combined XML description of the video segments
+    """
+    # Build knowledge base from directory structure
+    knowledge_base = _build_knowledge_base(segments_path, limit)
+
     # Process segments
     segment_results = []
-    for segment in knowledge_base:
-        res, audio_text, image_descriptions = _process_segment(segment)
+    for idx, segment in enumerate(knowledge_base):
+        segment_on_step = (
+            (lambda step_idx, step, idx=idx: on_step(idx, step_idx, step))
+            if on_step
+            else None
+        )
+        res, audio_text, image_descriptions = _process_segment(
+            segment, on_step=segment_on_step, delta_frames=delta_frames
+        )
         print(f"RES: {res} + IMAGE DESCS: {image_descriptions}")
         segment_results.append(res)
 
     # Create general tool description
-    general_description = _call(
-        _GENERAL_TOOL_CREATION_PROMPT.format(steps="\n".join(segment_results))
-    )
-    general_description = (
-        general_description.split("<xml>")[1].split("</xml>")[0]
-        if "<xml>" in general_description
-        else general_description
+    general_description = _call_xml(
+        _prompt_blocks(_GENERAL_TOOL_CREATION_PROMPT, steps="\n".join(segment_results))
     )
-    
+
     # new_segments = []
     # for segment in segment_results:
     #     res = _call(
@@ -353,11 +835,343 @@ def process_video_segments(segments_path: str, limit: Optional[int] = None) -> s
 
     # Create final XML
     final_xml = _final_xml_creation(general_description, "\n".join(segment_results))
+    print(f"Token usage: {usage_totals()}")
 
     return final_xml
 
 
+# Batch mode
+
+
+class BatchBackend(ABC):
+    """A backend that runs a list of message requests as one asynchronous job."""
+
+    @abstractmethod
+    def submit(self, requests: List[Dict]) -> str:
+        """Submit `{"custom_id": ..., "params": ...}` requests and return a batch id."""
+
+    @abstractmethod
+    def is_done(self, batch_id: str) -> bool:
+        """Return True once every request of the batch has finished processing."""
+
+    @abstractmethod
+    def results(self, batch_id: str) -> Dict[str, Optional[str]]:
+        """Map each custom_id to its response text, or None if the request failed."""
+
+
+class AnthropicBatchBackend(BatchBackend):
+    """Runs batches through the Anthropic Message Batches API."""
+
+    def __init__(self, client: Optional[anthropic.Anthropic] = None):
+        self._client = client or anthropic.Anthropic()
+
+    def submit(self, requests: List[Dict]) -> str:
+        return self._client.messages.batches.create(requests=requests).id
+
+    def is_done(self, batch_id: str) -> bool:
+        batch = self._client.messages.batches.retrieve(batch_id)
+        return batch.processing_status == "ended"
+
+    def results(self, batch_id: str) -> Dict[str, Optional[str]]:
+        results = {}
+        for entry in self._client.messages.batches.results(batch_id):
+            if entry.result.type != "succeeded":
+                results[entry.custom_id] = None
+                continue
+            _record_usage(entry.result.message.usage.model_dump())
+            results[entry.custom_id] = "".join(
+                block.text
+                for block in entry.result.message.content
+                if block.type == "text"
+            )
+        return results
+
+
+class LocalFileBatchBackend(BatchBackend):
+    """
+    File-based stand-in for a batch API.
+
+    Each batch is a directory holding `requests.jsonl`; the batch is done once a
+    `results.jsonl` of `{"custom_id": ..., "text": ...}` lines appears next to it.
+    If a responder is given the results are written immediately on submit,
+    otherwise an external process is expected to write them. Either way the file
+    must be written under another name and renamed to `results.jsonl`, so that a
+    batch is never seen as done while its results are partly written.
+    """
+
+    def __init__(
+        self, directory: str, responder: Optional[Callable[[Dict], str]] = None
+    ):
+        self.directory = directory
+        self.responder = responder
+
+    def _batch_path(self, batch_id: str, name: str) -> str:
+        return os.path.join(self.directory, batch_id, name)
+
+    def submit(self, requests: List[Dict]) -> str:
+        batch_id = f"batch_{uuid.uuid4().hex[:12]}"
+        os.makedirs(os.path.join(self.directory, batch_id), exist_ok=True)
+
+        with open(self._batch_path(batch_id, "requests.jsonl"), "w") as f:
+            for request in requests:
+                f.write(json.dumps(request) + "\n")
+
+        if self.responder:
+            partial_path = self._batch_path(batch_id, "results.jsonl.partial")
+            with open(partial_path, "w") as f:
+                for request in requests:
+                    text = self.responder(request["params"])
+                    f.write(
+                        json.dumps({"custom_id": request["custom_id"], "text": text})
+                        + "\n"
+                    )
+            os.replace(partial_path, self._batch_path(batch_id, "results.jsonl"))
+
+        return batch_id
+
+    def is_done(self, batch_id: str) -> bool:
+        return os.path.exists(self._batch_path(batch_id, "results.jsonl"))
+
+    def results(self, batch_id: str) -> Dict[str, Optional[str]]:
+        results = {}
+        with open(self._batch_path(batch_id, "results.jsonl")) as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    results[entry["custom_id"]] = entry.get("text")
+        return results
+
+
+def _batch_request(
+    custom_id: str,
+    prompt: Union[str, List[Dict]],
+    image_path: Optional[str] = None,
+    images: Optional[List[str]] = None,
+) -> Dict:
+    """Build a single Message Batches request."""
+    return {
+        "custom_id": custom_id,
+        "params": {
+            "model": _MODEL,
+            "max_tokens": _MAX_TOKENS,
+            "messages": [
+                {
+                    "role": "user",
+                    "content": _message_content(prompt, image_path, images),
+                }
+            ],
+        },
+    }
+
+
+def _batch_chunks(requests: List[Dict]) -> List[List[Dict]]:
+    """Split requests into chunks within the request count and size limits of a batch."""
+    chunks = []
+    chunk, size = [], 0
+    for request in requests:
+        request_size = len(json.dumps(request))
+        if chunk and (
+            len(chunk) >= _BATCH_MAX_REQUESTS or size + request_size > _BATCH_MAX_BYTES
+        ):
+            chunks.append(chunk)
+            chunk, size = [], 0
+        chunk.append(request)
+        size += request_size
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+
+def _run_batch(
+    backend: BatchBackend,
+    requests: List[Dict],
+    poll_interval: float,
+    timeout: float = _BATCH_TIMEOUT,
+) -> Dict[str, Optional[str]]:
+    """
+    Submit requests as batch jobs, split to fit the limits of a batch, wait for
+    them to end and return their results.
+
+    Raises TimeoutError if the batches have not all ended after timeout seconds.
+    """
+    batch_ids = []
+    for chunk in _batch_chunks(requests):
+        batch_ids.append(backend.submit(chunk))
+        print(f"Submitted batch {batch_ids[-1]} with {len(chunk)} requests")
+
+    deadline = time.monotonic() + timeout
+    pending = list(batch_ids)
+    while pending:
+        pending = [batch_id for batch_id in pending if not backend.is_done(batch_id)]
+        if pending and time.monotonic() >= deadline:
+            raise TimeoutError(
+                f"Batches {pending} did not end within {timeout:g} seconds"
+            )
+        if pending:
+            time.sleep(poll_interval)
+
+    results = {}
+    for batch_id in batch_ids:
+        results.update(backend.results(batch_id))
+    failed = [r["custom_id"] for r in requests if results.get(r["custom_id"]) is None]
+    if failed:
+        print(f"{len(failed)} batch requests failed: {failed}")
+    return results
+
+
+def _find_videos(path: str) -> List[str]:
+    """Return the video directories (directories of segment_NNN folders) under path."""
+
+    def has_segments(directory: str) -> bool:
+        return any(
+            d.startswith("segment_") and os.path.isdir(os.path.join(directory, d))
+            for d in os.listdir(directory)
+        )
+
+    if has_segments(path):
+        return [path]
+    return sorted(
+        os.path.join(path, d)
+        for d in os.listdir(path)
+        if os.path.isdir(os.path.join(path, d)) and has_segments(os.path.join(path, d))
+    )
+
+
+def process_videos_batch(
+    path: str,
+    backend: Optional[BatchBackend] = None,
+    limit: Optional[int] = None,
+    poll_interval: float = 30.0,
+    delta_frames: bool = False,
+    timeout: float = _BATCH_TIMEOUT,
+) -> Dict[str, str]:
+    """
+    Process a video, or a directory of videos, through asynchronous batch jobs.
+
+    Every frame description of every video is submitted as one batch, followed by
+    one batch for the steps of all segments and one for the general descriptions.
+    A batch over the request count or size limits is split into several.
+    Latency is traded for the lower cost and higher throughput of batch jobs.
+
+    Args:
+        path (str): A video's segments directory, or a directory of those
+        backend (Optional[BatchBackend]): Batch backend, defaults to the Anthropic API
+        limit (Optional[int]): Maximum number of segments to process per video
+        poll_interval (float): Seconds to wait between batch status checks
+        delta_frames (bool): Send only the changed region of consecutive frames
+        timeout (float): Seconds to wait for each batch before giving up
+
+    Returns:
+        Dict[str, str]: Combined XML description for each video directory
+    """
+    backend = backend or AnthropicBatchBackend()
+    videos = {
+        video_path: _build_knowledge_base(video_path, limit)
+        for video_path in _find_videos(path)
+    }
+
+    # Describe every frame of every video in a single batch
+    describe_requests = []
+    descriptions = {}
+    for v, knowledge_base in enumerate(videos.values()):
+        for s, segment in enumerate(knowledge_base):
+            frame_requests = _frame_requests(segment["images"], delta=delta_frames)
+            for f, request in enumerate(frame_requests):
+                if request is None:
+                    descriptions[f"v{v}-s{s}-f{f}"] = _UNCHANGED_FRAME_DESCRIPTION
+                    continue
+                prompt, images = request
+                describe_requests.append(
+                    _batch_request(f"v{v}-s{s}-f{f}", prompt, images=images)
+                )
+    descriptions.update(_run_batch(backend, describe_requests, poll_interval, timeout))
+
+    # Transcribe locally and create the steps of every segment in a single batch
+    steps_requests = []
+    for v, knowledge_base in enumerate(videos.values()):
+        for s, segment in enumerate(knowledge_base):
+            audio_text = _transcribe_from_path(segment["audio"], verbose=True)
+            image_descriptions = [
+                _format_image_description(f, descriptions[f"v{v}-s{s}-f{f}"])
+                for f in range(len(segment["images"]))
+                if descriptions.get(f"v{v}-s{s}-f{f}") is not None
+            ]
+            steps_requests.append(
+                _batch_request(
+                    f"v{v}-s{s}",
+                    _prompt_blocks(
+                        _STEPS_CREATION_PROMPT,
+                        audio_text=audio_text,
+                        image_descriptions="\n".join(image_descriptions),
+                    ),
+                )
+            )
+    steps = _run_batch(backend, steps_requests, poll_interval, timeout)
+
+    segment_results = {
+        v: [
+            _extract_xml(steps.get(f"v{v}-s{s}") or "")
+            for s in range(len(knowledge_base))
+        ]
+        for v, knowledge_base in enumerate(videos.values())
+    }
+
+    # Create the general tool description of every video in a single batch
+    general_requests = [
+        _batch_request(
+            f"v{v}",
+            _prompt_blocks(_GENERAL_TOOL_CREATION_PROMPT, steps="\n".join(results)),
+        )
+        for v, results in segment_results.items()
+    ]
+    general_descriptions = _run_batch(backend, general_requests, poll_interval, timeout)
+    print(f"Token usage: {usage_totals()}")
+
+    return {
+        video_path: _final_xml_creation(
+            _extract_xml(general_descriptions.get(f"v{v}") or ""),
+            "\n".join(segment_results[v]),
+        )
+        for v, video_path in enumerate(videos)
+    }
+
+
 if __name__ == "__main__":
-    # Example usage
-    result = process_video_segments("ingestor/video_parts", limit=4)
-    print(result)
+    parser = argparse.ArgumentParser(
+        description="Generate steps XML from processed video segments"
+    )
+    parser.add_argument("path", nargs="?", default="ingestor/video_parts")
+    parser.add_argument("--limit", type=int, default=4)
+    parser.add_argument(
+        "--batch",
+        action="store_true",
+        help="Process a video or a directory of videos through batch jobs",
+    )
+    parser.add_argument(
+        "--delta-frames",
+        action="store_true",
+        help="Describe only the changed region of consecutive frames",
+    )
+    parser.add_argument(
+        "--batch-dir",
+        help="Use a local file-based batch backend rooted at this directory",
+    )
+    args = parser.parse_args()
+
+    if args.batch:
+        backend = LocalFileBatchBackend(args.batch_dir) if args.batch_dir else None
+        results = process_videos_batch(
+            args.path,
+            backend=backend,
+            limit=args.limit,
+            delta_frames=args.delta_frames,
+        )
+        for video_path, result in results.items():
+            with open(os.path.join(video_path, "steps.xml"), "w") as f:
+                f.write(result)
+            print(f"{video_path}: {result}")
+    else:
+        result = process_video_segments(
+            args.path, limit=args.limit, delta_frames=args.delta_frames
+        )
+        print(result)
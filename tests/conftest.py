@@ -0,0 +1,222 @@
+import json
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import pytest
+from PIL import Image
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# knowledge_extractor lives at the root, computer_use_demo in its own project
+for path in (ROOT, ROOT / "claude-computer-use-macos"):
+    if str(path) not in sys.path:
+        sys.path.insert(0, str(path))
+
+from computer_use_demo.tools.backend import ComputerBackend  # noqa: E402
+
+
+class FakeBackend(ComputerBackend):
+    """A screen held in memory that records the input it receives."""
+
+    def __init__(self, size=(320, 200), display_num=None):
+        self.image = Image.new("RGB", size, "white")
+        self.display_num = display_num
+        self.events: list[tuple] = []
+        # representations by type, like a real pasteboard; text is one of them
+        self.clipboard: dict[str, object] = {}
+        self.pointer = (0, 0)
+        self.screenshots = 0
+        self.samples = 0
+        self.closed = False
+
+    def size(self):
+        return self.image.size
+
+    def screenshot(self):
+        self.screenshots += 1
+        return self.image.copy()
+
+    def sample(self, reduction):
+        self.samples += 1
+        return self.image.reduce(reduction).convert("L")
+
+    def position(self):
+        return self.pointer
+
+    def move(self, x, y):
+        self.pointer = (x, y)
+        self.events.append(("move", x, y))
+
+    def click(self, button="left"):
+        self.events.append(("click", button))
+
+    def double_click(self):
+        self.events.append(("double_click",))
+
+    def mouse_down(self):
+        self.events.append(("mouse_down",))
+
+    def mouse_up(self):
+        self.events.append(("mouse_up",))
+
+    def write(self, text, interval=0.0):
+        self.events.append(("write", text, interval))
+
+    def hotkey(self, *keys):
+        self.events.append(("hotkey", *keys))
+        if keys == self.paste_keys:
+            self.events.append(("paste", self.get_clipboard()))
+
+    def get_clipboard(self):
+        return self.clipboard.get("text", "")
+
+    def set_clipboard(self, text):
+        self.clipboard = {"text": text}
+
+    def save_clipboard(self):
+        return dict(self.clipboard)
+
+    def restore_clipboard(self, saved):
+        self.clipboard = saved
+
+    def close(self):
+        self.closed = True
+
+
+def text_block(text: str) -> dict:
+    return {"type": "text", "text": text}
+
+
+def tool_use_block(id: str, name: str, input: dict) -> dict:
+    return {"type": "tool_use", "id": id, "name": name, "input": input}
+
+
+def message(*content: dict, stop_reason: str = "end_turn", **usage: int) -> dict:
+    """A Messages API response holding content blocks."""
+    return {
+        "id": "msg_stub",
+        "type": "message",
+        "role": "assistant",
+        "model": "stub",
+        "content": list(content),
+        "stop_reason": stop_reason,
+        "stop_sequence": None,
+        "usage": {"input_tokens": 10, "output_tokens": 5, **usage},
+    }
+
+
+def _stream_events(response: dict):
+    """The server-sent events that stream a response."""
+    start = dict(response, content=[], stop_reason=None)
+    yield "message_start", {"type": "message_start", "message": start}
+    for index, block in enumerate(response["content"]):
+        if block["type"] == "text":
+            opening, delta = dict(block, text=""), {
+                "type": "text_delta",
+                "text": block["text"],
+            }
+        else:
+            opening, delta = dict(block, input={}), {
+                "type": "input_json_delta",
+                "partial_json": json.dumps(block["input"]),
+            }
+        yield "content_block_start", {
+            "type": "content_block_start",
+            "index": index,
+            "content_block": opening,
+        }
+        yield "content_block_delta", {
+            "type": "content_block_delta",
+            "index": index,
+            "delta": delta,
+        }
+        yield "content_block_stop", {"type": "content_block_stop", "index": index}
+    yield "message_delta", {
+        "type": "message_delta",
+        "delta": {"stop_reason": response["stop_reason"], "stop_sequence": None},
+        "usage": response["usage"],
+    }
+    yield "message_stop", {"type": "message_stop"}
+
+
+class AnthropicStub:
+    """
+    A local Messages API server. Each request is recorded and answered, after
+    delay seconds, with the next queued response, streamed when the request asks
+    for it, or with a plain text response once the queue is empty.
+    """
+
+    def __init__(self):
+        self.delay = 0.0
+        self.requests: list[dict] = []
+        self.headers: list[dict] = []
+        self.responses: list[dict] = []
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                stub.requests.append(body)
+                stub.headers.append(dict(self.headers))
+                time.sleep(stub.delay)
+                response = (
+                    stub.responses.pop(0)
+                    if stub.responses
+                    else message(text_block("done"))
+                )
+                self.send_response(200)
+                self.send_header("request-id", "req_stub")
+                if body.get("stream"):
+                    self.send_header("Content-Type", "text/event-stream")
+                    self.end_headers()
+                    for event, data in _stream_events(response):
+                        self.wfile.write(
+                            f"event: {event}\ndata: {json.dumps(data)}\n\n".encode()
+                        )
+                else:
+                    data = json.dumps(response).encode()
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(data)))
+                    self.end_headers()
+                    self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self._server.server_address[1]}"
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+@pytest.fixture
+def anthropic_stub(monkeypatch):
+    """A local Messages API server, which default clients are pointed at."""
+    with AnthropicStub() as stub:
+        monkeypatch.setenv("ANTHROPIC_API_KEY", "test")
+        monkeypatch.setenv("ANTHROPIC_API_URL", stub.url)
+        monkeypatch.setenv("ANTHROPIC_BASE_URL", stub.url)
+        yield stub
+
+
+@pytest.fixture
+def llm_cache():
+    """A fresh in-memory LangChain LLM cache in place of the global one."""
+    from langchain.globals import get_llm_cache, set_llm_cache
+    from langchain_core.caches import InMemoryCache
+
+    previous = get_llm_cache()
+    cache = InMemoryCache()
+    set_llm_cache(cache)
+    yield cache
+    set_llm_cache(previous)
@@ -0,0 +1,221 @@
+import asyncio
+import os
+import time
+
+import pytest
+
+from computer_use_demo.tools import BashTool
+from computer_use_demo.tools.base import ToolError
+from computer_use_demo.tools.bash import _BashSession
+from computer_use_demo.tools.run import OutputCapture
+
+
+def run_session(*commands: str, read_size: int | None = None, **kwargs):
+    """The results of commands run in order in one new session."""
+
+    async def go():
+        bash = _BashSession(**kwargs)
+        if read_size:
+            bash._read_size = read_size
+        await bash.start()
+        try:
+            return [await bash.run(command) for command in commands]
+        finally:
+            bash.stop()
+            await bash._process.wait()
+
+    return asyncio.run(go())
+
+
+def test_output_is_read_up_to_the_sentinel():
+    first, second = run_session("echo hello; echo oops >&2", "echo again")
+    assert (first.output, first.error) == ("hello", "oops")
+    assert (second.output, second.error) == ("again", "")
+
+
+def test_a_sentinel_split_across_reads_is_found():
+    (result,) = run_session("echo '<<exi'; echo done", read_size=3)
+    assert result.output == "<<exi\ndone"
+
+
+def test_output_without_a_final_newline_ends_before_the_sentinel():
+    (result,) = run_session("printf abc")
+    assert result.output == "abc"
+
+
+def test_both_streams_are_drained_while_the_command_runs():
+    # more than a pipe buffer on each stream, which would block bash if either
+    # stream were only read once the other one had finished
+    (result,) = run_session("head -c 200000 /dev/zero | tr '\\0' a | tee /dev/stderr")
+    assert len(result.output) < 200000
+    assert "200000 bytes" in result.output
+    assert "200000 bytes" in result.error
+
+
+def test_a_command_that_times_out_stops_its_session():
+    async def go():
+        tool = BashTool()
+        try:
+            with pytest.raises(ToolError, match="has been stopped"):
+                await tool(command="sleep 5", session="slow", timeout=0.2)
+            result = await tool(command="echo back", session="slow")
+        finally:
+            tool.close()
+        return result
+
+    result = asyncio.run(go())
+    assert result.output == "back"
+    assert result.system.startswith(
+        "bash session 'slow' was stopped after a command ran for 0.2 seconds"
+    )
+
+
+def test_short_output_is_kept_as_is():
+    capture = OutputCapture(limit=10)
+    capture.write(b"hello")
+    capture.close()
+    assert capture.text() == "hello"
+    assert capture.path is None
+
+
+def test_long_output_keeps_its_ends_and_spills_the_rest():
+    capture = OutputCapture(limit=10)
+    for chunk in (b"0123", b"456789ab", b"cdefghij"):
+        capture.write(chunk)
+    capture.close()
+    try:
+        text = capture.text()
+        assert text.startswith("01234\n<response clipped: 10 bytes")
+        assert text.endswith(">\nfghij")
+        assert capture.path in text
+        with open(capture.path, "rb") as f:
+            assert f.read() == b"0123456789abcdefghij"
+    finally:
+        capture.remove()
+    assert not os.path.exists(capture.path)
+
+
+def test_output_without_an_owner_is_not_spilled():
+    capture = OutputCapture(limit=10, spill=False)
+    capture.write(b"0123456789abcdefghij")
+    capture.close()
+    assert capture.path is None
+    assert "full output" not in capture.text()
+
+
+def test_a_session_keeps_only_its_latest_spill_files():
+    async def go():
+        bash = _BashSession()
+        bash._output_limit = 10
+        bash._max_spills = 2
+        await bash.start()
+        try:
+            for _ in range(3):
+                await bash.run("seq 100")
+            paths = [capture.path for capture in bash._spills]
+            assert len(paths) == 2
+            assert all(os.path.exists(path) for path in paths)
+        finally:
+            bash.stop()
+            await bash._process.wait()
+        return paths
+
+    paths = asyncio.run(go())
+    # stopping the session deletes them
+    assert not any(os.path.exists(path) for path in paths)
+
+
+def with_tool(scenario, **kwargs):
+    """Runs scenario(tool) with a new BashTool, closed afterwards."""
+
+    async def go():
+        tool = BashTool(**kwargs)
+        try:
+            return await scenario(tool)
+        finally:
+            tool.close()
+
+    return asyncio.run(go())
+
+
+def test_named_sessions_are_separate_shells(tmp_path):
+    async def scenario(tool):
+        await tool(command=f"cd {tmp_path}", session="a")
+        return (
+            (await tool(command="pwd", session="a")).output,
+            (await tool(command="pwd", session="b")).output,
+        )
+
+    a, b = with_tool(scenario)
+    assert a == str(tmp_path)
+    assert b == os.getcwd()
+
+
+def test_sessions_run_concurrently():
+    async def scenario(tool):
+        start = time.monotonic()
+        await asyncio.gather(
+            tool(command="sleep 0.3", session="a"),
+            tool(command="sleep 0.3", session="b"),
+        )
+        return time.monotonic() - start
+
+    assert with_tool(scenario) < 0.55
+
+
+def test_the_least_recently_used_session_makes_room():
+    async def scenario(tool):
+        await tool(command="export X=1", session="a")
+        await tool(command="true", session="b")
+        made_room = await tool(command="true", session="c")
+        back = await tool(command="echo ${X:-unset}", session="a")
+        return made_room, back
+
+    made_room, back = with_tool(scenario, max_sessions=2)
+    assert made_room.system.startswith("bash session 'a' was stopped to make room")
+    assert back.output == "unset"
+    assert "was stopped to make room for session 'c'" in back.system
+
+
+def test_idle_sessions_are_stopped():
+    async def scenario(tool):
+        await tool(command="true", session="a")
+        await asyncio.sleep(0.1)
+        return await tool(command="true", session="a")
+
+    result = with_tool(scenario, idle_timeout=0.05)
+    assert "was stopped after being idle for 0.05 seconds" in result.system
+
+
+def test_background_jobs_are_polled_until_they_exit():
+    async def scenario(tool):
+        started = await tool(command="echo one; sleep 0.2; echo two", background=True)
+        await asyncio.sleep(0.1)
+        running = await tool(job=1)
+        await asyncio.sleep(0.3)
+        finished = await tool(job=1)
+        with pytest.raises(ToolError, match="there is no background job 1"):
+            await tool(job=1)
+        return started, running, finished
+
+    started, running, finished = with_tool(scenario)
+    assert started.output.startswith("Started background job 1 ")
+    assert running.output == "Job 1 is running. New output:\none\n"
+    assert finished.output == "Job 1 has exited with returncode 0. New output:\ntwo\n"
+
+
+def test_a_background_job_can_be_killed():
+    async def scenario(tool):
+        await tool(command="sleep 5", background=True)
+        return await tool(job=1, restart=True)
+
+    result = with_tool(scenario)
+    assert result.output == "Job 1 has exited with returncode -15."
+
+
+def test_calls_in_the_same_session_conflict_and_others_do_not():
+    tool = BashTool()
+    a, b = tool.resources(session="a"), tool.resources(session="b")
+    assert a[1] == {"bash_session:a"}
+    assert not a[1] & (b[0] | b[1])
+    assert tool.resources(job=1) == (frozenset(), {"bash_job:1"})
@@ -0,0 +1,245 @@
+import asyncio
+import base64
+
+from anthropic import AsyncAnthropic
+from conftest import message, text_block, tool_use_block
+
+from computer_use_demo.conversation import ConversationState
+from computer_use_demo.loop import APIProvider, sampling_loop
+from computer_use_demo.tools import ImageHandle, ImageStore, ToolCollection
+
+
+def image_block(data="aW1n") -> dict:
+    return {
+        "type": "image",
+        "source": {"type": "base64", "media_type": "image/png", "data": data},
+    }
+
+
+def turn(index: int, *images: dict) -> list[dict]:
+    """An assistant tool call and the user's tool result holding images."""
+    tool_use_id = f"toolu_{index}"
+    return [
+        {
+            "role": "assistant",
+            "content": [tool_use_block(tool_use_id, "computer", {"action": "key"})],
+        },
+        {
+            "role": "user",
+            "content": [
+                {
+                    "type": "tool_result",
+                    "tool_use_id": tool_use_id,
+                    "content": [text_block(f"result {index}"), *images],
+                }
+            ],
+        },
+    ]
+
+
+def conversation(turns: int) -> ConversationState:
+    state = ConversationState([{"role": "user", "content": "task"}])
+    for index in range(turns):
+        for item in turn(index, image_block()):
+            state.append(item)
+    return state
+
+
+def images_left(state: ConversationState) -> list[int]:
+    """The indexes of the turns whose tool result still holds its image."""
+    results = [m["content"][0] for m in state.messages if m["role"] == "user"][1:]
+    return [
+        index
+        for index, result in enumerate(results)
+        if any(block["type"] == "image" for block in result["content"])
+    ]
+
+
+def test_images_are_indexed_as_they_are_appended():
+    state = conversation(3)
+    assert state.image_count == 3
+
+
+def test_prune_removes_the_oldest_images_in_chunks():
+    state = conversation(15)
+
+    state.prune_images(images_to_keep=3, min_removal_threshold=5)
+
+    # 12 beyond the limit, rounded down to a multiple of 5
+    assert images_left(state) == list(range(10, 15))
+    assert state.image_count == 5
+    # the text of the pruned results stays
+    assert state.messages[2]["content"][0]["content"] == [text_block("result 0")]
+
+
+def test_prune_below_the_threshold_changes_nothing():
+    state = conversation(5)
+    state.prune_images(images_to_keep=3, min_removal_threshold=5)
+    assert images_left(state) == list(range(5))
+
+
+def test_the_summary_response_is_reported_with_the_others(anthropic_stub):
+    tool_call = message(
+        tool_use_block("toolu_1", "bash", {"command": "true"}), stop_reason="tool_use"
+    )
+    anthropic_stub.responses = [
+        tool_call,
+        tool_call,
+        message(text_block("summary"), input_tokens=50),
+        message(text_block("done")),
+    ]
+    responses = []
+
+    async def run():
+        await sampling_loop(
+            model="stub",
+            provider=APIProvider.ANTHROPIC,
+            system_prompt_suffix="",
+            messages=[{"role": "user", "content": "task"}],
+            output_callback=lambda block: None,
+            tool_output_callback=lambda result, tool_use_id: None,
+            api_response_callback=responses.append,
+            api_key="test",
+            client=AsyncAnthropic(api_key="test", base_url=anthropic_stub.url),
+            tool_collection=ToolCollection(),
+            token_budget=1,
+            keep_last_turns=1,
+        )
+
+    asyncio.run(run())
+
+    assert len(responses) == len(anthropic_stub.requests) == 4
+    summary = responses[2]
+    assert summary.content[0].text == "summary"
+    assert summary.usage.input_tokens == 50
+
+
+def stored_conversation(turns: int) -> tuple[ConversationState, ImageStore]:
+    store = ImageStore()
+    state = ConversationState([{"role": "user", "content": "task"}])
+    for index in range(turns):
+        handle = store.put(f"image {index}".encode())
+        for item in turn(index, image_block(handle)):
+            state.append(item)
+    return state, store
+
+
+def image_data(messages: list[dict]) -> list:
+    return [
+        block["source"]["data"]
+        for m in messages
+        if isinstance(m["content"], list)
+        for item in m["content"]
+        if item["type"] == "tool_result"
+        for block in item["content"]
+        if block["type"] == "image"
+    ]
+
+
+def test_api_messages_resolve_handles_without_touching_the_history():
+    state, store = stored_conversation(2)
+
+    sent = state.api_messages()
+
+    assert image_data(sent) == [
+        base64.b64encode(b"image 0").decode(),
+        base64.b64encode(b"image 1").decode(),
+    ]
+    assert all(isinstance(data, ImageHandle) for data in image_data(state.messages))
+    # only the tool results that hold images are copied
+    assert sent[0] is state.messages[0]
+    assert sent[1]["content"][0] is state.messages[1]["content"][0]
+    assert sent[2]["content"][0] is not state.messages[2]["content"][0]
+
+
+def test_resolve_images_hands_back_plain_data_and_empties_the_store():
+    state, store = stored_conversation(2)
+
+    state.resolve_images()
+
+    assert image_data(state.messages) == [
+        base64.b64encode(b"image 0").decode(),
+        base64.b64encode(b"image 1").decode(),
+    ]
+    assert store.memory_size == 0
+
+
+def test_pruned_images_are_released_from_the_store():
+    state, store = stored_conversation(3)
+
+    state.prune_images(images_to_keep=1, min_removal_threshold=1)
+
+    assert store.memory_size == len(b"image 2")
+
+
+def compact(state, summarize=None, **kwargs):
+    return asyncio.run(state.compact(summarize=summarize, **kwargs))
+
+
+def test_a_conversation_under_budget_is_not_compacted():
+    state = conversation(6)
+    messages = list(state.messages)
+    assert not compact(state, token_budget=state.token_count, keep_last_turns=2)
+    assert state.messages == messages
+
+
+def test_compacting_summarizes_the_oldest_turns_into_the_task():
+    state, store = stored_conversation(6)
+    transcripts = []
+
+    async def summarize(transcript):
+        transcripts.append(transcript)
+        return "summary of the first turns"
+
+    assert compact(state, summarize, token_budget=100, keep_last_turns=2)
+
+    first = state.messages[0]
+    assert first["content"][0] == text_block("task")
+    assert "summary of the first turns" in first["content"][1]["text"]
+    # the last turns stay verbatim
+    assert len(state.messages) == 5
+    assert [m["content"][0].get("id") for m in state.messages[1::2]] == [
+        "toolu_4",
+        "toolu_5",
+    ]
+    assert transcripts[0].splitlines()[:2] == [
+        'action: computer {"action": "key"}',
+        "result: result 0",
+    ]
+    # the images of the removed turns are released
+    assert state.image_count == 2
+    assert store.memory_size == len(b"image 4") + len(b"image 5")
+
+
+def test_without_a_summarizer_the_actions_are_listed():
+    state = conversation(4)
+    compact(state, token_budget=100, keep_last_turns=1)
+    summary = state.messages[0]["content"][1]["text"]
+    assert "Earlier actions, in order:" in summary
+    assert summary.count("action: computer") == 3
+
+
+def test_summaries_extend_the_previous_one_and_are_cached():
+    calls = []
+
+    async def summarize(transcript):
+        calls.append(transcript)
+        return f"summary {len(calls)}"
+
+    cache = {}
+    for _ in range(2):
+        state = ConversationState([{"role": "user", "content": "task"}], cache)
+        for index in range(3):
+            for item in turn(index, image_block()):
+                state.append(item)
+        compact(state, summarize, token_budget=100, keep_last_turns=1)
+    # the second conversation found the same transcript in the shared cache
+    assert len(calls) == 1
+
+    for index in range(3, 6):
+        for item in turn(index, image_block()):
+            state.append(item)
+    compact(state, summarize, token_budget=100, keep_last_turns=1)
+    assert calls[1].startswith("Summary of the turns before:\nsummary 1\n")
+    assert "summary 2" in state.messages[0]["content"][1]["text"]
+    assert state.messages[0]["content"][0] == text_block("task")
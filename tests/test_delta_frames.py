@@ -0,0 +1,94 @@
+import base64
+from pathlib import Path
+
+import pytest
+
+cv2 = pytest.importorskip("cv2")
+np = pytest.importorskip("numpy")
+pytest.importorskip("langchain_anthropic")
+
+import knowledge_extractor as ke  # noqa: E402
+
+SAMPLE_FRAMES = Path(__file__).parent.parent / "ingestor/video_parts/segment_000/frames"
+
+
+def write_frames(tmp_path, *frames):
+    paths = []
+    for index, frame in enumerate(frames):
+        path = tmp_path / f"frame_{index}.png"
+        cv2.imwrite(str(path), frame)
+        paths.append(str(path))
+    return paths
+
+
+def kinds(requests):
+    """The kind of request of each frame: None, "full" or "crop"."""
+    return [
+        None if request is None else "full" if len(request[1]) == 1 else "crop"
+        for request in requests
+    ]
+
+
+@pytest.fixture
+def blank():
+    return np.full((400, 600, 3), 255, np.uint8)
+
+
+def test_small_change_sends_a_crop_and_outlined_thumbnail(tmp_path, blank):
+    changed = blank.copy()
+    changed[100:140, 200:300] = 0
+
+    requests = ke._frame_requests(write_frames(tmp_path, blank, changed), delta=True)
+
+    assert kinds(requests) == ["full", "crop"]
+    prompt, (crop, thumbnail) = requests[1]
+    assert "changed" in prompt[0]["text"]
+    decoded = cv2.imdecode(np.frombuffer(base64.b64decode(thumbnail), np.uint8), 1)
+    red = (decoded[:, :, 2] > 150) & (decoded[:, :, 0] < 100)
+    assert red.any()
+
+
+def test_changes_below_the_minimum_are_skipped(tmp_path, blank):
+    noisy = blank.copy()
+    noisy[10:13, 10:13] = 0  # 9 pixels, as from compression noise
+
+    requests = ke._frame_requests(write_frames(tmp_path, blank, noisy), delta=True)
+
+    assert kinds(requests) == ["full", None]
+
+
+def test_scattered_changes_send_the_full_frame(tmp_path, blank):
+    scattered = blank.copy()
+    scattered[0:20, 0:40] = 0
+    scattered[380:400, 560:600] = 0  # the bounding box covers the whole frame
+
+    requests = ke._frame_requests(write_frames(tmp_path, blank, scattered), delta=True)
+
+    assert kinds(requests) == ["full", "full"]
+
+
+def test_scene_change_sends_the_full_frame(tmp_path, blank):
+    requests = ke._frame_requests(
+        write_frames(tmp_path, blank, np.zeros_like(blank)), delta=True
+    )
+
+    assert kinds(requests) == ["full", "full"]
+
+
+def test_undecodable_frames_are_sent_in_full(tmp_path, blank):
+    paths = write_frames(tmp_path, blank, blank)
+    broken = tmp_path / "broken.png"
+    broken.write_bytes(b"not an image")
+
+    requests = ke._frame_requests([paths[0], str(broken), paths[1]], delta=True)
+
+    assert kinds(requests) == ["full", "full", None]
+
+
+@pytest.mark.skipif(not SAMPLE_FRAMES.is_dir(), reason="no sample frames")
+def test_sample_segment_sends_no_requests_for_compression_noise():
+    paths = sorted(map(str, SAMPLE_FRAMES.glob("*.jpg")), key=ke._natural_sort_key)
+
+    requests = ke._frame_requests(paths, delta=True)
+
+    assert kinds(requests) == ["full"] + [None] * (len(paths) - 1)
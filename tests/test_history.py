@@ -0,0 +1,26 @@
+from computer_use_demo.tools.history import COMPRESS_MIN_LENGTH, EditHistory
+
+
+def test_edit_history_undoes_in_reverse_order(tmp_path):
+    path = tmp_path / "file.txt"
+    large = "x" * COMPRESS_MIN_LENGTH * 4
+    texts = ["first\n", "first\nsecond\n", large, large + "tail\n", "last\n"]
+
+    history = EditHistory()
+    for text in texts:
+        history.push(path, text)
+
+    assert [history.pop(path) for _ in texts] == texts[::-1]
+    assert history.pop(path) is None
+    assert history.size == 0
+
+
+def test_edit_history_drops_oldest_entries_over_budget(tmp_path):
+    path = tmp_path / "file.txt"
+    history = EditHistory(max_file_bytes=100)
+    for i in range(10):
+        history.push(path, f"{i}" * 40)
+
+    assert history.pop(path) == "9" * 40
+    assert history.pop(path) == "8" * 40
+    assert history.pop(path) is None
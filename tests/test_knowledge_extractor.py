@@ -0,0 +1,86 @@
+import json
+
+import pytest
+
+pytest.importorskip("cv2")
+pytest.importorskip("langchain_anthropic")
+
+import knowledge_extractor as ke  # noqa: E402
+
+
+def test_local_file_batch_backend_round_trip(tmp_path):
+    backend = ke.LocalFileBatchBackend(
+        str(tmp_path),
+        responder=lambda params: params["messages"][0]["content"][0]["text"].upper(),
+    )
+    requests = [
+        ke._batch_request(f"req-{i}", [{"type": "text", "text": f"prompt {i}"}])
+        for i in range(3)
+    ]
+
+    results = ke._run_batch(backend, requests, poll_interval=0)
+
+    assert results == {f"req-{i}": f"PROMPT {i}" for i in range(3)}
+    (batch_dir,) = tmp_path.iterdir()
+    assert (batch_dir / "requests.jsonl").read_text().count("\n") == 3
+
+
+def test_local_file_batch_backend_waits_for_results(tmp_path):
+    backend = ke.LocalFileBatchBackend(str(tmp_path))
+    batch_id = backend.submit([ke._batch_request("only", "prompt")])
+    assert not backend.is_done(batch_id)
+
+    (tmp_path / batch_id / "results.jsonl").write_text(
+        '{"custom_id": "only", "text": "done"}\n'
+    )
+    assert backend.is_done(batch_id)
+    assert backend.results(batch_id) == {"only": "done"}
+
+
+def test_run_batch_splits_requests_over_the_batch_limits(tmp_path, monkeypatch):
+    monkeypatch.setattr(ke, "_BATCH_MAX_REQUESTS", 2)
+    backend = ke.LocalFileBatchBackend(str(tmp_path), responder=lambda params: "ok")
+    requests = [ke._batch_request(f"req-{i}", "prompt") for i in range(5)]
+
+    results = ke._run_batch(backend, requests, poll_interval=0)
+
+    assert results == {f"req-{i}": "ok" for i in range(5)}
+    assert len(list(tmp_path.iterdir())) == 3
+
+
+def test_batch_chunks_respect_the_size_limit(monkeypatch):
+    requests = [ke._batch_request(f"req-{i}", "x" * 100) for i in range(4)]
+    size = len(json.dumps(requests[0]))
+    monkeypatch.setattr(ke, "_BATCH_MAX_BYTES", 2 * size + 10)
+
+    chunks = ke._batch_chunks(requests)
+
+    assert [len(chunk) for chunk in chunks] == [2, 2]
+
+
+def test_run_batch_times_out(tmp_path):
+    backend = ke.LocalFileBatchBackend(str(tmp_path))
+
+    with pytest.raises(TimeoutError):
+        ke._run_batch(
+            backend, [ke._batch_request("only", "prompt")], poll_interval=0, timeout=0
+        )
+
+
+def test_local_file_batch_backend_publishes_results_whole(tmp_path):
+    seen = []
+
+    def responder(params):
+        # results must not be visible while they are being written
+        seen.append(list(tmp_path.glob("*/results.jsonl")))
+        return "text"
+
+    backend = ke.LocalFileBatchBackend(str(tmp_path), responder=responder)
+    batch_id = backend.submit([ke._batch_request(f"r{i}", "p") for i in range(2)])
+
+    assert seen == [[], []]
+    assert backend.is_done(batch_id)
+    assert sorted(p.name for p in (tmp_path / batch_id).iterdir()) == [
+        "requests.jsonl",
+        "results.jsonl",
+    ]
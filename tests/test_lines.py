@@ -0,0 +1,25 @@
+from computer_use_demo.tools.lines import BLOCK_SIZE, LineIndex
+
+
+def test_line_index_reads_ranges_across_blocks(tmp_path):
+    path = tmp_path / "large.txt"
+    lines = [f"line {i} " + "-" * (i % 50) for i in range(1, 20001)]
+    text = "\n".join(lines) + "\n"
+    path.write_text(text)
+    assert path.stat().st_size > 2 * BLOCK_SIZE
+
+    index = LineIndex(path)
+    assert index.line_count == len(text.split("\n"))
+    assert index.read(1, 3) == "\n".join(lines[:3])
+    assert index.read(9999, 10002) == "\n".join(lines[9998:10002])
+    assert index.read(19999) == "\n".join(lines[19998:]) + "\n"
+
+
+def test_line_index_normalizes_crlf(tmp_path):
+    path = tmp_path / "crlf.txt"
+    path.write_bytes(b"a\r\nb\r\nc")
+
+    index = LineIndex(path)
+    assert index.line_count == 3
+    assert index.read(2, 2) == "b"
+    assert index.read(1) == "a\nb\nc"
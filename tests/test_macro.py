@@ -0,0 +1,69 @@
+import asyncio
+
+import pytest
+from conftest import FakeBackend
+
+from computer_use_demo.loop import _make_api_tool_result
+from computer_use_demo.tools import ComputerMacroTool, ComputerTool
+from computer_use_demo.tools.base import ToolError
+
+
+def run(backend, actions):
+    macro = ComputerMacroTool(ComputerTool(backend=backend, settle_time=0.01))
+    return asyncio.run(macro(actions=actions))
+
+
+def test_actions_run_in_order_with_one_screenshot():
+    backend = FakeBackend()
+    result = run(
+        backend,
+        [
+            {"action": "mouse_move", "coordinate": [10, 20]},
+            {"action": "left_click", "settle": True},
+            {"action": "type", "text": "hi", "method": "keys"},
+        ],
+    )
+
+    assert [event[0] for event in backend.events] == ["move", "click", "write"]
+    assert result.output.splitlines()[0] == "1. Mouse moved successfully to X=10, Y=20"
+    assert result.image is not None
+    # settling between actions only polls samples
+    assert backend.screenshots == 1
+
+
+def test_a_failing_action_reports_what_ran_with_the_screen():
+    backend = FakeBackend()
+    result = run(
+        backend,
+        [
+            {"action": "mouse_move", "coordinate": [10, 20]},
+            {"action": "type"},
+            {"action": "left_click"},
+        ],
+    )
+
+    assert result.error.splitlines() == [
+        "Action 2 (type) failed: text is required for type",
+        "Completed actions:",
+        "1. Mouse moved successfully to X=10, Y=20",
+    ]
+    assert result.image is not None
+    assert backend.events == [("move", 10, 20)]
+
+    api_result = _make_api_tool_result(result, "toolu_1")
+    assert api_result["is_error"]
+    assert [block["type"] for block in api_result["content"]] == ["text", "image"]
+
+
+def test_a_malformed_macro_runs_nothing():
+    backend = FakeBackend()
+    with pytest.raises(ToolError, match="Action 2 \\(left_click\\) failed"):
+        run(
+            backend,
+            [
+                {"action": "mouse_move", "coordinate": [10, 20]},
+                {"action": "left_click", "coordinate": [10, 20]},
+            ],
+        )
+    assert backend.events == []
+    assert backend.screenshots == 0
@@ -0,0 +1,47 @@
+import pytest
+
+from computer_use_demo.tools.base import ToolError
+from computer_use_demo.tools.edit import EditTool
+
+
+def test_multi_edit_applies_all_edits_and_undoes_them_together(tmp_path):
+    path = tmp_path / "file.py"
+    original = "one\ntwo\nthree\n"
+    path.write_text(original)
+
+    tool = EditTool()
+    tool.multi_edit(
+        path,
+        [
+            {"old_str": "two", "new_str": "TWO"},
+            {"insert_line": 0, "new_str": "zero"},
+            {"old_str": "three", "new_str": "THREE"},
+        ],
+    )
+    assert path.read_text() == "zero\none\nTWO\nTHREE\n"
+
+    tool.undo_edit(path)
+    assert path.read_text() == original
+
+
+@pytest.mark.parametrize(
+    "edits",
+    [
+        [{"old_str": "two", "new_str": "TWO"}, {"old_str": "missing", "new_str": ""}],
+        [{"old_str": "o", "new_str": "0"}],
+        [{"old_str": "one\ntwo", "new_str": "x"}, {"old_str": "two", "new_str": "y"}],
+        [{"old_str": "one", "new_str": "1"}, {"insert_line": 9, "new_str": "x"}],
+    ],
+    ids=["missing", "ambiguous", "overlap", "bad-line"],
+)
+def test_multi_edit_leaves_file_untouched_on_error(tmp_path, edits):
+    path = tmp_path / "file.py"
+    original = "one\ntwo\nthree\n"
+    path.write_text(original)
+
+    tool = EditTool()
+    with pytest.raises(ToolError, match="No edits were performed"):
+        tool.multi_edit(path, edits)
+    assert path.read_text() == original
+    with pytest.raises(ToolError, match="No edit history"):
+        tool.undo_edit(path)
@@ -0,0 +1,102 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("cv2")
+pytest.importorskip("langchain_anthropic")
+
+from anthropic import AsyncAnthropic  # noqa: E402
+from conftest import message, text_block  # noqa: E402
+
+import knowledge_extractor as ke  # noqa: E402
+from computer_use_demo.loop import APIProvider, sampling_loop  # noqa: E402
+from computer_use_demo.tools import ToolCollection  # noqa: E402
+
+LONG_TEMPLATE = "Static instructions. " * 300 + "{value}"
+
+
+@pytest.fixture(autouse=True)
+def fresh_state(monkeypatch, llm_cache):
+    monkeypatch.setattr(ke, "_usage_totals", dict.fromkeys(ke._usage_totals, 0))
+    monkeypatch.setattr(ke, "_PROMPT_CACHING", True)
+
+
+def test_only_prefixes_above_the_minimum_get_a_breakpoint():
+    long_blocks = ke._prompt_blocks(LONG_TEMPLATE, value="dynamic")
+    assert long_blocks[0]["cache_control"] == {"type": "ephemeral"}
+    assert long_blocks[1] == {"type": "text", "text": "dynamic"}
+
+    # the current prompts are all below the minimum
+    for template in (
+        ke._DESCRIBE_IMAGE_PROMPT,
+        ke._DESCRIBE_CHANGES_PROMPT,
+        ke._STEPS_CREATION_PROMPT,
+        ke._GENERAL_TOOL_CREATION_PROMPT,
+    ):
+        kwargs = {"audio_text": "", "image_descriptions": "", "steps": ""}
+        assert "cache_control" not in ke._prompt_blocks(template, **kwargs)[0]
+
+
+def test_prompt_caching_can_be_turned_off():
+    ke.set_prompt_caching(False)
+    assert "cache_control" not in ke._prompt_blocks(LONG_TEMPLATE, value="x")[0]
+
+
+def test_call_sends_the_breakpoint_without_a_beta_header(anthropic_stub):
+    anthropic_stub.responses.append(
+        message(text_block("ok"), cache_read_input_tokens=1200)
+    )
+
+    assert ke._call(ke._prompt_blocks(LONG_TEMPLATE, value="x"), on_text=print) == "ok"
+
+    (request,) = anthropic_stub.requests
+    content = request["messages"][0]["content"]
+    assert content[0]["cache_control"] == {"type": "ephemeral"}
+    assert "cache_control" not in content[1]
+    assert "prompt-caching" not in anthropic_stub.headers[0].get("anthropic-beta", "")
+    assert ke.usage_totals() == {
+        "input_tokens": 10,
+        "output_tokens": 5,
+        "cache_creation_input_tokens": 0,
+        "cache_read_input_tokens": 1200,
+    }
+
+
+def test_cached_responses_do_not_count_usage_again(anthropic_stub):
+    ke._call("prompt")
+    totals = ke.usage_totals()
+
+    assert ke._call("prompt") == "done"
+    assert len(anthropic_stub.requests) == 1
+    assert ke.usage_totals() == totals
+
+
+def test_batch_requests_carry_the_breakpoint():
+    request = ke._batch_request("id", ke._prompt_blocks(LONG_TEMPLATE, value="x"))
+    content = request["params"]["messages"][0]["content"]
+    assert content[0]["cache_control"] == {"type": "ephemeral"}
+
+
+@pytest.mark.parametrize("prompt_caching", [True, False])
+def test_sampling_loop_caches_the_system_prompt(anthropic_stub, prompt_caching):
+    async def run():
+        await sampling_loop(
+            model="stub",
+            provider=APIProvider.ANTHROPIC,
+            system_prompt_suffix="",
+            messages=[{"role": "user", "content": "hello"}],
+            output_callback=lambda block: None,
+            tool_output_callback=lambda result, tool_use_id: None,
+            api_response_callback=lambda response: None,
+            api_key="test",
+            prompt_caching=prompt_caching,
+            client=AsyncAnthropic(api_key="test", base_url=anthropic_stub.url),
+            tool_collection=ToolCollection(),
+        )
+
+    asyncio.run(run())
+
+    (request,) = anthropic_stub.requests
+    (system,) = request["system"]
+    assert ("cache_control" in system) == prompt_caching
+    assert anthropic_stub.headers[0]["anthropic-beta"] == "computer-use-2024-10-22"
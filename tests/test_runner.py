@@ -0,0 +1,67 @@
+import asyncio
+
+import pytest
+from conftest import FakeBackend
+
+from computer_use_demo.loop import LINUX_SYSTEM_PROMPT, SYSTEM_PROMPT, APIProvider
+from computer_use_demo.runner import Job, run_jobs
+
+
+def make_jobs(tmp_path, count):
+    steps = tmp_path / "steps.xml"
+    steps.write_text("<xml><main_description>Open the page</main_description></xml>")
+    return [Job(str(steps)) for _ in range(count)]
+
+
+def run(jobs, tmp_path, backend_factory):
+    return asyncio.run(
+        run_jobs(
+            jobs,
+            workers=2,
+            model="stub",
+            provider=APIProvider.ANTHROPIC,
+            api_key="test",
+            backend_factory=backend_factory,
+            workdir=str(tmp_path / "runs"),
+            prompt_caching=False,
+        )
+    )
+
+
+@pytest.mark.parametrize(
+    "display_num, system_prompt",
+    [(99, LINUX_SYSTEM_PROMPT), (None, SYSTEM_PROMPT)],
+    ids=["xvfb", "local"],
+)
+def test_jobs_get_the_system_prompt_of_their_display(
+    anthropic_stub, tmp_path, display_num, system_prompt
+):
+    results = run(
+        make_jobs(tmp_path, 2), tmp_path, lambda: FakeBackend(display_num=display_num)
+    )
+
+    assert [result.error for result in results] == [None, None]
+    assert len(anthropic_stub.requests) == 2
+    for request in anthropic_stub.requests:
+        assert request["system"][0]["text"] == system_prompt
+
+
+def test_a_failing_backend_stops_the_other_workers_first(anthropic_stub, tmp_path):
+    anthropic_stub.delay = 0.2
+    backends = []
+
+    def backend_factory():
+        if backends:
+            raise RuntimeError("no display")
+        backends.append(FakeBackend(display_num=99))
+        return backends[0]
+
+    with pytest.raises(ExceptionGroup) as raised:
+        run(make_jobs(tmp_path, 4), tmp_path, backend_factory)
+
+    assert raised.group_contains(RuntimeError, match="no display")
+    # the other worker was cancelled and released its display before returning
+    assert backends[0].closed
+    requests = len(anthropic_stub.requests)
+    asyncio.run(asyncio.sleep(0.3))
+    assert len(anthropic_stub.requests) == requests
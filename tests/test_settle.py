@@ -0,0 +1,70 @@
+import asyncio
+
+from conftest import FakeBackend
+from PIL import ImageDraw
+
+from computer_use_demo.tools import ComputerTool
+
+
+class LoadingBackend(FakeBackend):
+    """A screen whose spinner turns for the given number of samples."""
+
+    def __init__(self, changing_samples: int):
+        super().__init__()
+        self.changing_samples = changing_samples
+
+    def sample(self, reduction):
+        if self.samples < self.changing_samples:
+            shade = 0 if self.samples % 2 else 255
+            ImageDraw.Draw(self.image).rectangle((0, 0, 159, 99), fill=(shade,) * 3)
+        return super().sample(reduction)
+
+
+def click_then_screenshot(computer):
+    async def go():
+        await computer(action="left_click")
+        return await computer(action="screenshot")
+
+    return asyncio.run(go())
+
+
+def test_a_still_screen_settles_at_the_first_matching_sample():
+    backend = FakeBackend()
+    computer = ComputerTool(backend=backend, settle_time=1.0)
+    result = click_then_screenshot(computer)
+
+    assert backend.samples == 2
+    assert computer.last_settle_duration < 1.0
+    assert result.system.startswith("The screen settled ")
+    assert result.image is not None
+
+
+def test_a_changing_screen_waits_until_stable_for_settle_time():
+    backend = LoadingBackend(changing_samples=4)
+    computer = ComputerTool(backend=backend, settle_time=0.2)
+    result = click_then_screenshot(computer)
+
+    assert computer.last_settle_duration >= 0.2
+    assert result.system == (
+        f"The screen settled {computer.last_settle_duration:.2f}s after the action."
+    )
+
+
+def test_a_screen_that_keeps_changing_times_out():
+    backend = LoadingBackend(changing_samples=1000)
+    computer = ComputerTool(backend=backend, settle_time=0.2, settle_timeout=0.3)
+    result = click_then_screenshot(computer)
+
+    assert result.output == "The screen was still changing after 0.3s."
+    assert result.system is None
+    assert result.image is not None
+
+
+def test_without_an_action_there_is_nothing_to_wait_for():
+    backend = FakeBackend()
+    computer = ComputerTool(backend=backend)
+    result = asyncio.run(computer(action="screenshot"))
+
+    assert backend.samples == 0
+    assert computer.last_settle_duration == 0.0
+    assert result.system is None
@@ -0,0 +1,104 @@
+import asyncio
+import json
+
+from anthropic import AsyncAnthropic
+from conftest import FakeBackend, message, tool_use_block
+from PIL import ImageDraw
+
+from computer_use_demo.loop import APIProvider, sampling_loop
+from computer_use_demo.tools import ComputerTool, ToolCollection
+from computer_use_demo.trajectory import TrajectoryCache, perceptual_hash
+
+MOVE = message(
+    tool_use_block(
+        "toolu_1", "computer", {"action": "mouse_move", "coordinate": [10, 20]}
+    ),
+    stop_reason="tool_use",
+)
+
+
+def striped_backend(dialog: bool = False) -> FakeBackend:
+    """A screen with some structure to hash, optionally with a dialog over it."""
+    backend = FakeBackend()
+    draw = ImageDraw.Draw(backend.image)
+    for x in range(0, 320, 40):
+        draw.rectangle((x, 0, x + 19, 199), fill="black")
+    if dialog:
+        draw.rectangle((60, 40, 260, 160), fill="grey")
+    return backend
+
+
+def run(stub, cache, backend):
+    computer = ComputerTool(backend=backend, settle_time=0.01)
+    trajectory = cache.open("workflow", computer)
+
+    async def go():
+        await sampling_loop(
+            model="stub",
+            provider=APIProvider.ANTHROPIC,
+            system_prompt_suffix="",
+            messages=[{"role": "user", "content": "open the page"}],
+            output_callback=lambda block: None,
+            tool_output_callback=lambda result, tool_use_id: None,
+            api_response_callback=lambda response: None,
+            api_key="test",
+            client=AsyncAnthropic(api_key="test", base_url=stub.url),
+            tool_collection=ToolCollection(computer),
+            trajectory=trajectory,
+        )
+
+    asyncio.run(go())
+    return trajectory
+
+
+def test_a_finished_run_is_recorded(anthropic_stub, tmp_path):
+    anthropic_stub.responses = [MOVE]
+    backend = striped_backend()
+    trajectory = run(anthropic_stub, TrajectoryCache(str(tmp_path)), backend)
+
+    turns = json.loads((tmp_path / "workflow.json").read_text())["turns"]
+    screen = perceptual_hash(backend.image.reduce(8))
+    assert [int(turn["screen"], 16) for turn in turns] == [screen, screen]
+    assert turns[0]["response"]["content"][0]["name"] == "computer"
+    assert trajectory.replayed == 0
+
+
+def test_matching_screens_replay_the_recorded_tool_calls(anthropic_stub, tmp_path):
+    cache = TrajectoryCache(str(tmp_path))
+    anthropic_stub.responses = [MOVE]
+    run(anthropic_stub, cache, striped_backend())
+    anthropic_stub.requests.clear()
+
+    backend = striped_backend()
+    trajectory = run(anthropic_stub, cache, backend)
+
+    assert trajectory.replayed == 1
+    assert ("move", 10, 20) in backend.events
+    # only the final response, which reports on this run, came from the API
+    (request,) = anthropic_stub.requests
+    assert request["messages"][-1]["content"][0]["type"] == "tool_result"
+
+
+def test_a_different_screen_stops_replay(anthropic_stub, tmp_path):
+    cache = TrajectoryCache(str(tmp_path))
+    anthropic_stub.responses = [MOVE]
+    run(anthropic_stub, cache, striped_backend())
+    anthropic_stub.requests.clear()
+
+    anthropic_stub.responses = [MOVE]
+    backend = striped_backend(dialog=True)
+    trajectory = run(anthropic_stub, cache, backend)
+
+    assert trajectory.replayed == 0
+    assert len(anthropic_stub.requests) == 2
+    # the screen is captured in full once, to compare it; after that only sampled
+    assert backend.screenshots == 1
+
+
+def test_without_a_recording_the_screen_is_only_sampled(anthropic_stub, tmp_path):
+    anthropic_stub.responses = [MOVE]
+    backend = striped_backend()
+    run(anthropic_stub, TrajectoryCache(str(tmp_path)), backend)
+
+    assert backend.screenshots == 0
+    assert backend.samples == 2
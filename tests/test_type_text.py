@@ -0,0 +1,87 @@
+import asyncio
+
+import pytest
+from conftest import FakeBackend
+
+from computer_use_demo.tools import computer
+from computer_use_demo.tools.base import ToolError
+from computer_use_demo.tools.computer import ComputerTool
+
+
+class UnicodeBackend(FakeBackend):
+    types_unicode = True
+
+
+class NoClipboardBackend(FakeBackend):
+    def set_clipboard(self, text):
+        raise FileNotFoundError("xclip")
+
+
+@pytest.fixture(autouse=True)
+def no_paste_delay(monkeypatch):
+    monkeypatch.setattr(computer, "PASTE_RESTORE_DELAY", 0)
+
+
+def type_text(backend, text, method="auto"):
+    return asyncio.run(ComputerTool(backend=backend).type_text(text, method))
+
+
+def test_keys_types_with_a_delay():
+    backend = FakeBackend()
+    assert type_text(backend, "hello", "keys") == "keys"
+    assert backend.events == [("write", "hello", computer.TYPING_DELAY_MS / 1000.0)]
+
+
+def test_chunks_write_groups_without_delay():
+    backend = FakeBackend()
+    text = "x" * (computer.TYPING_GROUP_SIZE * 2 + 1)
+    assert type_text(backend, text, "chunks") == "chunks"
+    assert [event[1] for event in backend.events] == [
+        "x" * computer.TYPING_GROUP_SIZE,
+        "x" * computer.TYPING_GROUP_SIZE,
+        "x",
+    ]
+    assert {event[2] for event in backend.events} == {0.0}
+
+
+def test_paste_uses_the_paste_keys_and_restores_the_clipboard():
+    backend = FakeBackend()
+    backend.clipboard = {"text": "before"}
+    assert type_text(backend, "hello", "paste") == "paste"
+    assert backend.events == [("hotkey", "command", "v"), ("paste", "hello")]
+    assert backend.clipboard == {"text": "before"}
+
+
+def test_paste_restores_non_text_clipboard_contents():
+    backend = FakeBackend()
+    image = {"public.png": b"\x89PNG", "public.tiff": b"II*\x00"}
+    backend.clipboard = dict(image)
+    type_text(backend, "hello", "paste")
+    assert ("paste", "hello") in backend.events
+    assert backend.clipboard == image
+
+
+def test_paste_falls_back_to_chunks_without_a_clipboard():
+    backend = NoClipboardBackend()
+    assert type_text(backend, "hello", "paste") == "chunks"
+    assert backend.events == [("write", "hello", 0.0)]
+
+
+@pytest.mark.parametrize(
+    "backend, text, method",
+    [
+        (FakeBackend(), "hello", "keys"),
+        (FakeBackend(), "x" * computer.PASTE_MIN_LENGTH, "paste"),
+        (FakeBackend(), "héllo", "paste"),
+        (UnicodeBackend(), "héllo", "keys"),
+        (UnicodeBackend(), "é" * computer.PASTE_MIN_LENGTH, "paste"),
+    ],
+    ids=["short", "long", "non-ascii", "non-ascii-typeable", "long-non-ascii"],
+)
+def test_auto_types_short_text_the_backend_can_type(backend, text, method):
+    assert type_text(backend, text) == method
+
+
+def test_unknown_method_is_an_error():
+    with pytest.raises(ToolError):
+        type_text(FakeBackend(), "hello", "morse")
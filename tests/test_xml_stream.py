@@ -0,0 +1,131 @@
+import pytest
+
+pytest.importorskip("cv2")
+pytest.importorskip("langchain_anthropic")
+
+from langchain_core.caches import InMemoryCache  # noqa: E402
+from langchain_core.messages import AIMessageChunk  # noqa: E402
+
+import knowledge_extractor as ke  # noqa: E402
+
+STEPS_XML = """<reasoning>The user logs in</reasoning>
+<xml>
+<step>
+    <description>Open the <b>login</b> page</description>
+    <steps>
+        <step><description>Click "Login"</description></step>
+    </steps>
+</step>
+<step>
+    <description>Submit the form</description>
+</step>
+</xml>"""
+
+
+class FakeChatModel:
+    """Streams scripted (text, stop_reason) responses in small chunks."""
+
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.calls = 0
+
+    def __call__(self, **kwargs):
+        return self
+
+    def _get_llm_string(self):
+        return "fake"
+
+    def stream(self, messages):
+        self.calls += 1
+        text, stop_reason = self.responses.pop(0)
+        for start in range(0, len(text), 5):
+            yield AIMessageChunk(content=text[start : start + 5])
+        yield AIMessageChunk(
+            content="",
+            response_metadata={"stop_reason": stop_reason},
+            usage_metadata={"input_tokens": 10, "output_tokens": 5, "total_tokens": 15},
+        )
+
+
+@pytest.fixture
+def fake_model(monkeypatch):
+    def install(*responses):
+        model = FakeChatModel(responses)
+        monkeypatch.setattr(ke, "ChatAnthropic", model)
+        return model
+
+    monkeypatch.setattr(ke, "get_llm_cache", lambda cache=InMemoryCache(): cache)
+    return install
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, len(STEPS_XML)])
+def test_step_stream_parser_emits_top_level_steps(chunk_size):
+    emitted = []
+    parser = ke._StepStreamParser(lambda index, step: emitted.append((index, step)))
+    for start in range(0, len(STEPS_XML), chunk_size):
+        parser.feed(STEPS_XML[start : start + chunk_size])
+
+    assert parser.close() == STEPS_XML.split("<xml>")[1].split("</xml>")[0]
+    assert [index for index, _ in emitted] == [0, 1]
+    assert emitted[0][1].startswith("<step>") and "Click" in emitted[0][1]
+    assert emitted[1][1].strip().endswith("</step>")
+
+
+def test_step_stream_parser_rejects_malformed_and_truncated_xml():
+    parser = ke._StepStreamParser()
+    with pytest.raises(ke.MalformedXMLError):
+        parser.feed("<xml><step><steps></step>")
+
+    parser = ke._StepStreamParser()
+    parser.feed("<xml><step></step>")
+    with pytest.raises(ke.MalformedXMLError, match="truncated"):
+        parser.close()
+
+    with pytest.raises(ke.MalformedXMLError, match="no <xml>"):
+        ke._StepStreamParser().close()
+
+
+def test_call_xml_streams_steps_and_caches_the_response(fake_model):
+    model = fake_model((STEPS_XML, "end_turn"))
+    emitted = []
+
+    content = ke._call_xml("prompt", on_step=lambda i, step: emitted.append(i))
+    assert content == ke._extract_xml(STEPS_XML)
+    assert emitted == [0, 1]
+
+    emitted.clear()
+    assert ke._call_xml("prompt", on_step=lambda i, step: emitted.append(i)) == content
+    assert emitted == [0, 1]
+    assert model.calls == 1
+
+
+def test_call_xml_retries_malformed_xml_and_emits_each_step_once(fake_model):
+    malformed = "<xml><step>first</step><step><steps></step>"
+    model = fake_model((malformed, "end_turn"), (STEPS_XML, "end_turn"))
+    emitted = []
+
+    content = ke._call_xml("prompt", on_step=lambda i, step: emitted.append(i))
+
+    assert content == ke._extract_xml(STEPS_XML)
+    assert emitted == [0, 1]
+    assert model.calls == 2
+
+
+def test_call_xml_does_not_retry_a_response_cut_off_at_max_tokens(fake_model):
+    model = fake_model(("<xml><step>cut off", "max_tokens"))
+
+    assert ke._call_xml("prompt") == "<step>cut off"
+    assert model.calls == 1
+
+
+def test_call_xml_falls_back_to_lenient_extraction(fake_model):
+    unclosed = "<reasoning>...</reasoning><xml><tool>description</tool>"
+    model = fake_model(*[(unclosed, "end_turn")] * (ke._XML_RETRIES + 1))
+
+    assert ke._call_xml("prompt") == "<tool>description</tool>"
+    assert model.calls == ke._XML_RETRIES + 1
+
+
+def test_prompt_examples_close_their_xml_blocks():
+    for prompt in (ke._STEPS_CREATION_PROMPT, ke._GENERAL_TOOL_CREATION_PROMPT):
+        assert prompt.count("<xml>") == prompt.count("</xml>")